@@ -0,0 +1,104 @@
+import json
+from typing import Any, NamedTuple, Optional
+
+# Optional fast JSON codecs: orjson, then msgspec, then the standard library
+try:
+    import orjson
+
+    def loads(data: str | bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import msgspec
+
+        _encoder = msgspec.json.Encoder()
+        _decoder = msgspec.json.Decoder()
+
+        def loads(data: str | bytes) -> Any:
+            return _decoder.decode(data)
+
+        def dumps(obj: Any) -> str:
+            return _encoder.encode(obj).decode()
+
+        JSON_BACKEND = "msgspec"
+    except ImportError:
+        def loads(data: str | bytes) -> Any:
+            return json.loads(data)
+
+        def dumps(obj: Any) -> str:
+            return json.dumps(obj)
+
+        JSON_BACKEND = "json"
+
+
+# Events that are relayed live but never become part of the room drawing history
+TRANSIENT_EVENTS = frozenset({
+    "cursor",
+    "chat",
+    "user_left",
+    "save_snapshot",
+    "restore_snapshot",
+    "get_snapshots",
+    "get_chat_history",
+    "get_region",
+    "webrtc-offer",
+    "webrtc-answer",
+    "webrtc-candidate",
+})
+
+
+# History records that tombstone or revive an earlier record, named by its seq in their target field
+UNDO_EVENTS = frozenset({"undo", "redo"})
+
+
+class EventRecord(NamedTuple):
+    """A history event classified once on ingest: sequence number, type, raw JSON text and author"""
+    seq: int
+    type: Optional[str]
+    raw: str
+    author: Optional[str] = None
+
+
+def parse_event(message: str | bytes) -> tuple[Optional[dict], Optional[str]]:
+    """Decode an inbound message once, returning (event, event_type)"""
+    try:
+        event = loads(message)
+    except Exception:
+        return None, None
+    if not isinstance(event, dict):
+        return None, None
+    return event, event.get("type")
+
+
+def is_history_event(event_type: Optional[str]) -> bool:
+    return event_type is not None and event_type not in TRANSIENT_EVENTS
+
+
+def _splice(raw: str, field: str) -> str:
+    body = raw.rstrip()[:-1].rstrip()
+    separator = '' if body.endswith('{') else ','
+    return f'{body}{separator}{field}}}'
+
+
+def with_seq(raw: str, seq: int) -> str:
+    """Splice a seq field into the JSON object text of an event, without re-encoding it"""
+    return _splice(raw, f'"seq":{seq}')
+
+
+def with_author(raw: str, author: str) -> str:
+    """Splice the sender's username into an event; as the last key it wins over any author the client sent"""
+    return _splice(raw, f'"author":{dumps(author)}')
+
+
+def event_author(raw: str) -> Optional[str]:
+    """The author spliced into a logged event, if any"""
+    try:
+        author = loads(raw).get("author")
+    except Exception:
+        return None
+    return author if isinstance(author, str) else None
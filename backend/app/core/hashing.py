@@ -0,0 +1,79 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+from passlib.context import CryptContext
+from app.core.config import settings
+from app.core.logger import logger
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes already waiting; the caller should retry later"""
+
+
+class PasswordHasher:
+    """Runs bcrypt in a small dedicated thread pool so hashing never blocks the event loop"""
+
+    def __init__(self, workers: int = settings.PASSWORD_HASH_WORKERS, max_waiting: int = settings.PASSWORD_HASH_MAX_WAITING):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        # Created on first use, so the app can shut down and start again in one process
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self.waiting = 0
+        self.metrics: Dict[str, int] = {
+            "completed": 0,
+            "rejected": 0,
+            "max_waiting": 0,
+            "wait_ms": 0,
+            "hash_ms": 0,
+        }
+
+    async def _run(self, fn: Callable, *args):
+        if self.waiting >= self.max_waiting:
+            self.metrics["rejected"] += 1
+            logger.warning(f"Password hashing overloaded ({self.waiting} waiting), rejecting request")
+            raise PasswordHasherBusy()
+
+        if self._executor is None:
+            # bcrypt releases the GIL, so a few threads hash in parallel with the loop
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            self._slots = asyncio.Semaphore(self.workers)
+        executor, slots = self._executor, self._slots
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        self.metrics["max_waiting"] = max(self.metrics["max_waiting"], self.waiting)
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.metrics["wait_ms"] += round((started - queued) * 1000)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            slots.release()
+            self.metrics["completed"] += 1
+            self.metrics["hash_ms"] += round((time.perf_counter() - started) * 1000)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    def get_metrics(self) -> dict:
+        return {**self.metrics, "workers": self.workers, "waiting": self.waiting}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._slots = None
+
+
+password_hasher = PasswordHasher()
@@ -1,7 +1,12 @@
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
+from fastapi import HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from app.core.config import settings
+from app.core.logger import logger
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
 
@@ -16,12 +21,68 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
+class TokenCache:
+    """Bounded LRU of verified tokens to (username, exp); entries stop matching once the token expires"""
+
+    def __init__(self, max_entries: int = settings.TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict()
+        self.metrics: Dict[str, int] = {"hits": 0, "misses": 0, "rejected": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[str]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        username, expires = entry
+        if expires is not None and expires <= time.time():
+            del self._entries[token]
+            return None
+        self._entries.move_to_end(token)
+        return username
+
+    def put(self, token: str, username: str, expires: Optional[float]):
+        if self.max_entries <= 0:
+            return
+        self._entries[token] = (username, expires)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+token_cache = TokenCache()
+
+
 def verify_token(token: str):
+    username = token_cache.get(token)
+    if username is not None:
+        token_cache.metrics["hits"] += 1
+        return username
+    token_cache.metrics["misses"] += 1
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
+            token_cache.metrics["rejected"] += 1
             return None
+        # Only tokens that verified are cached, so garbage can't push out real sessions
+        token_cache.put(token, username, payload.get("exp"))
         return username
     except JWTError:
+        token_cache.metrics["rejected"] += 1
         return None
+
+
+async def get_current_username(request: Request) -> str:
+    """FastAPI dependency returning the username from the request's Bearer token, else a 401"""
+    authorization = request.headers.get("Authorization")
+    if not authorization or not authorization.startswith("Bearer "):
+        logger.warning(f"{request.method} {request.url.path} rejected: No authentication token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication required")
+
+    username = verify_token(authorization[len("Bearer "):])
+    if not username:
+        logger.warning(f"{request.method} {request.url.path} rejected: Invalid token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    return username
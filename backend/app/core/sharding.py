@@ -0,0 +1,21 @@
+import zlib
+from app.core.config import settings
+
+
+def shard_for_room(room_id: str, shard_count: int = None) -> int:
+    """Stable room -> shard mapping (crc32, so every process agrees without coordination)"""
+    shard_count = shard_count or settings.SHARD_COUNT
+    return zlib.crc32(room_id.encode()) % shard_count
+
+
+def owns_room(room_id: str) -> bool:
+    """Whether this process serves the room's WebSocket traffic"""
+    return settings.SHARD_COUNT <= 1 or shard_for_room(room_id) == settings.SHARD_INDEX
+
+
+def shard_url(shard_index: int) -> str:
+    """Public WebSocket base URL of a shard"""
+    return settings.SHARD_URL_TEMPLATE.format(
+        index=shard_index,
+        port=settings.SHARD_BASE_PORT + shard_index
+    )
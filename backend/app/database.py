@@ -1,12 +1,101 @@
+import time
+from typing import Dict, Optional
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, Float, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.sql import func
 from app.core.config import settings
 
 
-engine = create_async_engine(settings.DATABASE_URL, echo=settings.DEBUG)
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a free connection"""
+
+    # Kept on the class so the counts survive the pool being recreated by engine.dispose()
+    checkout_metrics: Dict[str, float] = {"checkouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0, "timeouts": 0}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.checkout_metrics["timeouts"] += 1
+            raise
+        finally:
+            waited = (time.perf_counter() - started) * 1000
+            self.checkout_metrics["checkouts"] += 1
+            self.checkout_metrics["wait_ms_total"] += waited
+            self.checkout_metrics["wait_ms_max"] = max(self.checkout_metrics["wait_ms_max"], waited)
+
+
+def _engine_options(url: str) -> dict:
+    options = {
+        "echo": settings.DEBUG,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_recycle": settings.DB_POOL_RECYCLE_S,
+    }
+    # In-memory SQLite lives in a single connection, so it keeps its default static pool
+    if ":memory:" not in url:
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_S,
+        )
+    if "+asyncpg" in url:
+        options["connect_args"] = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+engine = create_async_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def get_pool_metrics() -> dict:
+    pool = engine.pool
+    metrics = {"class": type(pool).__name__}
+    if isinstance(pool, TimedQueuePool):
+        checkouts = pool.checkout_metrics["checkouts"]
+        metrics.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            **pool.checkout_metrics,
+            wait_ms_avg=pool.checkout_metrics["wait_ms_total"] / checkouts if checkouts else 0.0,
+        )
+    return metrics
+
+
+class UnitOfWork:
+    """One session shared by everything a single inbound event does, opened only if it touches the DB
+
+    Call release() once the event is done with the DB but still has other things to await, so a
+    read doesn't keep its connection idle in transaction meanwhile.
+    """
+
+    def __init__(self):
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def session(self) -> AsyncSession:
+        # Creating the session is cheap; a connection is checked out on its first query
+        if self._session is None:
+            self._session = AsyncSessionLocal()
+        return self._session
+
+    async def release(self):
+        """End the session's transaction and return its connection to the pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "UnitOfWork":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.release()
+
+
 Base = declarative_base()
 
 
@@ -42,6 +131,21 @@ class RoomHistory(Base):
     history_json = Column(Text)
 
 
+# Append-only drawing event log, folded into RoomHistory on compaction
+class RoomEvent(Base):
+    __tablename__ = "room_events"
+    id = Column(Integer, primary_key=True, index=True)
+    room_id = Column(String, index=True)
+    seq = Column(Integer, nullable=False)
+    event_type = Column(String)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_room_event_room_seq', 'room_id', 'seq'),
+    )
+
+
 # Snapshot/Version per room
 class Snapshot(Base):
     __tablename__ = 'snapshots'
@@ -56,6 +160,28 @@ class Snapshot(Base):
     )
 
 
+# Content-addressed, compressed snapshot piece shared by every snapshot containing it
+class SnapshotChunk(Base):
+    __tablename__ = "snapshot_chunks"
+    hash = Column(String(64), primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)
+    last_used = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+# Position of a chunk within a snapshot
+class SnapshotChunkRef(Base):
+    __tablename__ = "snapshot_chunk_refs"
+    id = Column(Integer, primary_key=True, index=True)
+    snapshot_id = Column(Integer, ForeignKey("snapshots.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    hash = Column(String(64), nullable=False, index=True)
+
+    __table_args__ = (
+        Index('idx_snapshot_chunk_ref_position', 'snapshot_id', 'position'),
+    )
+
+
 # ChatMessage table for chat box feature
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
@@ -1,10 +1,13 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Path, Request, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Path, Request, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from app.websocket.manager import ConnectionManager
 from app.database import engine, Base, AsyncSessionLocal
-from app.core.security import verify_token
+from app.core.hashing import password_hasher
+from app.core.security import get_current_username, verify_token
 from app.core.config import settings
+from app.core.sharding import owns_room, shard_for_room, shard_url
+from app.services.canvas_service import CanvasService
 from app.services.room_service import RoomService
 from app.core.logger import logger
 
@@ -27,12 +30,15 @@ app.add_middleware(
 async def on_startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await manager.start()
     logger.info(f"{settings.APP_NAME} v{settings.APP_VERSION} started successfully")
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
     logger.info(f"{settings.APP_NAME} shutting down")
+    await manager.shutdown()
+    password_hasher.shutdown()
 
 
 @app.get("/")
@@ -43,9 +49,24 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for background workers"""
+    return {**manager.get_metrics(), "password_hashing": password_hasher.get_metrics()}
+
+
 # --- WEBSOCKET ENDPOINT WITH USERNAME (JWT) EXTRACTION ---
 @app.websocket("/ws/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str = Path(...)):
+    # Every socket of a room lands on its shard, so drawing never takes a hop between processes
+    if not owns_room(room_id):
+        # Accept first so the client actually receives the close code and owning shard URL
+        shard = shard_for_room(room_id)
+        logger.debug(f"Redirecting room {room_id} to shard {shard}")
+        await websocket.accept()
+        await websocket.close(code=4009, reason=shard_url(shard))
+        return
+
     token = websocket.query_params.get("token") or websocket.headers.get("Authorization")
     if not token:
         logger.warning(f"WebSocket connection rejected: No token provided for room {room_id}")
@@ -65,13 +86,35 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str = Path(...)):
         await websocket.close(code=4003)
         return
 
-    await manager.connect(websocket, room_id, username=username)
+    # ?encoding=deflate asks for the init frame as pre-compressed raw-deflate bytes
+    compress_init = websocket.query_params.get("encoding") == "deflate"
+    # ?protocol=binary opts in to compact binary stroke frames (see app/websocket/codec.py)
+    binary = websocket.query_params.get("protocol") == "binary"
+    # ?since=<seq> on reconnect asks for only the history events after the last one seen
+    since = websocket.query_params.get("since")
+    since = int(since) if since and since.isdigit() else None
+    # ?render=tiles asks for the server-rendered canvas as PNG tiles instead of the vector history
+    tiles = websocket.query_params.get("render") == "tiles"
+    await manager.connect(
+        websocket,
+        room_id,
+        username=username,
+        compress_init=compress_init,
+        binary=binary,
+        since=since,
+        tiles=tiles
+    )
     
     try:
         while True:
             try:
-                data = await websocket.receive_text()
-                await manager.broadcast(data, room_id, username=username, sender_ws=websocket)
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                if message.get("bytes") is not None:
+                    await manager.broadcast_binary(message["bytes"], room_id, username=username)
+                else:
+                    await manager.broadcast(message["text"], room_id, username=username, sender_ws=websocket)
             except WebSocketDisconnect:
                 logger.debug(f"WebSocket disconnect detected for {username} in room {room_id}")
                 break  
@@ -106,27 +149,24 @@ async def list_rooms():
         return {"rooms": rooms}
 
 
+@app.get('/rooms/{room_name}/shard')
+async def get_room_shard(room_name: str):
+    """Which shard process serves the room's WebSocket"""
+    shard = shard_for_room(room_name) if settings.SHARD_COUNT > 1 else 0
+    return {"room": room_name, "shard": shard, "url": shard_url(shard)}
+
+
+@app.get('/rooms/{room_name}/chat')
+async def get_older_chat(room_name: str, before: int, username: str = Depends(get_current_username)):
+    """Chat messages older than message before, for scrolling back past the join backlog"""
+    async with AsyncSessionLocal() as session:
+        messages, next_before = await CanvasService.get_chat_page(session, room_name, before)
+    return {"room": room_name, "messages": messages, "before": before, "next_before": next_before}
+
+
 @app.post('/rooms', status_code=status.HTTP_201_CREATED)
-async def create_room(request: Request):
+async def create_room(request: Request, username: str = Depends(get_current_username)):
     """Create a new room using RoomService"""
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        logger.warning("Room creation rejected: No authentication token")
-        return JSONResponse(
-            {"detail": "Authentication required"},
-            status_code=status.HTTP_401_UNAUTHORIZED
-        )
-    token = token.replace("Bearer ", "")
-    
-    try:
-        username = verify_token(token)
-        if not username:
-            logger.warning("Room creation rejected: Invalid token")
-            return JSONResponse({"detail": "Invalid token"}, status_code=401)
-    except Exception:
-        logger.warning("Room creation rejected: Token verification failed")
-        return JSONResponse({"detail": "Invalid token"}, status_code=401)
-
     data = await request.json()
     room_name = data.get("room")
     
@@ -140,40 +180,21 @@ async def create_room(request: Request):
 
 
 @app.delete('/rooms/{room_name}')
-async def delete_room(room_name: str, request: Request):
+async def delete_room(room_name: str, username: str = Depends(get_current_username)):
     """Delete a room using RoomService"""
-    token = request.headers.get("Authorization")
-    if not token or not token.startswith("Bearer "):
-        logger.warning(f"Room deletion rejected: No authentication token for room {room_name}")
-        return JSONResponse(
-            {"detail": "Authentication required"},
-            status_code=status.HTTP_401_UNAUTHORIZED
-        )
-    token = token.replace("Bearer ", "")
-    
-    try:
-        username = verify_token(token)
-        if not username:
-            logger.warning(f"Room deletion rejected: Invalid token for room {room_name}")
-            return JSONResponse({"detail": "Invalid token"}, status_code=401)
-    except Exception:
-        logger.warning(f"Room deletion rejected: Token verification failed for room {room_name}")
-        return JSONResponse({"detail": "Invalid token"}, status_code=401)
-
     async with AsyncSessionLocal() as session:
-        room = await RoomService.get_room_by_name(session, room_name)
-        if not room:
+        exists = await RoomService.room_exists(session, room_name)
+        if not exists:
             logger.warning(f"Room deletion failed: Room {room_name} not found")
             return JSONResponse({"detail": "Room not found"}, status_code=404)
         
+        # Served from the room cache filled by the lookup above
         is_admin = await RoomService.is_room_admin(session, room_name, username)
         if not is_admin:
             logger.warning(f"Room deletion rejected: User {username} is not admin of room {room_name}")
             return JSONResponse({"detail": "Only admin can delete room"}, status_code=403)
-        
-        await RoomService.delete_room(session, room_name)
-    
-    await manager.delete_room(room_name)
+
+        await manager.delete_room(room_name, session)
     logger.info(f"Room {room_name} deleted by admin {username}")
     return {"success": True, "detail": "Room deleted"}
 
@@ -1,61 +1,260 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List, Optional
+from sqlalchemy import and_, insert, or_
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 from datetime import datetime
-import json
-from app.database import RoomHistory, ChatMessage
+from app.database import RoomHistory, RoomEvent, ChatMessage, Snapshot
+from app.services.snapshot_service import CHECKPOINT_SNAPSHOT_OWNER, SnapshotService
+from app.core.config import settings
+from app.core.events import UNDO_EVENTS, EventRecord, loads, dumps, event_author, is_history_event, with_seq
 from app.core.logger import logger
 
+# Checkpoint base argument meaning "keep whatever base layer is stored"
+BASE_UNCHANGED = object()
+
+
+def parse_chat_timestamp(timestamp: Any) -> datetime:
+    """Client chat timestamp (ISO string, possibly Z-suffixed) as a datetime, now if missing or invalid"""
+    if isinstance(timestamp, datetime):
+        return timestamp
+    if isinstance(timestamp, str):
+        try:
+            return datetime.fromisoformat(timestamp[:-1] + '+00:00' if timestamp.endswith('Z') else timestamp)
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+
+def chat_entry(username: str, message: str, timestamp: datetime, chat_id: int = None) -> dict:
+    return {"id": chat_id, "username": username, "message": message, "timestamp": str(timestamp)}
+
+
+class ChatTail:
+    """Last MAX_CHAT_HISTORY chat messages per room, so recent chat is served without a query"""
+
+    def __init__(self, size: int = settings.MAX_CHAT_HISTORY):
+        self.size = size
+        # Oldest first; ids are filled in once the write-behind flush has inserted a message
+        self.rooms: Dict[str, Deque[dict]] = {}
+        # Rooms whose tail was merged with the table; the others only hold messages seen since startup
+        self.loaded: Set[str] = set()
+        self.metrics: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def add(self, room_id: str, entry: dict):
+        if self.size <= 0:
+            return
+        if room_id not in self.rooms:
+            self.rooms[room_id] = deque(maxlen=self.size)
+        self.rooms[room_id].append(entry)
+
+    def add_remote(self, room_id: str, entry: dict):
+        """A message another node persists; only tails already merged with the table take it"""
+        if room_id in self.loaded:
+            self.rooms[room_id].append(entry)
+
+    def get(self, room_id: str, limit: int) -> Optional[List[dict]]:
+        if room_id not in self.loaded or limit > self.size:
+            self.metrics["misses"] += 1
+            return None
+        self.metrics["hits"] += 1
+        entries = list(self.rooms[room_id])
+        return entries[-limit:] if limit > 0 else []
+
+    def fill(self, room_id: str, rows: List[dict]) -> List[dict]:
+        """Merge the newest rows from the table with messages still waiting to be written"""
+        stored = {row["id"] for row in rows}
+        pending = [entry for entry in self.rooms.get(room_id, ()) if entry["id"] not in stored]
+        merged = rows + pending
+        if self.size > 0:
+            self.rooms[room_id] = deque(merged, maxlen=self.size)
+            self.loaded.add(room_id)
+        return merged
+
+    def discard(self, room_id: str):
+        self.rooms.pop(room_id, None)
+        self.loaded.discard(room_id)
+
+
+chat_tail = ChatTail()
+
 
 class CanvasService:
     """Service class for canvas drawing history and chat operations"""
     
     @staticmethod
-    async def save_room_history(db: AsyncSession, room_id: str, events: List[str]) -> bool:
-        """Save or update room drawing history"""
-        try:
-            result = await db.execute(
-                select(RoomHistory).where(RoomHistory.room_id == room_id)
+    async def _write_checkpoint(
+        db: AsyncSession,
+        room_id: str,
+        events: List[EventRecord],
+        seq: int,
+        base: Any = BASE_UNCHANGED
+    ):
+        """Stage a checkpoint upsert and log truncation without committing
+
+        base is a (base_seq, PNG data URL) pair for a new base layer, None to drop
+        the stored one, or BASE_UNCHANGED to keep it.
+        """
+        result = await db.execute(
+            select(RoomHistory).where(RoomHistory.room_id == room_id)
+        )
+        room_history = result.scalars().first()
+        # Records are stored as [seq, type, raw] so loading never re-parses event payloads
+        checkpoint: Dict[str, Any] = {"seq": seq, "events": [list(record) for record in events]}
+
+        if base is BASE_UNCHANGED:
+            if room_history and room_history.history_json and '"base_id"' in room_history.history_json:
+                previous = loads(room_history.history_json)
+                checkpoint["base_id"] = previous["base_id"]
+                checkpoint["base_seq"] = previous["base_seq"]
+        else:
+            # The base layer lives in the Snapshot table; only the latest one per room is kept
+            await SnapshotService.stage_snapshot_delete(
+                db,
+                Snapshot.room_id == room_id,
+                Snapshot.saved_by == CHECKPOINT_SNAPSHOT_OWNER
             )
-            room_history = result.scalars().first()
-            
-            if room_history:
-                room_history.history_json = json.dumps(events)
-                logger.debug(f"Updated history for room {room_id} ({len(events)} events)")
-            else:
-                room_history = RoomHistory(
-                    room_id=room_id,
-                    history_json=json.dumps(events)
-                )
-                db.add(room_history)
-                logger.debug(f"Created new history for room {room_id} ({len(events)} events)")
-            
+            if base is not None:
+                # Chunked like user snapshots, so base tiles that didn't change are stored once
+                base_seq, data = base
+                snapshot = await SnapshotService.stage_snapshot(db, room_id, data, CHECKPOINT_SNAPSHOT_OWNER)
+                checkpoint["base_id"] = snapshot.id
+                checkpoint["base_seq"] = base_seq
+        history_json = dumps(checkpoint)
+
+        if room_history:
+            room_history.history_json = history_json
+        else:
+            db.add(RoomHistory(room_id=room_id, history_json=history_json))
+
+        await db.execute(
+            RoomEvent.__table__.delete().where(
+                RoomEvent.room_id == room_id,
+                RoomEvent.seq <= seq
+            )
+        )
+
+    @staticmethod
+    async def write_event_batch(
+        db: AsyncSession,
+        events: List[Dict[str, Any]],
+        checkpoints: Dict[str, Tuple[int, List[EventRecord], Any]],
+        chats: List[Tuple[str, datetime, dict]] = ()
+    ) -> bool:
+        """Insert logged events and chat messages for any number of rooms and apply checkpoints in one commit"""
+        try:
+            if events:
+                await db.execute(insert(RoomEvent), events)
+            if chats:
+                await CanvasService._insert_chat_messages(db, chats)
+            for room_id, (seq, room_events, base) in checkpoints.items():
+                await CanvasService._write_checkpoint(db, room_id, room_events, seq, base)
             await db.commit()
+            logger.debug(f"Committed {len(events)} events, {len(chats)} chat messages and {len(checkpoints)} checkpoints")
             return True
         except Exception as e:
-            logger.error(f"Error saving room history for {room_id}: {e}", exc_info=True)
+            logger.error(f"Error writing event batch: {e}", exc_info=True)
             await db.rollback()
             return False
-    
+
     @staticmethod
-    async def load_room_history(db: AsyncSession, room_id: str) -> List[str]:
-        """Load drawing history for a room"""
+    async def save_room_checkpoint(db: AsyncSession, room_id: str, events: List[EventRecord], seq: int) -> bool:
+        """Fold the room history up to seq into RoomHistory and truncate the event log"""
+        try:
+            await CanvasService._write_checkpoint(db, room_id, events, seq)
+            await db.commit()
+            logger.debug(f"Checkpointed room {room_id} at seq {seq} ({len(events)} events)")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving checkpoint for room {room_id}: {e}", exc_info=True)
+            await db.rollback()
+            return False
+
+    @staticmethod
+    async def load_room_history(
+        db: AsyncSession,
+        room_id: str,
+        compact: bool = True
+    ) -> Tuple[List[EventRecord], int, Optional[Tuple[int, str]]]:
+        """Load drawing history as (records, last seq, (base_seq, base image) or None), compacting any log tail
+
+        Only the node that owns the room's history compacts; other nodes just read it.
+        """
         try:
             result = await db.execute(
                 select(RoomHistory).where(RoomHistory.room_id == room_id)
             )
             room_history = result.scalars().first()
-            
+
+            events: List[EventRecord] = []
+            checkpoint_seq = 0
+            legacy = 0
+            base = None
             if room_history and room_history.history_json:
-                events = json.loads(room_history.history_json)
-                logger.debug(f"Loaded history for room {room_id} ({len(events)} events)")
-                return events
-            logger.debug(f"No history found for room {room_id}")
-            return []
+                checkpoint = loads(room_history.history_json)
+                # Rows written before the event log existed hold a bare list
+                if isinstance(checkpoint, list):
+                    checkpoint = {"seq": 0, "events": checkpoint}
+                checkpoint_seq = checkpoint.get("seq", 0)
+                for entry in checkpoint.get("events", []):
+                    if isinstance(entry, str):
+                        # Older checkpoints stored raw strings; classify them once here
+                        event_type = loads(entry).get("type")
+                        if is_history_event(event_type):
+                            # They carry no seq; number them in order so every record has its own
+                            legacy += 1
+                            events.append(EventRecord(legacy, event_type, with_seq(entry, legacy)))
+                    else:
+                        events.append(EventRecord(*entry))
+                if checkpoint.get("base_id"):
+                    result = await db.execute(
+                        select(Snapshot.data).where(Snapshot.id == checkpoint["base_id"])
+                    )
+                    base_data = result.scalar()
+                    if base_data:
+                        base_data = await SnapshotService.resolve_snapshot_data(db, checkpoint["base_id"], base_data)
+                        base = (checkpoint["base_seq"], base_data)
+
+            result = await db.execute(
+                select(RoomEvent.seq, RoomEvent.event_type, RoomEvent.payload)
+                .where(RoomEvent.room_id == room_id, RoomEvent.seq > checkpoint_seq)
+                .order_by(RoomEvent.seq, RoomEvent.id)
+            )
+            tail = result.all()
+            # The log tail moves up past the renumbered legacy records
+            offset = max(0, legacy - checkpoint_seq)
+            last_seq = (tail[-1].seq if tail else checkpoint_seq) + offset
+            # Not trimmed here: the in-memory history folds whatever overflows into its base layer
+            events.extend(
+                EventRecord(row.seq + offset, row.event_type, CanvasService._shift_seq(row.payload, offset), event_author(row.payload))
+                for row in tail
+            )
+
+            if compact and (tail or legacy):
+                # Renumbered records are checkpointed right away, so later loads and log rows agree on seqs
+                await CanvasService.save_room_checkpoint(db, room_id, events, last_seq)
+
+            logger.debug(f"Loaded history for room {room_id} ({len(events)} events, seq {last_seq})")
+            return events, last_seq, base
         except Exception as e:
             logger.error(f"Error loading room history for {room_id}: {e}", exc_info=True)
-            return []
-    
+            return [], 0, None
+
+    @staticmethod
+    def _shift_seq(raw: str, offset: int) -> str:
+        """Move a logged event's seq, and an undo record's target, up by offset"""
+        if not offset:
+            return raw
+        event = loads(raw)
+        if isinstance(event.get("seq"), int):
+            event["seq"] += offset
+        if event.get("type") in UNDO_EVENTS and isinstance(event.get("target"), int):
+            event["target"] += offset
+        return dumps(event)
+
     @staticmethod
     async def clear_room_history(db: AsyncSession, room_id: str) -> bool:
         """Clear drawing history for a room"""
@@ -63,6 +262,9 @@ class CanvasService:
             await db.execute(
                 RoomHistory.__table__.delete().where(RoomHistory.room_id == room_id)
             )
+            await db.execute(
+                RoomEvent.__table__.delete().where(RoomEvent.room_id == room_id)
+            )
             await db.commit()
             logger.info(f"Cleared history for room {room_id}")
             return True
@@ -71,6 +273,28 @@ class CanvasService:
             await db.rollback()
             return False
     
+    @staticmethod
+    async def _insert_chat_messages(db: AsyncSession, chats: List[Tuple[str, datetime, dict]]):
+        """Stage one multi-row insert of (room_id, timestamp, tail entry) items and fill in the entries' ids"""
+        result = await db.execute(
+            insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+            [
+                {"room_id": room_id, "username": entry["username"], "message": entry["message"], "timestamp": timestamp}
+                for room_id, timestamp, entry in chats
+            ]
+        )
+        # Rows go in queue order, so ids keep each room's messages in the order they arrived
+        for (_, _, entry), chat_id in zip(chats, result.scalars().all()):
+            entry["id"] = chat_id
+
+    @staticmethod
+    def record_chat_message(room_id: str, username: str, message: str, timestamp: Any) -> Tuple[str, datetime, dict]:
+        """Add a chat message to the room's tail, returning the item to queue for the write-behind insert"""
+        timestamp = parse_chat_timestamp(timestamp)
+        entry = chat_entry(username, message, timestamp)
+        chat_tail.add(room_id, entry)
+        return room_id, timestamp, entry
+
     @staticmethod
     async def save_chat_message(
         db: AsyncSession,
@@ -81,20 +305,8 @@ class CanvasService:
     ) -> bool:
         """Save a chat message to database"""
         try:
-            # Handle timestamp conversion if it's a string
-            if isinstance(timestamp, str):
-                if timestamp.endswith('Z'):
-                    timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                else:
-                    timestamp = datetime.fromisoformat(timestamp)
-            
-            chat_msg = ChatMessage(
-                room_id=room_id,
-                username=username,
-                message=message,
-                timestamp=timestamp
-            )
-            db.add(chat_msg)
+            item = CanvasService.record_chat_message(room_id, username, message, timestamp)
+            await CanvasService._insert_chat_messages(db, [item])
             await db.commit()
             logger.debug(f"Chat message saved in room {room_id} by {username}")
             return True
@@ -107,31 +319,63 @@ class CanvasService:
     async def get_chat_history(
         db: AsyncSession,
         room_id: str,
-        limit: int = 100
+        limit: int = settings.MAX_CHAT_HISTORY,
+        before: Optional[int] = None
     ) -> List[dict]:
-        """Get chat message history for a room"""
+        """Get chat message history for a room, oldest first, optionally only messages older than message before"""
+        if before is None:
+            cached = chat_tail.get(room_id, limit)
+            if cached is not None:
+                return cached
         try:
+            query = select(ChatMessage).where(ChatMessage.room_id == room_id)
+            if before is not None:
+                # Keyset page on idx_chat_room_timestamp, with the id breaking timestamp ties
+                anchor = select(ChatMessage.timestamp).where(ChatMessage.id == before).scalar_subquery()
+                query = query.where(or_(
+                    ChatMessage.timestamp < anchor,
+                    and_(ChatMessage.timestamp == anchor, ChatMessage.id < before)
+                ))
             result = await db.execute(
-                select(ChatMessage)
-                .where(ChatMessage.room_id == room_id)
-                .order_by(ChatMessage.timestamp.desc())
-                .limit(limit)
+                query
+                .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+                # The newest page reads a full tail's worth, so the tail can answer later reads of any size up to it
+                .limit(limit if before is not None else max(limit, chat_tail.size))
             )
             messages = result.scalars().all()
-            
-            chat_history = [
-                {
-                    "username": msg.username,
-                    "message": msg.message,
-                    "timestamp": str(msg.timestamp)
-                }
-                for msg in reversed(messages)
-            ]
+
+            chat_history = [chat_entry(msg.username, msg.message, msg.timestamp, msg.id) for msg in reversed(messages)]
+            if before is None:
+                chat_history = chat_tail.fill(room_id, chat_history)[-limit:] if limit > 0 else []
             logger.debug(f"Retrieved {len(chat_history)} chat messages for room {room_id}")
             return chat_history
         except Exception as e:
             logger.error(f"Error getting chat history for room {room_id}: {e}", exc_info=True)
             return []
+
+    @staticmethod
+    async def get_chat_page(
+        db: AsyncSession,
+        room_id: str,
+        before: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[List[dict], Optional[int]]:
+        """(messages oldest first, id to pass as before for the next older page)"""
+        if before is None:
+            limit = limit or settings.MAX_CHAT_HISTORY
+            messages = await CanvasService.get_chat_history(db, room_id, limit)
+            # Served from the chat tail, so older messages are assumed to exist whenever the page is full
+            more = len(messages) >= limit
+        else:
+            limit = limit or settings.CHAT_PAGE_SIZE
+            # One extra row tells whether an older page exists
+            messages = await CanvasService.get_chat_history(db, room_id, limit + 1, before)
+            more = len(messages) > limit
+            messages = messages[-limit:]
+        if not more:
+            return messages, None
+        # Messages still queued for the write-behind insert, or persisted by another node, have no id yet
+        return messages, next((message["id"] for message in messages if message["id"] is not None), None)
     
     @staticmethod
     async def delete_room_data(db: AsyncSession, room_id: str) -> bool:
@@ -140,10 +384,14 @@ class CanvasService:
             await db.execute(
                 RoomHistory.__table__.delete().where(RoomHistory.room_id == room_id)
             )
+            await db.execute(
+                RoomEvent.__table__.delete().where(RoomEvent.room_id == room_id)
+            )
             await db.execute(
                 ChatMessage.__table__.delete().where(ChatMessage.room_id == room_id)
             )
             await db.commit()
+            chat_tail.discard(room_id)
             logger.info(f"Deleted all canvas data for room {room_id}")
             return True
         except Exception as e:
@@ -1,10 +1,57 @@
+import time
+from collections import OrderedDict
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List, Dict, Any
-from app.database import Room, RoomHistory, Snapshot, ChatMessage
+from typing import List, Dict, Any, NamedTuple, Optional
+from app.database import Room, RoomHistory, RoomEvent, Snapshot, ChatMessage
+from app.services.snapshot_service import SnapshotService
+from app.core.config import settings
 from app.core.logger import logger
 
 
+class RoomInfo(NamedTuple):
+    exists: bool
+    admin_username: Optional[str] = None
+
+
+class RoomCache:
+    """Per-process lookups of existing rooms with a TTL, updated on create and delete"""
+
+    def __init__(self, ttl_s: int = settings.ROOM_CACHE_TTL_S, max_entries: int = settings.ROOM_CACHE_MAX_ENTRIES):
+        self.ttl = ttl_s
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.metrics: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, room_name: str) -> Optional[RoomInfo]:
+        entry = self._entries.get(room_name)
+        if entry is None or entry[0] < time.monotonic():
+            self.metrics["misses"] += 1
+            return None
+        self._entries.move_to_end(room_name)
+        self.metrics["hits"] += 1
+        return entry[1]
+
+    def put(self, room_name: str, info: RoomInfo):
+        # Misses are never cached: a room created by another process must be found at once
+        if self.ttl <= 0 or not info.exists:
+            self.invalidate(room_name)
+            return
+        self._entries[room_name] = (time.monotonic() + self.ttl, info)
+        self._entries.move_to_end(room_name)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, room_name: str):
+        self._entries.pop(room_name, None)
+
+
+room_cache = RoomCache()
+
+
 class RoomService:
     """Service class for room-related operations"""
     
@@ -21,12 +68,28 @@ class RoomService:
             logger.error(f"Error fetching room {room_name}: {e}", exc_info=True)
             return None
     
+    @staticmethod
+    async def get_room_info(db: AsyncSession, room_name: str) -> RoomInfo | None:
+        """Whether a room exists and who its admin is, from the room cache when fresh; None on error"""
+        info = room_cache.get(room_name)
+        if info is not None:
+            return info
+        try:
+            result = await db.execute(select(Room.admin_username).where(Room.name == room_name))
+            row = result.first()
+            info = RoomInfo(True, row.admin_username) if row else RoomInfo(False)
+            room_cache.put(room_name, info)
+            return info
+        except Exception as e:
+            logger.error(f"Error fetching room {room_name}: {e}", exc_info=True)
+            return None
+    
     @staticmethod
     async def create_room(db: AsyncSession, room_name: str, admin_username: str) -> Room | None:
         """Create a new room with specified admin"""
         try:
-            existing_room = await RoomService.get_room_by_name(db, room_name)
-            if existing_room:
+            existing_room = await RoomService.get_room_info(db, room_name)
+            if existing_room is None or existing_room.exists:
                 logger.warning(f"Room creation failed: Room already exists - {room_name}")
                 return None
             
@@ -34,11 +97,14 @@ class RoomService:
             db.add(new_room)
             await db.commit()
             await db.refresh(new_room)
+            room_cache.put(room_name, RoomInfo(True, admin_username))
             logger.info(f"Room created: {room_name} by admin {admin_username}")
             return new_room
         except Exception as e:
             logger.error(f"Error creating room {room_name}: {e}", exc_info=True)
             await db.rollback()
+            # E.g. another process created it meanwhile; look it up again next time
+            room_cache.invalidate(room_name)
             return None
     
     @staticmethod
@@ -61,8 +127,8 @@ class RoomService:
     async def is_room_admin(db: AsyncSession, room_name: str, username: str) -> bool:
         """Check if user is admin of the specified room"""
         try:
-            room = await RoomService.get_room_by_name(db, room_name)
-            if not room:
+            room = await RoomService.get_room_info(db, room_name)
+            if not room or not room.exists:
                 logger.warning(f"Admin check failed: Room not found - {room_name}")
                 return False
             
@@ -80,29 +146,32 @@ class RoomService:
     async def delete_room(db: AsyncSession, room_name: str) -> bool:
         """Delete a room and all associated data (snapshots, history, chat)"""
         try:
-            room = await RoomService.get_room_by_name(db, room_name)
-            if not room:
+            room = await RoomService.get_room_info(db, room_name)
+            if not room or not room.exists:
                 logger.warning(f"Room deletion failed: Room not found - {room_name}")
                 return False
             
             # Delete associated data first (foreign key constraints)
-            await db.execute(Snapshot.__table__.delete().where(Snapshot.room_id == room_name))
+            await SnapshotService.stage_snapshot_delete(db, Snapshot.room_id == room_name)
             await db.execute(RoomHistory.__table__.delete().where(RoomHistory.room_id == room_name))
+            await db.execute(RoomEvent.__table__.delete().where(RoomEvent.room_id == room_name))
             await db.execute(ChatMessage.__table__.delete().where(ChatMessage.room_id == room_name))
             
             # Delete the room
             await db.execute(Room.__table__.delete().where(Room.name == room_name))
             await db.commit()
+            room_cache.invalidate(room_name)
             
             logger.info(f"Room deleted successfully: {room_name}")
             return True
         except Exception as e:
             logger.error(f"Error deleting room {room_name}: {e}", exc_info=True)
             await db.rollback()
+            room_cache.invalidate(room_name)
             return False
     
     @staticmethod
     async def room_exists(db: AsyncSession, room_name: str) -> bool:
         """Check if room exists"""
-        room = await RoomService.get_room_by_name(db, room_name)
-        return room is not None
+        room = await RoomService.get_room_info(db, room_name)
+        return room is not None and room.exists
@@ -1,13 +1,104 @@
+import asyncio
+import codecs
+import zlib
+from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List, Dict, Any, Optional
-from app.database import Snapshot
+from sqlalchemy import and_, exists, func, insert, or_, update
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from app.database import Snapshot, SnapshotChunk, SnapshotChunkRef
+from app.services.snapshot_store import (
+    chunk_size, compress_chunk, encode_canvas, is_chunked, join_snapshot,
+    load_manifest, manifest_data, new_canvas, paste_tile, split_snapshot
+)
+from app.core.config import settings
 from app.core.logger import logger
 
+# Snapshot rows written by history compaction as a room's base layer, hidden from user listings
+CHECKPOINT_SNAPSHOT_OWNER = "__checkpoint__"
+
+
+def snapshot_metadata(snapshot) -> Dict[str, Any]:
+    """Listing entry for a Snapshot row, or a row of its metadata columns"""
+    return {
+        "id": snapshot.id,
+        "saved_by": snapshot.saved_by,
+        "created_at": str(snapshot.created_at)
+    }
+
+
+def _insert_ignore(db: AsyncSession, table):
+    """INSERT that skips rows whose key already exists, so concurrent saves of one chunk don't conflict"""
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(table)
+    return dialect_insert(table).on_conflict_do_nothing()
+
 
 class SnapshotService:
     """Service class for canvas snapshot operations"""
-    
+
+    @staticmethod
+    async def stage_snapshot(db: AsyncSession, room_id: str, data: str, saved_by: str) -> Snapshot:
+        """Stage a snapshot as deduplicated chunks without committing"""
+        manifest, hashes, contents = await asyncio.to_thread(split_snapshot, data)
+        unique = list(contents)
+        if unique:
+            # Touch reused chunks first: the row locks keep retention from collecting them before we commit
+            await db.execute(
+                update(SnapshotChunk).where(SnapshotChunk.hash.in_(unique)).values(last_used=func.now())
+            )
+            result = await db.execute(select(SnapshotChunk.hash).where(SnapshotChunk.hash.in_(unique)))
+            stored = set(result.scalars().all())
+            missing = [digest for digest in unique if digest not in stored]
+            if missing:
+                blobs = await asyncio.to_thread(lambda: [compress_chunk(contents[digest]) for digest in missing])
+                await db.execute(
+                    _insert_ignore(db, SnapshotChunk),
+                    [
+                        {"hash": digest, "data": blob, "size": chunk_size(contents[digest])}
+                        for digest, blob in zip(missing, blobs)
+                    ]
+                )
+            logger.debug(f"Snapshot for room {room_id}: {len(hashes)} chunks, {len(missing)} new")
+
+        snapshot = Snapshot(room_id=room_id, saved_by=saved_by, data=manifest_data(manifest))
+        db.add(snapshot)
+        await db.flush()
+        if hashes:
+            await db.execute(
+                insert(SnapshotChunkRef),
+                [{"snapshot_id": snapshot.id, "position": position, "hash": digest} for position, digest in enumerate(hashes)]
+            )
+        return snapshot
+
+    @staticmethod
+    async def resolve_snapshot_data(db: AsyncSession, snapshot_id: int, data: str) -> Optional[str]:
+        """Rebuild a snapshot's data from its chunks; rows from before chunking hold it as is"""
+        if not is_chunked(data):
+            return data
+        result = await db.execute(
+            select(SnapshotChunk.data)
+            .join(SnapshotChunkRef, SnapshotChunkRef.hash == SnapshotChunk.hash)
+            .where(SnapshotChunkRef.snapshot_id == snapshot_id)
+            .order_by(SnapshotChunkRef.position)
+        )
+        return await asyncio.to_thread(join_snapshot, data, result.scalars().all())
+
+    @staticmethod
+    async def stage_snapshot_delete(db: AsyncSession, *criteria):
+        """Stage deleting snapshots and their chunk references; orphaned chunks go in the next retention run"""
+        await db.execute(
+            SnapshotChunkRef.__table__.delete().where(
+                SnapshotChunkRef.snapshot_id.in_(select(Snapshot.id).where(*criteria))
+            )
+        )
+        await db.execute(Snapshot.__table__.delete().where(*criteria))
+
     @staticmethod
     async def save_snapshot(
         db: AsyncSession,
@@ -17,12 +108,7 @@ class SnapshotService:
     ) -> Snapshot | None:
         """Save a new canvas snapshot"""
         try:
-            snapshot = Snapshot(
-                room_id=room_id,
-                saved_by=saved_by,
-                data=snapshot_data
-            )
-            db.add(snapshot)
+            snapshot = await SnapshotService.stage_snapshot(db, room_id, snapshot_data, saved_by)
             await db.commit()
             await db.refresh(snapshot)
             logger.info(f"Snapshot saved for room {room_id} by {saved_by}")
@@ -33,55 +119,110 @@ class SnapshotService:
             return None
     
     @staticmethod
-    async def get_snapshots_by_room(db: AsyncSession, room_id: str) -> List[Dict[str, Any]]:
-        """Get all snapshots for a room, ordered by creation date (newest first)"""
+    async def get_snapshots_by_room(
+        db: AsyncSession,
+        room_id: str,
+        limit: Optional[int] = None,
+        before: Optional[int] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Get snapshot metadata for a room, newest first, optionally only those older than snapshot before"""
         try:
-            result = await db.execute(
-                select(Snapshot)
-                .where(Snapshot.room_id == room_id)
-                .order_by(Snapshot.created_at.desc())
+            # Metadata columns only, so listing never reads snapshot data
+            query = select(Snapshot.id, Snapshot.saved_by, Snapshot.created_at).where(
+                Snapshot.room_id == room_id,
+                Snapshot.saved_by != CHECKPOINT_SNAPSHOT_OWNER
             )
-            snapshots = result.scalars().all()
-            
-            snapshot_list = [
-                {
-                    "id": snap.id,
-                    "saved_by": snap.saved_by,
-                    "created_at": str(snap.created_at)
-                }
-                for snap in snapshots
-            ]
+            if before is not None:
+                # Keyset page on idx_snapshot_room_created, with the id breaking created_at ties
+                anchor = select(Snapshot.created_at).where(Snapshot.id == before).scalar_subquery()
+                query = query.where(or_(
+                    Snapshot.created_at < anchor,
+                    and_(Snapshot.created_at == anchor, Snapshot.id < before)
+                ))
+            query = query.order_by(Snapshot.created_at.desc(), Snapshot.id.desc())
+            if limit is not None:
+                query = query.limit(limit)
+            result = await db.execute(query)
+
+            snapshot_list = [snapshot_metadata(row) for row in result.all()]
             logger.debug(f"Retrieved {len(snapshot_list)} snapshots for room {room_id}")
             return snapshot_list
         except Exception as e:
             logger.error(f"Error getting snapshots for room {room_id}: {e}", exc_info=True)
-            return []
+            return None
     
     @staticmethod
     async def get_snapshot_data(db: AsyncSession, snapshot_id: int) -> Optional[str]:
         """Get the canvas data for a specific snapshot"""
         try:
             result = await db.execute(
-                select(Snapshot).where(Snapshot.id == snapshot_id)
+                select(Snapshot.data).where(Snapshot.id == snapshot_id)
             )
-            snapshot = result.scalars().first()
+            data = result.scalar()
             
-            if snapshot:
+            if data:
                 logger.debug(f"Retrieved snapshot data for snapshot ID {snapshot_id}")
-                return snapshot.data
+                return await SnapshotService.resolve_snapshot_data(db, snapshot_id, data)
             logger.warning(f"Snapshot not found: {snapshot_id}")
             return None
         except Exception as e:
             logger.error(f"Error getting snapshot data for ID {snapshot_id}: {e}", exc_info=True)
             return None
     
+    @staticmethod
+    async def open_snapshot_stream(db: AsyncSession, snapshot_id: int) -> Optional[AsyncIterator[str]]:
+        """Snapshot data as an iterator of string pieces read from the DB chunk by chunk, or None if not found"""
+        try:
+            result = await db.execute(
+                select(Snapshot.data).where(Snapshot.id == snapshot_id)
+            )
+            data = result.scalar()
+        except Exception as e:
+            logger.error(f"Error opening snapshot {snapshot_id}: {e}", exc_info=True)
+            return None
+        if not data:
+            logger.warning(f"Snapshot not found: {snapshot_id}")
+            return None
+        return SnapshotService._stream_snapshot(db, snapshot_id, data)
+
+    @staticmethod
+    async def _stream_snapshot(db: AsyncSession, snapshot_id: int, data: str) -> AsyncIterator[str]:
+        piece_size = settings.SNAPSHOT_CHUNK_SIZE
+        if not is_chunked(data):
+            for start in range(0, len(data), piece_size):
+                yield data[start:start + piece_size]
+            return
+
+        manifest = load_manifest(data)
+        result = await db.stream(
+            select(SnapshotChunk.data)
+            .join(SnapshotChunkRef, SnapshotChunkRef.hash == SnapshotChunk.hash)
+            .where(SnapshotChunkRef.snapshot_id == snapshot_id)
+            .order_by(SnapshotChunkRef.position)
+        )
+        if manifest["kind"] == "bytes":
+            # Chunks were cut on byte boundaries, which may fall inside a UTF-8 character
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            async for blob in result.scalars():
+                yield decoder.decode(zlib.decompress(blob))
+            yield decoder.decode(b"", final=True)
+            return
+
+        # Tiles are pasted as they arrive, so only the canvas and one tile blob are held at a time
+        image = new_canvas(manifest)
+        position = 0
+        async for blob in result.scalars():
+            paste_tile(image, manifest, position, blob)
+            position += 1
+        data = await asyncio.to_thread(encode_canvas, image)
+        for start in range(0, len(data), piece_size):
+            yield data[start:start + piece_size]
+
     @staticmethod
     async def delete_snapshots_by_room(db: AsyncSession, room_id: str) -> bool:
         """Delete all snapshots for a specific room"""
         try:
-            await db.execute(
-                Snapshot.__table__.delete().where(Snapshot.room_id == room_id)
-            )
+            await SnapshotService.stage_snapshot_delete(db, Snapshot.room_id == room_id)
             await db.commit()
             logger.info(f"Deleted all snapshots for room {room_id}")
             return True
@@ -89,3 +230,48 @@ class SnapshotService:
             logger.error(f"Error deleting snapshots for room {room_id}: {e}", exc_info=True)
             await db.rollback()
             return False
+
+    @staticmethod
+    async def prune_snapshots(
+        db: AsyncSession,
+        keep: int = settings.MAX_SNAPSHOTS_PER_ROOM,
+        grace_s: int = settings.SNAPSHOT_CHUNK_GRACE_S
+    ) -> Tuple[int, int]:
+        """Delete all but the newest keep snapshots per room, then unreferenced chunks; returns (snapshots, chunks) removed"""
+        pruned = 0
+        try:
+            if keep > 0:
+                result = await db.execute(
+                    select(Snapshot.room_id)
+                    .where(Snapshot.saved_by != CHECKPOINT_SNAPSHOT_OWNER)
+                    .group_by(Snapshot.room_id)
+                    .having(func.count() > keep)
+                )
+                for room_id in result.scalars().all():
+                    result = await db.execute(
+                        select(Snapshot.id)
+                        .where(Snapshot.room_id == room_id, Snapshot.saved_by != CHECKPOINT_SNAPSHOT_OWNER)
+                        .order_by(Snapshot.created_at.desc(), Snapshot.id.desc())
+                        .offset(keep)
+                    )
+                    stale = result.scalars().all()
+                    await SnapshotService.stage_snapshot_delete(db, Snapshot.id.in_(stale))
+                    await db.commit()
+                    pruned += len(stale)
+                    logger.info(f"Pruned {len(stale)} old snapshots in room {room_id}")
+
+            cutoff = datetime.utcnow() - timedelta(seconds=grace_s)
+            result = await db.execute(
+                SnapshotChunk.__table__.delete().where(
+                    SnapshotChunk.last_used < cutoff,
+                    ~exists().where(SnapshotChunkRef.hash == SnapshotChunk.hash)
+                )
+            )
+            await db.commit()
+            if result.rowcount:
+                logger.info(f"Collected {result.rowcount} unreferenced snapshot chunks")
+            return pruned, result.rowcount
+        except Exception as e:
+            logger.error(f"Error pruning snapshots: {e}", exc_info=True)
+            await db.rollback()
+            return pruned, 0
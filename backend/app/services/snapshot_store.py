@@ -0,0 +1,125 @@
+import base64
+import hashlib
+import io
+import zlib
+from typing import Dict, List, Tuple
+from app.core.config import settings
+from app.core.events import loads, dumps
+
+# Optional Pillow for image tiles; without it snapshots are chunked as plain byte ranges
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Snapshot.data of a chunked snapshot is this prefix plus its manifest; older rows hold the data itself
+CHUNKED_PREFIX = "chunks:"
+PNG_DATA_URL = "data:image/png;base64,"
+
+
+def is_chunked(data: str) -> bool:
+    return data.startswith(CHUNKED_PREFIX)
+
+
+def _digest(kind: bytes, content: bytes) -> str:
+    return hashlib.sha256(kind + content).hexdigest()
+
+
+def _split_tiles(data: str, tile_size: int):
+    image = Image.open(io.BytesIO(base64.b64decode(data[len(PNG_DATA_URL):])))
+    image = image.convert("RGBA")
+    width, height = image.size
+    manifest = {"kind": "tiles", "width": width, "height": height, "tile": tile_size, "tiles": []}
+    hashes: List[str] = []
+    contents: Dict[str, "Image.Image"] = {}
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            tile = image.crop((left, top, min(left + tile_size, width), min(top + tile_size, height)))
+            if tile.getbbox() is None:
+                # Blank tiles are left out and come back transparent
+                continue
+            # Keyed by pixels, not PNG bytes, so identical regions share a chunk whatever encoded them
+            digest = _digest(b"t%dx%d:" % tile.size, tile.tobytes())
+            manifest["tiles"].append([left // tile_size, top // tile_size])
+            hashes.append(digest)
+            contents[digest] = tile
+    return manifest, hashes, contents
+
+
+def _split_bytes(data: str, chunk_size: int):
+    raw = data.encode()
+    manifest = {"kind": "bytes"}
+    hashes: List[str] = []
+    contents: Dict[str, bytes] = {}
+    for start in range(0, len(raw), chunk_size):
+        chunk = raw[start:start + chunk_size]
+        digest = _digest(b"b:", chunk)
+        hashes.append(digest)
+        contents[digest] = chunk
+    return manifest, hashes, contents
+
+
+def split_snapshot(
+    data: str,
+    tile_size: int = settings.SNAPSHOT_TILE_SIZE,
+    chunk_size: int = settings.SNAPSHOT_CHUNK_SIZE
+) -> Tuple[dict, List[str], dict]:
+    """Split snapshot data into (manifest, chunk hash per position, hash -> content to compress)"""
+    if Image is not None and data.startswith(PNG_DATA_URL):
+        try:
+            return _split_tiles(data, tile_size)
+        except Exception:
+            # Not a decodable PNG after all; byte chunks still dedupe identical saves
+            pass
+    return _split_bytes(data, chunk_size)
+
+
+def compress_chunk(content) -> bytes:
+    """Blob stored for a chunk: PNG for image tiles, raw deflate for byte ranges"""
+    if isinstance(content, bytes):
+        return zlib.compress(content)
+    buffer = io.BytesIO()
+    content.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def chunk_size(content) -> int:
+    return len(content) if isinstance(content, bytes) else len(content.tobytes())
+
+
+def manifest_data(manifest: dict) -> str:
+    return CHUNKED_PREFIX + dumps(manifest)
+
+
+def load_manifest(data: str) -> dict:
+    return loads(data[len(CHUNKED_PREFIX):])
+
+
+def new_canvas(manifest: dict) -> "Image.Image":
+    """Blank image to paste a tiled snapshot's tiles into"""
+    if Image is None:
+        raise RuntimeError("Pillow is required to restore tiled snapshots")
+    return Image.new("RGBA", (manifest["width"], manifest["height"]), (0, 0, 0, 0))
+
+
+def paste_tile(image: "Image.Image", manifest: dict, position: int, blob: bytes):
+    tx, ty = manifest["tiles"][position]
+    image.paste(Image.open(io.BytesIO(blob)), (tx * manifest["tile"], ty * manifest["tile"]))
+
+
+def encode_canvas(image: "Image.Image") -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return PNG_DATA_URL + base64.b64encode(buffer.getvalue()).decode()
+
+
+def join_snapshot(data: str, blobs: List[bytes]) -> str:
+    """Rebuild the snapshot data from its manifest and chunk blobs in position order"""
+    manifest = load_manifest(data)
+    if manifest["kind"] == "bytes":
+        return b"".join(zlib.decompress(blob) for blob in blobs).decode()
+
+    image = new_canvas(manifest)
+    for position, blob in enumerate(blobs):
+        paste_tile(image, manifest, position, blob)
+    return encode_canvas(image)
@@ -1,12 +1,10 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from passlib.context import CryptContext
 from app.models.user import User
+from app.core.hashing import PasswordHasherBusy, password_hasher
 from app.core.security import create_access_token
 from app.core.logger import logger
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 class UserService:
     """Service class for user-related operations"""
@@ -28,7 +26,7 @@ class UserService:
     async def create_user(db: AsyncSession, full_name: str, username: str, password: str) -> User:
         """Create a new user with hashed password"""
         try:
-            hashed_password = pwd_context.hash(password)
+            hashed_password = await password_hasher.hash(password)
             new_user = User(
                 full_name=full_name,
                 username=username,
@@ -47,7 +45,7 @@ class UserService:
     @staticmethod
     async def verify_password(plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+        return await password_hasher.verify(plain_password, hashed_password)
     
     @staticmethod
     async def authenticate_user(db: AsyncSession, username: str, password: str) -> User | None:
@@ -62,6 +60,8 @@ class UserService:
                 return None
             logger.info(f"User authenticated successfully: {username}")
             return user
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             logger.error(f"Error authenticating user {username}: {e}", exc_info=True)
             return None
@@ -0,0 +1,243 @@
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional
+from app.core.config import settings
+from app.core.events import loads, dumps
+from app.core.logger import logger
+
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more; larger frames are stored and referenced
+PG_NOTIFY_MAX_BYTES = 7999
+PG_FRAME_REF_PREFIX = "ref:"
+# Stored frames outlive any listener's lag by far; older ones are deleted as new ones are stored
+PG_FRAME_RETENTION_S = 300
+
+
+class Backplane(ABC):
+    """Pub/sub transport that relays room frames between server nodes"""
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self._handler: Optional[Callable[[dict], Awaitable[None]]] = None
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.BACKPLANE_QUEUE_MAXSIZE)
+        self._publisher: asyncio.Task | None = None
+        self.metrics: Dict[str, int] = {"published": 0, "received": 0, "dropped": 0, "failed": 0}
+
+    def set_handler(self, handler: Callable[[dict], Awaitable[None]]):
+        self._handler = handler
+
+    async def start(self):
+        await self._connect()
+        self._publisher = asyncio.create_task(self._publish_loop())
+        logger.info(f"{type(self).__name__} started (node {self.node_id})")
+
+    async def stop(self):
+        if self._publisher is not None:
+            self._publisher.cancel()
+            try:
+                await self._publisher
+            except asyncio.CancelledError:
+                pass
+            self._publisher = None
+        await self._disconnect()
+
+    def publish(self, room_id: str, kind: str, **fields):
+        """Queue an envelope for other nodes without blocking the caller"""
+        envelope = {"node": self.node_id, "room": room_id, "kind": kind, **fields}
+        try:
+            self._outbox.put_nowait(dumps(envelope))
+        except asyncio.QueueFull:
+            self.metrics["dropped"] += 1
+            logger.warning(f"Backplane outbox full, dropping {kind} for room {room_id}")
+
+    async def _publish_loop(self):
+        while True:
+            raw = await self._outbox.get()
+            try:
+                await self._publish(raw)
+                self.metrics["published"] += 1
+            except Exception as e:
+                self.metrics["failed"] += 1
+                logger.error(f"Backplane publish error: {e}")
+
+    async def _deliver(self, raw: str | bytes):
+        envelope = loads(raw)
+        if envelope.get("node") == self.node_id or self._handler is None:
+            return
+        self.metrics["received"] += 1
+        try:
+            await self._handler(envelope)
+        except Exception as e:
+            logger.error(f"Backplane handler error: {e}", exc_info=True)
+
+    async def _connect(self):
+        pass
+
+    async def _disconnect(self):
+        pass
+
+    @abstractmethod
+    async def _publish(self, raw: str):
+        ...
+
+
+class LocalBroker:
+    """In-process message broker, shared by in-memory backplanes (and by tests as a fake broker)"""
+
+    def __init__(self):
+        self.subscribers: List["InMemoryBackplane"] = []
+
+    async def publish(self, raw: str):
+        for subscriber in list(self.subscribers):
+            await subscriber._deliver(raw)
+
+
+_local_brokers: Dict[str, LocalBroker] = {}
+
+
+class InMemoryBackplane(Backplane):
+    """Backplane for several managers within one process"""
+
+    def __init__(self, broker: LocalBroker = None):
+        super().__init__()
+        self.broker = broker or LocalBroker()
+
+    async def _connect(self):
+        self.broker.subscribers.append(self)
+
+    async def _disconnect(self):
+        if self in self.broker.subscribers:
+            self.broker.subscribers.remove(self)
+
+    async def _publish(self, raw: str):
+        await self.broker.publish(raw)
+
+
+class RedisBackplane(Backplane):
+    """Backplane over Redis pub/sub (requires the optional redis package)"""
+
+    def __init__(self, url: str, channel: str = settings.BACKPLANE_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._redis = None
+        self._pubsub = None
+        self._reader: asyncio.Task | None = None
+
+    async def _connect(self):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("BACKPLANE_URL uses redis:// but the redis package is not installed") from e
+        self._redis = redis.from_url(self.url)
+        self._pubsub = self._redis.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        async for message in self._pubsub.listen():
+            if message.get("type") == "message":
+                await self._deliver(message["data"])
+
+    async def _disconnect(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.close()
+        if self._redis is not None:
+            await self._redis.close()
+
+    async def _publish(self, raw: str):
+        await self._redis.publish(self.channel, raw)
+
+
+class PostgresBackplane(Backplane):
+    """Backplane over Postgres LISTEN/NOTIFY using a dedicated asyncpg connection"""
+
+    def __init__(self, dsn: str, channel: str = settings.BACKPLANE_CHANNEL):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        # Frames too large for NOTIFY; the notification carries only their id
+        self.frames_table = f'"{channel}_frames"'
+        self._conn = None
+        # The publisher and the reader share the connection, one query at a time
+        self._lock = asyncio.Lock()
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._reader: asyncio.Task | None = None
+        self.metrics["stored"] = 0
+
+    async def _connect(self):
+        import asyncpg
+        self._conn = await asyncpg.connect(self.dsn)
+        await self._conn.execute(
+            f"CREATE UNLOGGED TABLE IF NOT EXISTS {self.frames_table} "
+            "(id BIGSERIAL PRIMARY KEY, payload TEXT NOT NULL, created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        await self._conn.add_listener(self.channel, self._on_notify)
+        self._reader = asyncio.create_task(self._read())
+
+    def _on_notify(self, connection, pid, channel, payload):
+        # Queued rather than handled in a task of its own, so frames are applied in the order sent
+        self._inbox.put_nowait(payload)
+
+    async def _read(self):
+        while True:
+            payload = await self._inbox.get()
+            if payload.startswith(PG_FRAME_REF_PREFIX):
+                try:
+                    async with self._lock:
+                        payload = await self._conn.fetchval(
+                            f"SELECT payload FROM {self.frames_table} WHERE id = $1",
+                            int(payload[len(PG_FRAME_REF_PREFIX):])
+                        )
+                except Exception as e:
+                    self.metrics["failed"] += 1
+                    logger.error(f"Backplane error fetching stored frame {payload}: {e}")
+                    continue
+                if payload is None:
+                    self.metrics["dropped"] += 1
+                    logger.warning("Backplane stored frame expired before it was read, not relayed")
+                    continue
+            try:
+                await self._deliver(payload)
+            except Exception as e:
+                logger.error(f"Backplane error reading frame: {e}", exc_info=True)
+
+    async def _disconnect(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._conn is not None:
+            await self._conn.remove_listener(self.channel, self._on_notify)
+            await self._conn.close()
+
+    async def _publish(self, raw: str):
+        async with self._lock:
+            if len(raw.encode()) > PG_NOTIFY_MAX_BYTES:
+                frame_id = await self._conn.fetchval(
+                    f"INSERT INTO {self.frames_table} (payload) VALUES ($1) RETURNING id", raw
+                )
+                await self._conn.execute(
+                    f"DELETE FROM {self.frames_table} WHERE created_at < now() - make_interval(secs => $1)",
+                    PG_FRAME_RETENTION_S
+                )
+                self.metrics["stored"] += 1
+                raw = f"{PG_FRAME_REF_PREFIX}{frame_id}"
+            await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, raw)
+
+
+def create_backplane(url: str) -> Optional[Backplane]:
+    """Build the backplane for BACKPLANE_URL; an empty URL means single-node mode"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        name = url[len("memory://"):]
+        broker = _local_brokers.setdefault(name, LocalBroker())
+        return InMemoryBackplane(broker)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackplane(url)
+    if url.startswith(("postgres://", "postgresql://", "postgresql+asyncpg://")):
+        return PostgresBackplane(url.replace("postgresql+asyncpg://", "postgresql://", 1))
+    raise ValueError(f"Unsupported BACKPLANE_URL scheme: {url}")
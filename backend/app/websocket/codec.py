@@ -0,0 +1,200 @@
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import List, Optional
+
+# Compact binary stroke frame (little-endian):
+#   u8 version | u8 type | u8 r | u8 g | u8 b | u8 flags | u16 thickness x10 | u16 point count
+#   followed by the first point as int16 x, y and int16 dx, dy deltas for the rest,
+#   then, if flagged, the u32 history seq of the first point (the rest follow it one by one)
+#   and, if flagged, u8 length and the UTF-8 username of the author
+STROKE_FRAME_VERSION = 1
+STROKE_HEADER = struct.Struct("<BBBBBBHH")
+STROKE_TYPES = {"brush": 1, "eraser": 2}
+STROKE_TYPE_NAMES = {code: name for name, code in STROKE_TYPES.items()}
+FLAG_HAS_COLOR = 0x01
+FLAG_HAS_AUTHOR = 0x02
+FLAG_HAS_SEQ = 0x04
+STROKE_SEQ = struct.Struct("<I")
+
+# Absolute coordinates are bounded so every delta still fits in an int16
+COORD_LIMIT = 16383
+
+
+def _parse_color(color) -> Optional[tuple]:
+    if not isinstance(color, str) or not color.startswith("#"):
+        return None
+    hex_digits = color[1:]
+    if len(hex_digits) == 3:
+        hex_digits = "".join(digit * 2 for digit in hex_digits)
+    if len(hex_digits) != 6:
+        return None
+    try:
+        value = int(hex_digits, 16)
+    except ValueError:
+        return None
+    return (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF
+
+
+def encode_stroke(events: List[dict]) -> Optional[bytes]:
+    """Pack same-style brush/eraser points into one binary frame; None if they can't be represented"""
+    if not events:
+        return None
+    first = events[0]
+    type_code = STROKE_TYPES.get(first.get("type"))
+    if type_code is None:
+        return None
+
+    flags = 0
+    rgb = (0, 0, 0)
+    if first.get("color") is not None:
+        rgb = _parse_color(first["color"])
+        if rgb is None:
+            return None
+        flags |= FLAG_HAS_COLOR
+
+    try:
+        thickness = round(float(first.get("thickness", 0)) * 10)
+        points = [(round(event["x"]), round(event["y"])) for event in events]
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not 0 <= thickness <= 0xFFFF or len(points) > 0xFFFF:
+        return None
+    if any(
+        event.get("type") != first.get("type") or
+        event.get("color") != first.get("color") or
+        event.get("thickness") != first.get("thickness") or
+        event.get("author") != first.get("author")
+        for event in events
+    ):
+        return None
+    if any(abs(x) > COORD_LIMIT or abs(y) > COORD_LIMIT for x, y in points):
+        return None
+
+    seq = b""
+    if first.get("seq") is not None:
+        # Points recorded as history events carry consecutive seqs, so only the first is sent
+        start = first["seq"]
+        if not isinstance(start, int) or isinstance(start, bool) or not 0 <= start <= 0xFFFFFFFF - len(events):
+            return None
+        if any(event.get("seq") != start + index for index, event in enumerate(events)):
+            return None
+        flags |= FLAG_HAS_SEQ
+        seq = STROKE_SEQ.pack(start)
+    elif any(event.get("seq") is not None for event in events):
+        return None
+
+    author = b""
+    if first.get("author") is not None:
+        if not isinstance(first["author"], str):
+            return None
+        author = first["author"].encode()
+        if len(author) > 0xFF:
+            return None
+        flags |= FLAG_HAS_AUTHOR
+        author = bytes([len(author)]) + author
+
+    coords = array("h", points[0])
+    previous_x, previous_y = points[0]
+    for x, y in points[1:]:
+        coords.append(x - previous_x)
+        coords.append(y - previous_y)
+        previous_x, previous_y = x, y
+
+    header = STROKE_HEADER.pack(STROKE_FRAME_VERSION, type_code, *rgb, flags, thickness, len(points))
+    if sys.byteorder == "big":
+        coords.byteswap()
+    return header + coords.tobytes() + seq + author
+
+
+def decode_stroke(data: bytes) -> List[dict]:
+    """Unpack a binary stroke frame into the equivalent per-point JSON events"""
+    if len(data) < STROKE_HEADER.size:
+        raise ValueError("Stroke frame shorter than its header")
+    version, type_code, r, g, b, flags, thickness, count = STROKE_HEADER.unpack_from(data)
+    if version != STROKE_FRAME_VERSION:
+        raise ValueError(f"Unsupported stroke frame version {version}")
+    event_type = STROKE_TYPE_NAMES.get(type_code)
+    if event_type is None:
+        raise ValueError(f"Unknown stroke type code {type_code}")
+    body = data[STROKE_HEADER.size:STROKE_HEADER.size + count * 4]
+    trailer = data[STROKE_HEADER.size + count * 4:]
+    if count == 0 or len(body) != count * 4:
+        raise ValueError(f"Stroke frame carries {len(body)} bytes for {count} points")
+    seq = None
+    if flags & FLAG_HAS_SEQ:
+        if len(trailer) < STROKE_SEQ.size:
+            raise ValueError("Stroke frame is missing its seq")
+        seq, = STROKE_SEQ.unpack_from(trailer)
+        trailer = trailer[STROKE_SEQ.size:]
+    author = None
+    if flags & FLAG_HAS_AUTHOR:
+        if not trailer or len(trailer) != trailer[0] + 1:
+            raise ValueError("Stroke frame author doesn't match its length")
+        author = trailer[1:].decode()
+    elif trailer:
+        raise ValueError(f"Stroke frame carries {len(trailer)} bytes after its points")
+
+    coords = array("h")
+    coords.frombytes(body)
+    if sys.byteorder == "big":
+        coords.byteswap()
+    xs = accumulate(coords[0::2])
+    ys = accumulate(coords[1::2])
+
+    # Keep integral widths as ints so transcoded JSON matches what clients send
+    width = thickness // 10 if thickness % 10 == 0 else thickness / 10
+    style = {"color": f"#{r:02x}{g:02x}{b:02x}"} if flags & FLAG_HAS_COLOR else {}
+    style["thickness"] = width
+    if author is not None:
+        style["author"] = author
+    events = [{"type": event_type, "x": x, "y": y, **style} for x, y in zip(xs, ys)]
+    if seq is not None:
+        for index, event in enumerate(events):
+            event["seq"] = seq + index
+    return events
+
+
+# Large server frames (e.g. a restored snapshot) go out as a sequence of binary fragments:
+#   u8 marker | u8 flags | u32 transfer id | u32 fragment index, followed by a slice of the UTF-8 frame
+# The marker can't be mistaken for a stroke frame, whose first byte is its version
+FRAGMENT_MARKER = 0xF0
+FRAGMENT_HEADER = struct.Struct("<BBII")
+FLAG_FINAL = 0x01
+# Set together with FLAG_FINAL when the server gave up on the frame; clients discard what they have
+FLAG_ABORT = 0x02
+
+
+class FragmentEncoder:
+    """Cuts a frame being produced piece by piece into fixed-size fragments, the last one flagged final"""
+
+    def __init__(self, transfer_id: int, fragment_size: int):
+        self.transfer_id = transfer_id & 0xFFFFFFFF
+        self.fragment_size = fragment_size
+        self.index = 0
+        self._buffer = bytearray()
+
+    def _fragment(self, payload: bytes, flags: int = 0) -> bytes:
+        header = FRAGMENT_HEADER.pack(FRAGMENT_MARKER, flags, self.transfer_id, self.index)
+        self.index += 1
+        return header + payload
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Fragments completed by data; a remainder waits for more data or finish()"""
+        self._buffer += data
+        fragments = []
+        # Keep at least one byte back so the final fragment is never empty
+        while len(self._buffer) > self.fragment_size:
+            fragments.append(self._fragment(bytes(self._buffer[:self.fragment_size])))
+            del self._buffer[:self.fragment_size]
+        return fragments
+
+    def finish(self) -> bytes:
+        fragment = self._fragment(bytes(self._buffer), FLAG_FINAL)
+        self._buffer.clear()
+        return fragment
+
+    def abort(self) -> bytes:
+        self._buffer.clear()
+        return self._fragment(b"", FLAG_FINAL | FLAG_ABORT)
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class HistoryCompactor:
+    """Periodically checkpoints rooms whose history changed, keeping the event log and load time bounded"""
+
+    def __init__(self, compact: Callable[[], Awaitable[int]], interval_s: int = settings.HISTORY_COMPACTION_INTERVAL_S):
+        self._compact = compact
+        self.interval = interval_s
+        self._task: asyncio.Task | None = None
+        self.metrics: Dict[str, int] = {"runs": 0, "rooms_compacted": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"History compactor started (every {self.interval}s)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.metrics["rooms_compacted"] += await self._compact()
+                self.metrics["runs"] += 1
+            except Exception as e:
+                logger.error(f"History compaction error: {e}", exc_info=True)
@@ -0,0 +1,128 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+from fastapi import WebSocket
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class ClientConnection:
+    """Bounded outbound queue and writer task for a single WebSocket"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        username: Optional[str],
+        on_close: Callable[["ClientConnection"], Awaitable[None]],
+        metrics: Dict[str, int],
+        binary: bool = False
+    ):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.username = username
+        # Negotiated with ?protocol=binary: stroke events arrive as compact binary frames
+        self.binary = binary
+        # Got the canvas as server-rendered tiles, so undos of strokes drawn before that need new tiles
+        self.tiles = False
+        self.queue: Deque[Tuple[str | bytes, Optional[str], Optional[str]]] = deque()
+        self.closed = False
+        self._on_close = on_close
+        self._metrics = metrics
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def send(self, message: str | bytes, event_type: str = None, key: str = None) -> bool:
+        """Queue a frame for this client without waiting on the network"""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= settings.SEND_QUEUE_HIGH_WATER:
+            if not self._relieve_pressure(event_type, key):
+                return False
+            if len(self.queue) >= settings.SEND_QUEUE_MAXSIZE:
+                logger.warning(
+                    f"Send queue overflow for {self.username} in room {self.room_id}, disconnecting"
+                )
+                self._abort()
+                return False
+
+        self.queue.append((message, event_type, key))
+        self._wakeup.set()
+        return True
+
+    def _relieve_pressure(self, event_type: Optional[str], key: Optional[str]) -> bool:
+        """Apply the slow-consumer policy; returns False if the new frame must be dropped"""
+        policy = settings.SLOW_CONSUMER_POLICY
+        if policy == "disconnect":
+            logger.warning(
+                f"Client {self.username} in room {self.room_id} passed the send high-water mark, disconnecting"
+            )
+            self._abort()
+            return False
+
+        if policy == "coalesce":
+            # Keep at most one queued frame per key (e.g. one cursor per user)
+            if key is not None:
+                for i, (_, _, queued_key) in enumerate(self.queue):
+                    if queued_key == key:
+                        del self.queue[i]
+                        self._metrics["coalesced"] += 1
+                        break
+            return True
+
+        if event_type == "cursor":
+            self._metrics["dropped"] += 1
+            return False
+
+        before = len(self.queue)
+        self.queue = deque(item for item in self.queue if item[1] != "cursor")
+        self._metrics["dropped"] += before - len(self.queue)
+        return True
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                while self.queue:
+                    message, _, _ = self.queue.popleft()
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    else:
+                        await self.websocket.send_text(message)
+                    self._metrics["sent"] += 1
+                self._wakeup.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Send failed for {self.username} in room {self.room_id}: {e}")
+            self.closed = True
+            asyncio.create_task(self._on_close(self))
+
+    def _abort(self):
+        """Drop a slow consumer: stop writing and close the socket"""
+        if self.closed:
+            return
+        self._metrics["slow_disconnects"] += 1
+        self.closed = True
+        self.queue.clear()
+        if self._task is not None:
+            self._task.cancel()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=1008)
+        except Exception:
+            pass
+        await self._on_close(self)
+
+    def close(self):
+        """Stop the writer task; queued frames are discarded"""
+        self.closed = True
+        self.queue.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
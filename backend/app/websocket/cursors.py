@@ -0,0 +1,65 @@
+import asyncio
+from typing import Callable, Dict
+from app.core.config import settings
+from app.core.events import dumps
+from app.core.logger import logger
+
+
+class CursorAggregator:
+    """Keeps the latest cursor per user and flushes one combined frame per room on a fixed tick"""
+
+    def __init__(self, send: Callable[[str, str], None], tick_hz: int = settings.CURSOR_TICK_HZ):
+        self._send = send
+        self.interval = 1 / tick_hz if tick_hz > 0 else 0
+        self.pending: Dict[str, Dict[str, dict]] = {}
+        self._task: asyncio.Task | None = None
+        self.metrics: Dict[str, int] = {"updates": 0, "frames": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Cursor aggregator started ({round(1 / self.interval)} Hz)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def update(self, room_id: str, username: str, event: dict):
+        """Record a cursor move; only the newest position per user survives until the next tick"""
+        self.metrics["updates"] += 1
+        if username:
+            event["username"] = username
+        self.pending.setdefault(room_id, {})[username or event.get("user_id")] = event
+
+    def remove_user(self, room_id: str, username: str):
+        room = self.pending.get(room_id)
+        if room:
+            room.pop(username, None)
+
+    def discard_room(self, room_id: str):
+        self.pending.pop(room_id, None)
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        for room_id, cursors in pending.items():
+            if cursors:
+                self._send(room_id, dumps({"type": "cursors", "cursors": list(cursors.values())}))
+                self.metrics["frames"] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Cursor flush error: {e}", exc_info=True)
@@ -0,0 +1,454 @@
+import sys
+import zlib
+from bisect import bisect_right
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set
+from app.core.config import settings
+from app.core.events import UNDO_EVENTS, EventRecord, loads, dumps
+from app.websocket.spatial import MASKS_AVAILABLE, Box, StrokeGrid, is_cullable, is_erased, is_eraser
+
+
+INIT_PREFIX = '{"type":"init","history":['
+RESYNC_PREFIX = '{"type":"resync","history":['
+# The room's latest seq goes last so clients can pick it off any frame cheaply
+SEQ_SUFFIX = '],"seq":%d}'
+
+# Memory held by a record besides its payload string (the tuple and its int)
+RECORD_OVERHEAD = sys.getsizeof(EventRecord(0, None, "")) + sys.getsizeof(2 ** 40)
+
+
+def record_size(record: EventRecord) -> int:
+    return sys.getsizeof(record.raw) + RECORD_OVERHEAD
+
+
+class HistoryBudget:
+    """Byte accounting shared by every room's history, with an optional global cap"""
+
+    def __init__(self, max_bytes: int = settings.HISTORY_MAX_TOTAL_BYTES):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.evicted = 0
+
+    @property
+    def over(self) -> bool:
+        return self.max_bytes > 0 and self.used > self.max_bytes
+
+
+class UndoIndex:
+    """Per-user stacks of a room's undoable and undone record seqs, so undo never scans the room log"""
+
+    def __init__(self):
+        self.done: Dict[str, List[int]] = {}
+        self.undone: Dict[str, List[int]] = {}
+
+    def add(self, author: str, seq: int):
+        self.done.setdefault(author, []).append(seq)
+        # New work ends the user's redo chain, as in any editor
+        self.undone.pop(author, None)
+
+    def last_done(self, author: str) -> Optional[int]:
+        stack = self.done.get(author)
+        return stack[-1] if stack else None
+
+    def last_undone(self, author: str) -> Optional[int]:
+        stack = self.undone.get(author)
+        return stack[-1] if stack else None
+
+    def move(self, author: str, seq: int, undo: bool):
+        """Move seq between the user's done and undone stacks"""
+        source, target = (self.done, self.undone) if undo else (self.undone, self.done)
+        stack = source.get(author, [])
+        if stack and stack[-1] == seq:
+            stack.pop()
+        elif seq in stack:
+            # Only when nodes saw a user's undos in a different order
+            stack.remove(seq)
+        else:
+            return
+        target.setdefault(author, []).append(seq)
+
+    def forget(self, floor: int):
+        """Drop seqs at or below floor; those records are folded into the base layer for good"""
+        for author in list(self.done):
+            stack = self.done[author]
+            # Ascending: new records and redone ones are always the user's newest
+            del stack[:bisect_right(stack, floor)]
+            if not stack:
+                del self.done[author]
+        for author in list(self.undone):
+            stack = self.undone[author]
+            # Undone newest first, so the oldest sit on top
+            while stack and stack[-1] <= floor:
+                stack.pop()
+            if not stack:
+                del self.undone[author]
+
+    def clear(self):
+        self.done.clear()
+        self.undone.clear()
+
+
+class HistoryBuffer:
+    """In-memory drawing history for one room with a shared, pre-serialized init frame"""
+
+    def __init__(
+        self,
+        records: Iterable[EventRecord] = (),
+        seq: int = 0,
+        budget: Optional[HistoryBudget] = None,
+        max_records: int = settings.MAX_HISTORY_PER_ROOM,
+        on_evict: Optional[Callable[[List[EventRecord]], None]] = None,
+        base: Optional[str] = None,
+        floor: Optional[int] = None
+    ):
+        # Bounded ring: appends and evictions are O(1) amortized
+        self.records: Deque[EventRecord] = deque()
+        self.max_records = max_records
+        # Overflow evicts a chunk at once, so the init frame and base layer change only every so often
+        self.evict_chunk = max(1, max_records // 10)
+        self.seq = seq
+        self.bytes = 0
+        self._budget = budget
+        # Receives evicted records, e.g. to fold them into a base layer instead of losing them
+        self._on_evict = on_evict
+        # Leading init entry standing for everything at or below the floor (see BaseLayer)
+        self.base = base
+        # Cached init frame minus its closing seq suffix, plus the finished frame for the current seq
+        self._init_body: Optional[str] = None
+        self._init_frame: Optional[str] = None
+        self._init_deflated: Optional[bytes] = None
+        # Records appended since the cached frame was built; folded in on the next join
+        self._pending: List[str] = []
+        # Records with seq <= floor are no longer held (evicted, cleared or never loaded)
+        self.floor = floor if floor is not None else 0
+        # Seqs of records undone by a later undo record; they stay held (for redo) but are not replayed
+        self.dead: Set[int] = set()
+        self.undo = UndoIndex()
+        # Seqs of records wiped out by later erasers (or erasers with nothing beneath); held but not replayed
+        self.culled: Set[int] = set()
+        # Eraser seq -> records culled because it covers them, revived if the eraser is undone
+        self._culled_by: Dict[int, List[int]] = {}
+        # Erasers up to this seq were already looked at by cull_erased
+        self._culled_through = 0
+        # Culled records brought back by an undo, for the caller to send to clients that never got them
+        self.revived: List[EventRecord] = []
+        # Seq of the last undo that revived records; clients that joined before it may lack them
+        self._revived_at = 0
+        # Built on the first region query or cull, then kept up to date on append
+        self._grid: Optional[StrokeGrid] = None
+        # Whether every held record has its own, increasing seq; the grid and culling are keyed by it
+        self.ordered = True
+        for record in records:
+            self._push(record)
+        if floor is None:
+            self.floor = self.records[0].seq - 1 if self.records else seq
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def next_seq(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def _push(self, record: EventRecord) -> bool:
+        """Append to the ring, returning True if the oldest records fell out"""
+        if self.records and record.seq <= self.records[-1].seq:
+            self.ordered = False
+            self._grid = None
+        self.records.append(record)
+        if record.type in UNDO_EVENTS:
+            self._apply_undo(record)
+        else:
+            if record.author is not None:
+                self.undo.add(record.author, record.seq)
+            if self._grid is not None:
+                self._grid.insert(record, loads(record.raw))
+        self._account(record_size(record))
+        if len(self.records) > self.max_records:
+            self._evict(max(self.evict_chunk, len(self.records) - self.max_records))
+            return True
+        return False
+
+    def _apply_undo(self, record: EventRecord):
+        target = loads(record.raw).get("target")
+        if not isinstance(target, int):
+            return
+        if record.type == "undo":
+            self.dead.add(target)
+            if target in self._culled_by:
+                self._revive(self._culled_by.pop(target), record.seq)
+        else:
+            self.dead.discard(target)
+        if record.author is not None:
+            self.undo.move(record.author, target, record.type == "undo")
+
+    def _revive(self, seqs: List[int], seq: int):
+        revived = set(seqs) & self.culled
+        if not revived:
+            return
+        self.culled -= revived
+        self._revived_at = seq
+        self.revived.extend(record for record in self.records if record.seq in revived)
+        # The remaining erasers may still cover some of them; look again on the next pass
+        self._culled_through = self.floor
+
+    def take_revived(self) -> List[EventRecord]:
+        revived, self.revived = self.revived, []
+        return revived
+
+    def _evict(self, count: int) -> int:
+        evicted = [self.records.popleft() for _ in range(min(count, len(self.records)))]
+        if not evicted:
+            return 0
+        freed = sum(record_size(record) for record in evicted)
+        self.floor = evicted[-1].seq
+        self._account(-freed)
+        # Undone records and the undo records themselves are dropped rather than folded in; culled ones
+        # are kept, since the eraser covering them may still be undone
+        live = [record for record in evicted if record.type not in UNDO_EVENTS and record.seq not in self.dead]
+        seqs = {record.seq for record in evicted}
+        self.dead -= seqs
+        self.culled -= seqs
+        for seq in [seq for seq in self._culled_by if seq <= self.floor]:
+            del self._culled_by[seq]
+        if self._grid is not None:
+            for seq in seqs:
+                self._grid.remove(seq)
+        self.undo.forget(self.floor)
+        if self._on_evict is not None:
+            self._on_evict(live)
+        return freed
+
+    def is_live(self, record: EventRecord) -> bool:
+        """Whether the record is drawn: not an undo/redo marker, not undone and not erased away"""
+        return record.type not in UNDO_EVENTS and record.seq not in self.dead and record.seq not in self.culled
+
+    def live_records(self) -> Iterator[EventRecord]:
+        return (record for record in self.records if self.is_live(record))
+
+    def spatial_index(self) -> StrokeGrid:
+        if self._grid is None:
+            self._grid = StrokeGrid()
+            for record in self.records:
+                if record.type not in UNDO_EVENTS:
+                    self._grid.insert(record, loads(record.raw))
+        return self._grid
+
+    def record_box(self, seq: int) -> Optional[Box]:
+        """Bounding box of what a held record draws, or None if it isn't held or has no known extent"""
+        if not self.ordered:
+            return None
+        return self.spatial_index().boxes.get(seq)
+
+    def region_records(self, box: Box) -> List[EventRecord]:
+        """Drawn records whose bounding box intersects box, in history order"""
+        if not self.ordered:
+            # Seqs can't tell records apart, so none are indexed; everything drawn may be in the box
+            return list(self.live_records())
+        return [record for record in self.spatial_index().query(box) if self.is_live(record)]
+
+    def region_frame(self, x: float, y: float, width: float, height: float, base: Optional[str] = None) -> str:
+        """The records a client needs to draw one rectangle of the canvas, optionally over a cropped base"""
+        entries = [record.raw for record in self.region_records((x, y, x + width, y + height))]
+        if base is not None:
+            entries.insert(0, base)
+        header = dumps({"type": "region", "x": x, "y": y, "width": width, "height": height})
+        return header[:-1] + ',"history":[' + ','.join(entries) + SEQ_SUFFIX % self.seq
+
+    def cull_erased(self, base_drawn: Optional[Callable[[Box], bool]] = None) -> int:
+        """Stop replaying records that later erasers fully cover, and erasers with nothing beneath them
+
+        Only erasers appended since the last pass are looked at. base_drawn tells whether the base
+        layer has pixels in a box; without it an eraser over no held record is assumed to erase nothing.
+        Returns the number of records culled. The Pillow work can run in a thread instead: pass
+        cull_snapshot() to find_erased there, then its result to apply_cull.
+        """
+        snapshot = self.cull_snapshot()
+        if snapshot is None:
+            return 0
+        return self.apply_cull(find_erased(*snapshot, base_drawn), snapshot[2], self.seq)
+
+    def cull_snapshot(self) -> Optional[tuple]:
+        """Copies of what find_erased reads, or None if records can't be culled"""
+        if not MASKS_AVAILABLE or not self.ordered:
+            return None
+        return list(self.records), self.dead | self.culled, self._culled_through
+
+    def apply_cull(self, erased: List[tuple], since: int, through: int) -> int:
+        """Cull what find_erased found, except records undone, evicted or cleared while it ran"""
+        held = {record.seq for record in self.records}
+        culled = 0
+        for seq, erasers in erased:
+            if seq not in held or seq in self.dead or seq in self.culled or any(eraser in self.dead for eraser in erasers):
+                continue
+            self.culled.add(seq)
+            for eraser in erasers:
+                self._culled_by.setdefault(eraser, []).append(seq)
+            culled += 1
+        # An undo reviving records meanwhile asked for a fresh look from further back
+        if self._culled_through == since:
+            self._culled_through = through
+        if culled:
+            self._invalidate()
+        return culled
+
+    def _account(self, delta: int):
+        self.bytes += delta
+        if self._budget is not None:
+            self._budget.used += delta
+
+    def append(self, record: EventRecord):
+        # An undo or redo changes which earlier records are drawn, so the init frame is rebuilt
+        if self._push(record) or record.type in UNDO_EVENTS:
+            self._invalidate()
+        elif self._init_body is not None:
+            self._pending.append(record.raw)
+            self._init_frame = None
+            self._init_deflated = None
+
+    def append_remote(self, record: EventRecord):
+        """Append a record that another node already sequenced"""
+        self.seq = max(self.seq, record.seq)
+        self.append(record)
+
+    def evict_oldest(self, count: int) -> int:
+        """Drop up to count of the oldest records, returning the bytes freed"""
+        freed = self._evict(count)
+        if freed:
+            if self._budget is not None:
+                self._budget.evicted += 1
+            self._invalidate()
+        return freed
+
+    def set_base(self, base: Optional[str]):
+        if base != self.base:
+            self.base = base
+            self._invalidate()
+
+    def since(self, seq: int) -> Optional[List[EventRecord]]:
+        """Records after seq, or None if some of them are no longer held"""
+        if seq < self.floor or seq > self.seq:
+            return None
+        tail = []
+        for record in reversed(self.records):
+            if record.seq <= seq:
+                break
+            tail.append(record)
+        tail.reverse()
+        return tail
+
+    def clear(self):
+        self.records.clear()
+        self.dead.clear()
+        self.undo.clear()
+        self.culled.clear()
+        self._culled_by.clear()
+        self.revived = []
+        self._grid = None
+        self.ordered = True
+        self.base = None
+        self._account(-self.bytes)
+        # The clear takes a seq of its own so clients that saw everything before it still resync fully
+        self.floor = self.next_seq()
+        self._invalidate()
+
+    def release(self):
+        """Return this buffer's bytes to the shared budget before it is dropped"""
+        self._account(-self.bytes)
+
+    def _invalidate(self):
+        self._init_body = None
+        self._init_frame = None
+        self._init_deflated = None
+        self._pending = []
+
+    def init_frame(self) -> str:
+        """The init frame for joiners, rebuilt or extended only after history changed"""
+        if self._init_body is None:
+            # Joiners get only what is drawn; undone strokes and undo records cost them nothing
+            entries = [record.raw for record in self.live_records()]
+            if self.base is not None:
+                entries.insert(0, self.base)
+            self._init_body = INIT_PREFIX + ','.join(entries)
+        elif self._pending:
+            # Extend the cached body instead of re-joining the whole history
+            separator = ',' if len(self._init_body) > len(INIT_PREFIX) else ''
+            self._init_body += separator + ','.join(self._pending)
+        self._pending = []
+        if self._init_frame is None:
+            self._init_frame = self._init_body + SEQ_SUFFIX % self.seq
+        return self._init_frame
+
+    def resync_frame(self, seq: int) -> Optional[str]:
+        """Only the events a client that has seen up to seq is missing, or None if they were evicted
+
+        Undo and redo records are included, since they may target records the client already drew.
+        A client that missed an undo reviving culled records may not have them, so it gets None too.
+        """
+        tail = self.since(seq)
+        if tail is None or seq < self._revived_at:
+            return None
+        return RESYNC_PREFIX + ','.join(record.raw for record in tail) + SEQ_SUFFIX % self.seq
+
+    def init_frame_deflated(self) -> bytes:
+        """Raw-deflate (permessage-deflate compatible) copy of the init frame"""
+        frame = self.init_frame()
+        if self._init_deflated is None:
+            compressor = zlib.compressobj(wbits=-15)
+            self._init_deflated = compressor.compress(frame.encode()) + compressor.flush()
+        return self._init_deflated
+
+
+def find_erased(
+    records: List[EventRecord],
+    hidden: Set[int],
+    since: int,
+    base_drawn: Optional[Callable[[Box], bool]] = None
+) -> List[tuple]:
+    """(seq, seqs of the erasers covering it) for each record erasers appended after since wipe out
+
+    Works on copies from HistoryBuffer.cull_snapshot, so it can run off the event loop; hidden holds
+    the seqs not drawn (undone or already culled). Erasers with nothing beneath them come with no erasers.
+    """
+    grid = StrokeGrid()
+    events: Dict[int, dict] = {}
+    for record in records:
+        if record.type not in UNDO_EVENTS:
+            events[record.seq] = loads(record.raw)
+            grid.insert(record, events[record.seq])
+    hidden = set(hidden)
+
+    def is_live(record: EventRecord) -> bool:
+        return record.type not in UNDO_EVENTS and record.seq not in hidden
+
+    def covering(record: EventRecord) -> bool:
+        return record.type in ("polyline", "eraser") and is_live(record) and is_eraser(record.type, events[record.seq])
+
+    new_erasers = []
+    for record in reversed(records):
+        if record.seq <= since:
+            break
+        # Single eraser points continue a shared path, so only whole eraser strokes are culled
+        if record.type == "polyline" and covering(record):
+            new_erasers.append(record)
+
+    erased = []
+    for eraser in reversed(new_erasers):
+        box = grid.boxes.get(eraser.seq)
+        if box is None or not is_live(eraser):
+            continue
+        # Undone records count too: a redo would bring them back under the eraser
+        beneath = [record for record in grid.query(box) if record.seq < eraser.seq]
+        if not beneath and not (base_drawn is not None and base_drawn(box)):
+            hidden.add(eraser.seq)
+            erased.append((eraser.seq, []))
+            continue
+        for target in beneath:
+            target_box = grid.boxes.get(target.seq)
+            if target_box is None or not is_live(target) or not is_cullable(target.type, events[target.seq]):
+                continue
+            erasers = [record for record in grid.query(target_box) if record.seq > target.seq and covering(record)]
+            if erasers and is_erased((target.type, events[target.seq], target_box), [(record.type, events[record.seq]) for record in erasers]):
+                hidden.add(target.seq)
+                erased.append((target.seq, [record.seq for record in erasers]))
+    return erased
@@ -1,48 +1,197 @@
-from typing import Dict, List
+import asyncio
+import base64
+import itertools
+from typing import AsyncIterator, Dict, List, Optional
 from fastapi import WebSocket
-import json
-from app.database import AsyncSessionLocal
-from app.services.room_service import RoomService
-from app.services.canvas_service import CanvasService
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, UnitOfWork, get_pool_metrics
+from app.services.room_service import RoomService, room_cache
+from app.services.canvas_service import BASE_UNCHANGED, CanvasService, chat_entry, chat_tail, parse_chat_timestamp
 from app.services.snapshot_service import SnapshotService
+from app.websocket.backplane import create_backplane
+from app.websocket.compactor import HistoryCompactor
+from app.websocket.codec import STROKE_TYPES, FragmentEncoder, decode_stroke, encode_stroke
+from app.websocket.connection import ClientConnection
+from app.websocket.cursors import CursorAggregator
+from app.websocket.history import HistoryBudget, HistoryBuffer, find_erased
+from app.websocket.persistence import PersistenceWorker
+from app.websocket.raster import RASTER_AVAILABLE, BaseLayer, RoomRaster, base_record, encode_png, render_history, render_region
+from app.websocket.retention import SnapshotRetention
+from app.websocket.snapshots import SnapshotListCache
+from app.websocket.spatial import Box
+from app.websocket.strokes import StrokeAggregator
 from app.core.config import settings
+from app.core.sharding import shard_for_room
+from app.core.security import token_cache
+from app.core.events import UNDO_EVENTS, EventRecord, loads, dumps, parse_event, is_history_event, with_author, with_seq
 from app.core.logger import logger
 
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.history: Dict[str, List[str]] = {}
+        self.history: Dict[str, HistoryBuffer] = {}
+        self.history_budget = HistoryBudget()
+        # Rendered canvases, kept only for rooms where a client asked for raster tiles
+        self.rasters: Dict[str, RoomRaster] = {}
+        # Held while a room's raster is drawn on, so renders in worker threads apply in history order
+        self.raster_locks: Dict[str, asyncio.Lock] = {}
+        # Rendered history evicted from each room's ring, so init frames can start from it
+        self.bases: Dict[str, BaseLayer] = {}
+        # Rooms unloaded to honour the memory budget, possibly with log writes still queued
+        self.unloaded_rooms: set = set()
+        self.uncompacted: Dict[str, int] = {}
         self.rooms: set = set()
         self.socket_user_map: Dict[WebSocket, str] = {}
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.send_metrics: Dict[str, int] = {"sent": 0, "dropped": 0, "coalesced": 0, "slow_disconnects": 0, "streamed_frames": 0}
+        self._transfer_ids = itertools.count(1)
+        self.persistence = PersistenceWorker()
+        self.cursors = CursorAggregator(self._send_cursor_frame)
+        self.strokes = StrokeAggregator(self._append_stroke)
+        self.compactor = HistoryCompactor(self.compact_rooms)
+        self.snapshot_lists = SnapshotListCache()
+        self.snapshot_retention = SnapshotRetention(self.snapshot_lists.clear)
+        self.backplane = create_backplane(settings.BACKPLANE_URL)
+        if self.backplane:
+            self.backplane.set_handler(self._on_backplane_message)
+        # With a backplane, the node with this shard index numbers and persists its rooms' history
+        self.shard_index = settings.SHARD_INDEX
 
-    async def connect(self, websocket: WebSocket, room_id: str, username: str = None):
+    async def start(self):
+        """Start background workers"""
+        self.persistence.start()
+        self.cursors.start()
+        self.strokes.start()
+        self.compactor.start()
+        self.snapshot_retention.start()
+        if self.backplane:
+            await self.backplane.start()
+            if settings.SHARD_COUNT <= 1:
+                logger.warning(
+                    "BACKPLANE_URL is set with SHARD_COUNT=1, so this node numbers every room's history itself; "
+                    "give each node its own SHARD_INDEX out of SHARD_COUNT when running more than one"
+                )
+
+    async def shutdown(self):
+        """Flush pending writes and stop background workers"""
+        if self.backplane:
+            await self.backplane.stop()
+        await self.cursors.stop()
+        await self.strokes.stop()
+        await self.compactor.stop()
+        await self.snapshot_retention.stop()
+        await self.compact_rooms()
+        await self.persistence.stop()
+
+    def get_metrics(self) -> dict:
+        metrics = {
+            "persistence": self.persistence.get_metrics(),
+            "db_pool": get_pool_metrics(),
+            "cursors": self.cursors.metrics,
+            "strokes": self.strokes.metrics,
+            "history": {
+                "rooms": {room_id: history.bytes for room_id, history in self.history.items()},
+                "records": sum(len(history) for history in self.history.values()),
+                "bytes": self.history_budget.used,
+                "max_bytes": self.history_budget.max_bytes,
+                "budget_evictions": self.history_budget.evicted,
+                "culled": sum(len(history.culled) for history in self.history.values()),
+            },
+            "compactor": {**self.compactor.metrics, "base_layers": len(self.bases)},
+            "snapshot_retention": self.snapshot_retention.metrics,
+            "token_cache": {**token_cache.metrics, "tokens": len(token_cache)},
+            "room_cache": {**room_cache.metrics, "rooms": len(room_cache)},
+            "chat_tail": {**chat_tail.metrics, "rooms": len(chat_tail)},
+            "snapshot_lists": {**self.snapshot_lists.metrics, "rooms": len(self.snapshot_lists.rooms)},
+            "raster": {
+                "rooms": len(self.rasters),
+                "applied": sum(raster.metrics["applied"] for raster in self.rasters.values()),
+                "tiles_encoded": sum(raster.metrics["tiles_encoded"] for raster in self.rasters.values()),
+            },
+            "connections": {
+                **self.send_metrics,
+                "open": len(self.clients),
+                "queued": sum(len(client.queue) for client in self.clients.values()),
+            },
+        }
+        if self.backplane:
+            metrics["backplane"] = {**self.backplane.metrics, "node_id": self.backplane.node_id}
+        return metrics
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        username: str = None,
+        compress_init: bool = False,
+        binary: bool = False,
+        since: int = None,
+        tiles: bool = False
+    ):
         await websocket.accept()
+        self.rooms.add(room_id)
+
+        if room_id not in self.history:
+            await self.load_room_history(room_id)
+        # Strokes still being drawn are left open, so joins don't split them; the joiner gets their
+        # remaining points live and the whole polyline once they close
+        await self._refresh_base(room_id)
+        tiles_frame = None
+        if tiles and RASTER_AVAILABLE and settings.RASTER_TILES and (since is None or self.history[room_id].resync_frame(since) is None):
+            # The raster already includes every history event, so join cost doesn't grow with history
+            tiles_frame = (await self._room_raster(room_id)).tiles_frame()
+
+        # Register and queue init without awaiting in between, so init is the first frame
+        client = ClientConnection(websocket, room_id, username, self._on_client_closed, self.send_metrics, binary)
+        client.start()
+        self.clients[websocket] = client
         if room_id not in self.active_connections:
             self.active_connections[room_id] = []
         self.active_connections[room_id].append(websocket)
-        self.rooms.add(room_id)
         if username:
             self.socket_user_map[websocket] = username
         
         logger.info(f"User {username} connected to room {room_id}")
 
-        if room_id not in self.history:
-            await self.load_room_history(room_id)
+        self._send_canvas_state(client, room_id, compress_init, since, tiles_frame)
 
-        filtered_history = [
-            event for event in self.history.get(room_id, [])
-            if not json.loads(event).get("type") == "cursor"
-        ]
+        # Chat backlog follows the canvas state; messages relayed meanwhile are part of it too
+        async with UnitOfWork() as uow:
+            messages, next_before = await self._chat_page(uow.session, room_id)
+        if messages:
+            client.send(self._chat_history_frame(messages, next_before), "chat_history")
 
-        if filtered_history:
-            await websocket.send_text(
-                '{"type":"init","history":[' + ','.join(filtered_history) + ']}'
-            )
-            logger.debug(f"Sent {len(filtered_history)} history events to {username} in room {room_id}")
+    def _send_canvas_state(self, client: ClientConnection, room_id: str, compress_init: bool, since: int, tiles_frame: Optional[str]):
+        history = self.history[room_id]
+        username = client.username
+        if since is not None:
+            # A reconnecting client only needs what it missed, unless that was already evicted
+            resync_frame = history.resync_frame(since)
+            if resync_frame is not None:
+                client.send(resync_frame)
+                logger.debug(f"Resynced {username} in room {room_id} from seq {since} to {history.seq}")
+                return
+
+        if tiles_frame is not None:
+            client.send(tiles_frame)
+            client.tiles = True
+            logger.debug(f"Sent raster tiles to {username} in room {room_id}")
+            return
+
+        # Every joiner shares the room's cached init frame until history changes
+        if len(history) or since is not None:
+            client.send(history.init_frame_deflated() if compress_init else history.init_frame())
+            logger.debug(f"Sent {len(history)} history events to {username} in room {room_id}")
 
     async def disconnect(self, websocket: WebSocket, room_id: str):
         username = self.socket_user_map.pop(websocket, None)
+        client = self.clients.pop(websocket, None)
+        if client:
+            client.close()
+        if username:
+            self.cursors.remove_user(room_id, username)
+            await self.strokes.close_user(room_id, username)
         if (
             room_id in self.active_connections and
             websocket in self.active_connections[room_id]
@@ -50,7 +199,7 @@ class ConnectionManager:
             self.active_connections[room_id].remove(websocket)
             if username:
                 await self.broadcast(
-                    json.dumps({"type": "user_left", "username": username}),
+                    dumps({"type": "user_left", "username": username}),
                     room_id
                 )
                 logger.info(f"User {username} disconnected from room {room_id}")
@@ -59,148 +208,738 @@ class ConnectionManager:
                 del self.active_connections[room_id]
                 logger.debug(f"Room {room_id} has no active connections")
 
+    def _send_cursor_frame(self, room_id: str, frame: str):
+        # Keyed so the coalesce policy keeps only the newest combined frame queued
+        self.send_to_room(room_id, frame, "cursor", key="cursors")
+
+    async def _on_client_closed(self, client: ClientConnection):
+        await self.disconnect(client.websocket, client.room_id)
+
     async def send_personal_message(self, message: str, websocket: WebSocket):
+        client = self.clients.get(websocket)
+        if client:
+            client.send(message)
+            return
         try:
             await websocket.send_text(message)
         except Exception as e:
             logger.error(f"Error sending personal message: {e}")
 
-    async def save_room_history(self, room_id):
-        """Save room drawing history using CanvasService"""
-        async with AsyncSessionLocal() as session:
-            events = self.history.get(room_id, [])
-            await CanvasService.save_room_history(session, room_id, events)
+    def send_to_room(
+        self,
+        room_id: str,
+        message: str,
+        event_type: str = None,
+        key: str = None,
+        exclude: WebSocket = None,
+        record: EventRecord = None
+    ):
+        """Queue a frame on every connection in the room, on this node and any other"""
+        self._deliver_local(room_id, message, event_type, key, exclude)
+        if self.backplane:
+            self.backplane.publish(
+                room_id,
+                "frame",
+                payload=message,
+                event_type=event_type,
+                key=key,
+                record=list(record) if record else None
+            )
+
+    def _deliver_local(
+        self,
+        room_id: str,
+        message: str,
+        event_type: str = None,
+        key: str = None,
+        exclude: WebSocket = None
+    ):
+        binary = None
+        encoded = event_type not in STROKE_TYPES
+        for connection in self.active_connections.get(room_id, []):
+            if connection is exclude:
+                continue
+            client = self.clients.get(connection)
+            if not client:
+                continue
+            if client.binary and not encoded:
+                # Encode at most once per frame, and only when someone in the room speaks binary
+                binary = encode_stroke([loads(message)])
+                encoded = True
+            client.send(binary if client.binary and binary is not None else message, event_type, key)
+
+    async def _stream_to_room(
+        self,
+        room_id: str,
+        prefix: str,
+        pieces: AsyncIterator[str],
+        suffix: str,
+        event_type: str
+    ) -> bool:
+        """Send a large frame whose string field is streamed in pieces, serialized once for every recipient
+
+        Binary clients get sequenced fragments while the data is still being read; text clients and
+        other nodes get the assembled frame at the end.
+        """
+        recipients = [self.clients[ws] for ws in self.active_connections.get(room_id, []) if ws in self.clients]
+        binary_clients = [client for client in recipients if client.binary]
+        text_clients = [client for client in recipients if not client.binary]
+        parts = [] if text_clients or self.backplane else None
+        encoder = FragmentEncoder(next(self._transfer_ids), settings.SNAPSHOT_FRAGMENT_SIZE)
+
+        def emit(part: str):
+            if parts is not None:
+                parts.append(part)
+            for fragment in encoder.feed(part.encode()):
+                for client in binary_clients:
+                    client.send(fragment, event_type)
+
+        try:
+            emit(prefix)
+            async for piece in pieces:
+                # Escaped piece by piece, as dumps would escape the whole string
+                emit(dumps(piece)[1:-1])
+            emit(suffix)
+        except Exception as e:
+            logger.error(f"Error streaming {event_type} frame in room {room_id}: {e}", exc_info=True)
+            fragment = encoder.abort()
+            for client in binary_clients:
+                client.send(fragment, event_type)
+            return False
+
+        fragment = encoder.finish()
+        for client in binary_clients:
+            client.send(fragment, event_type)
+        if parts is not None:
+            message = "".join(parts)
+            for client in text_clients:
+                client.send(message, event_type)
+            if self.backplane:
+                self.backplane.publish(room_id, "frame", payload=message, event_type=event_type)
+        self.send_metrics["streamed_frames"] += 1
+        return True
+
+    def _deliver_stroke(self, room_id: str, data: Optional[bytes], messages: List[str], event_type: str):
+        """Relay a binary stroke frame to binary clients and as per-point JSON to the rest (and to all without a frame)"""
+        for connection in self.active_connections.get(room_id, []):
+            client = self.clients.get(connection)
+            if not client:
+                continue
+            if client.binary and data is not None:
+                client.send(data, event_type)
+            else:
+                for message in messages:
+                    client.send(message, event_type)
+
+    def owns_history(self, room_id: str) -> bool:
+        """Whether this node numbers, persists and checkpoints the room's history
+
+        Seqs must be unique and in one order on every node, so with a backplane only the room's
+        shard assigns them; the other nodes forward history writes to it.
+        """
+        return self.backplane is None or settings.SHARD_COUNT <= 1 or shard_for_room(room_id) == self.shard_index
+
+    async def _on_backplane_message(self, envelope: dict):
+        """Apply a frame published by another node to this node's connections and history"""
+        room_id = envelope["room"]
+        if envelope["kind"] == "delete":
+            self._drop_room_state(room_id)
+            return
+        if envelope["kind"] in ("append", "undo"):
+            if self.owns_history(room_id):
+                await self._append_forwarded(room_id, envelope)
+            return
+
+        # Only rooms loaded here keep a live copy; others load the log when someone joins
+        history = self.history.get(room_id)
+        # Nodes that predate polyline frames publish finished strokes as bare records
+        if envelope["kind"] == "record":
+            if history is not None:
+                await self._append_remote(room_id, history, EventRecord(*envelope["record"]))
+            return
+
+        if envelope.get("event_type") == "snapshots_history":
+            # Another node saved a snapshot in this room
+            self.snapshot_lists.discard(room_id)
+        elif envelope.get("event_type") == "chat":
+            # The sending node writes it; keep this node's chat tail current
+            event = loads(envelope["payload"])
+            chat_tail.add_remote(room_id, chat_entry(
+                event.get("username"),
+                event.get("message"),
+                parse_chat_timestamp(event.get("timestamp"))
+            ))
+
+        if envelope["kind"] == "stroke":
+            if history is not None:
+                for record in envelope["records"]:
+                    await self._append_remote(room_id, history, EventRecord(*record))
+            data = base64.b64decode(envelope["binary"]) if envelope.get("binary") else None
+            self._deliver_stroke(room_id, data, envelope["payloads"], envelope["event_type"])
+            return
+
+        if history is None and envelope.get("event_type") == "clear" and self.owns_history(room_id):
+            # The owner persists the clear even when nobody here is in the room
+            await self.load_room_history(room_id)
+            history = self.history[room_id]
+        if history is not None:
+            if envelope.get("record"):
+                await self._append_remote(room_id, history, EventRecord(*envelope["record"]))
+            elif envelope.get("event_type") == "clear":
+                await self._clear_room_history(room_id)
+                if self.owns_history(room_id):
+                    await self.checkpoint_room_history(room_id, cleared=True)
+        self._deliver_local(room_id, envelope["payload"], envelope.get("event_type"), envelope.get("key"))
+
+    async def _append_forwarded(self, room_id: str, envelope: dict):
+        """Number a history write another node forwarded to this owner node, and relay it to every node"""
+        if room_id not in self.history:
+            await self.load_room_history(room_id)
+        if envelope["kind"] == "undo":
+            record = await self.undo_user_stroke(room_id, envelope["author"], envelope["event_type"])
+        else:
+            record = await self.append_room_event(room_id, envelope["event_type"], envelope["message"], envelope["author"])
+        if record is not None:
+            self.send_to_room(room_id, record.raw, record.type, record=record)
+
+    async def append_room_event(self, room_id: str, event_type: str, message: str, author: str = None) -> Optional[EventRecord]:
+        """Record a drawing event in memory and queue it for the room log
+
+        Returns None if the event was forwarded to the room's owner node, which relays the record back.
+        """
+        if not self.owns_history(room_id):
+            self.backplane.publish(room_id, "append", event_type=event_type, message=message, author=author)
+            return None
+        history = self._room_history(room_id)
+        seq = history.next_seq()
+        if author is not None:
+            # Whose undo stack the record goes on; clients see it too
+            message = with_author(message, author)
+        # Stored and relayed with its seq, so clients can resume from the last one they saw
+        record = EventRecord(seq, event_type, with_seq(message, seq), author)
+        history.append(record)
+        await self._apply_to_raster(room_id, record)
+        self._send_revived(room_id, history)
+        self.uncompacted[room_id] = self.uncompacted.get(room_id, 0) + 1
+        if self.history_budget.over:
+            self._enforce_history_budget(room_id)
+
+        await self.persistence.enqueue_event(room_id, record)
+
+        if self.uncompacted[room_id] >= settings.HISTORY_COMPACTION_THRESHOLD:
+            await self.checkpoint_room_history(room_id)
+        return record
+
+    async def _append_remote(self, room_id: str, history: HistoryBuffer, record: EventRecord):
+        history.append_remote(record)
+        await self._apply_to_raster(room_id, record)
+        self._send_revived(room_id, history)
+
+    def _send_revived(self, room_id: str, history: HistoryBuffer):
+        """Send records an undone eraser brings back; clients that joined after they were culled never got them"""
+        revived = history.take_revived()
+        if revived:
+            # Each node culls on its own, so this goes to local connections only
+            frame = '{"type":"restore","history":[' + ','.join(record.raw for record in revived) + '],"seq":%d}' % history.seq
+            self._deliver_local(room_id, frame, "restore")
+
+    async def _apply_to_raster(self, room_id: str, record: EventRecord):
+        lock = self.raster_locks.get(room_id)
+        if lock is None:
+            return
+        async with lock:
+            raster = self.rasters.get(room_id)
+            # A raster rendered while the record waited for the lock may already include it
+            if raster is None or record.seq <= raster.seq:
+                return
+            if record.type in UNDO_EVENTS:
+                # Pixels can't be taken back out; what the target covered is redrawn from the live records
+                raster = await self._repaint_undone(room_id, raster, record)
+                if raster is not None:
+                    await self._send_tiles(room_id, raster)
+            else:
+                raster.apply(record)
+
+    async def _repaint_undone(self, room_id: str, raster: RoomRaster, record: EventRecord) -> Optional[RoomRaster]:
+        """Redraw the area of the stroke an undo/redo record targets, or the whole raster if that can't be bounded"""
+        history = self.history.get(room_id)
+        if history is None:
+            return None
+        target = loads(record.raw).get("target")
+        box = history.record_box(target) if isinstance(target, int) else None
+        records = []
+        if box is not None:
+            left, top = max(0, int(box[0]) - 2), max(0, int(box[1]) - 2)
+            right, bottom = min(raster.width, int(box[2]) + 3), min(raster.height, int(box[3]) + 3)
+            box = (left, top, right, bottom)
+            records = [item for item in history.region_records(box) if item.seq <= record.seq]
+        # Single brush/eraser points continue a path that may start outside the box
+        if box is None or box[0] >= box[2] or box[1] >= box[3] or any(item.type in ("brush", "eraser") for item in records):
+            raster = await self._render_raster(room_id, history, record.seq)
+            return raster if self.rasters.get(room_id) is raster else None
+
+        layer = self.bases.get(room_id)
+        base = layer.raster.image.crop(box) if layer is not None else None
+        patch = await asyncio.to_thread(render_region, box, records, base)
+        if self.rasters.get(room_id) is not raster:
+            return None
+        raster.paste(box, patch)
+        raster.seq = max(raster.seq, record.seq)
+        return raster
+
+    async def _render_raster(self, room_id: str, history: HistoryBuffer, seq: int) -> RoomRaster:
+        """Draw the room's raster from its base layer and live records up to seq off the event loop; lock held"""
+        layer = self.bases.get(room_id)
+        base = layer.raster.image.copy() if layer is not None else None
+        records = [record for record in history.live_records() if record.seq <= seq]
+        raster = await asyncio.to_thread(render_history, records, base, layer.seq if layer is not None else 0)
+        # Undone records and the undo records themselves are accounted for too
+        raster.seq = max(raster.seq, seq)
+        # Kept unless the room was unloaded or deleted meanwhile
+        if self.history.get(room_id) is history:
+            self.rasters[room_id] = raster
+        return raster
+
+    async def _send_tiles(self, room_id: str, raster: RoomRaster):
+        """Repaint clients that joined from raster tiles, whose tiles may hold a stroke just undone or redone"""
+        if not any(client.tiles for client in self._room_clients(room_id)):
+            return
+        await raster.encode_dirty()
+        frame = raster.tiles_frame()
+        # Read again after the encode; clients may have joined or left meanwhile
+        for client in self._room_clients(room_id):
+            if client.tiles:
+                client.send(frame, "tiles")
+
+    def _room_clients(self, room_id: str) -> List[ClientConnection]:
+        return [self.clients[ws] for ws in self.active_connections.get(room_id, []) if ws in self.clients]
+
+    async def undo_user_stroke(self, room_id: str, username: str, event_type: str) -> Optional[EventRecord]:
+        """Undo (or redo) the user's latest stroke, recorded as a small undo/redo history record"""
+        if not username:
+            return None
+        # A stroke still being drawn is finished first, so that is the one undone
+        await self.strokes.close_user(room_id, username)
+        if not self.owns_history(room_id):
+            # Queued behind that stroke, so the owner sees it before picking the target
+            self.backplane.publish(room_id, "undo", event_type=event_type, author=username)
+            return None
+        undo = self._room_history(room_id).undo
+        target = undo.last_done(username) if event_type == "undo" else undo.last_undone(username)
+        if target is None:
+            return None
+        return await self.append_room_event(room_id, event_type, dumps({"type": event_type, "target": target}), username)
+
+    async def _clear_room_history(self, room_id: str):
+        history = self._room_history(room_id)
+        self.bases.pop(room_id, None)
+        history.clear()
+        lock = self.raster_locks.get(room_id)
+        if lock is not None:
+            # Records appended while this waits for the lock come after the clear
+            seq = history.seq
+            async with lock:
+                if room_id in self.rasters:
+                    self.rasters[room_id].clear(seq)
+
+    async def _room_raster(self, room_id: str) -> RoomRaster:
+        """The room's rendered canvas with its tiles encoded, drawn from its history the first time it is needed"""
+        lock = self.raster_locks.setdefault(room_id, asyncio.Lock())
+        async with lock:
+            raster = self.rasters.get(room_id)
+            if raster is None:
+                history = self._room_history(room_id)
+                raster = await self._render_raster(room_id, history, history.seq)
+            await raster.encode_dirty()
+        return raster
+
+    async def _append_stroke(self, room_id: str, polyline: dict, author: str = None):
+        """Record a finished polyline; its points were already relayed live as they arrived"""
+        record = await self.append_room_event(room_id, "polyline", dumps(polyline), author)
+        if record is None:
+            return
+        # Clients swap the author's live points for it, so they know which seq an undo takes away
+        self.send_to_room(room_id, record.raw, "polyline", record=record)
+
+    async def checkpoint_room_history(self, room_id: str, cleared: bool = False):
+        """Queue a checkpoint of the in-memory room history and its base layer"""
+        self.uncompacted[room_id] = 0
+        if not self.owns_history(room_id):
+            return
+        if settings.ERASER_CULLING and not cleared and room_id in self.history:
+            culled = await self._cull_erased(room_id)
+            if room_id not in self.history:
+                # Unloaded or deleted while culling
+                return
+            if culled:
+                logger.debug(f"Culled {culled} erased records in room {room_id}")
+        base = None if cleared else BASE_UNCHANGED
+        on_commit = None
+        layer = self.bases.get(room_id)
+        if layer is not None and not layer.persisted:
+            data = await self._refresh_base(room_id)
+            if room_id not in self.history or self.bases.get(room_id) is not layer:
+                # Cleared or unloaded while encoding; that path checkpoints on its own
+                return
+            base = (layer.seq, data)
+            # Until the write commits, the room can't be unloaded without losing the layer
+            on_commit = lambda: layer.mark_persisted(data)
+        history = self._room_history(room_id)
+        await self.persistence.enqueue_checkpoint(room_id, history.seq, list(history.records), base, on_commit)
+
+    async def compact_rooms(self) -> int:
+        """Checkpoint every loaded room with events or a base layer not yet in its checkpoint"""
+        rooms = [
+            room_id for room_id in list(self.history)
+            if self.uncompacted.get(room_id) or (room_id in self.bases and not self.bases[room_id].persisted)
+        ]
+        for room_id in rooms:
+            if room_id in self.history:
+                await self.checkpoint_room_history(room_id)
+        if rooms:
+            logger.debug(f"Compacted history of {len(rooms)} rooms")
+        return len(rooms)
 
     async def load_room_history(self, room_id):
         """Load room drawing history using CanvasService"""
+        if room_id in self.unloaded_rooms:
+            await self.persistence.drain()
+            self.unloaded_rooms.discard(room_id)
         async with AsyncSessionLocal() as session:
-            self.history[room_id] = await CanvasService.load_room_history(session, room_id)
+            events, seq, base = await CanvasService.load_room_history(session, room_id, self.owns_history(room_id))
+        if room_id in self.history:
+            self.history[room_id].release()
+        self.bases.pop(room_id, None)
+        if base is None:
+            self.history[room_id] = self._new_history(room_id, events, seq)
+        else:
+            base_seq, data = base
+            if RASTER_AVAILABLE:
+                self.bases[room_id] = BaseLayer(data, base_seq)
+            self.history[room_id] = self._new_history(room_id, events, seq, base_record(data, base_seq), base_seq)
+        self.uncompacted[room_id] = 0
+        if self.history_budget.over:
+            self._enforce_history_budget(room_id)
+
+    def _room_history(self, room_id: str) -> HistoryBuffer:
+        history = self.history.get(room_id)
+        if history is None:
+            history = self.history[room_id] = self._new_history(room_id)
+        return history
+
+    def _new_history(self, room_id: str, events=(), seq: int = 0, base: str = None, floor: int = None) -> HistoryBuffer:
+        # Without Pillow there is no base layer and evicted events are only kept in the room log
+        on_evict = (lambda records: self._fold_into_base(room_id, records)) if RASTER_AVAILABLE else None
+        return HistoryBuffer(events, seq, self.history_budget, on_evict=on_evict, base=base, floor=floor)
+
+    async def _cull_erased(self, room_id: str) -> int:
+        """Cull the room's erased records, rendering eraser masks in a worker thread on a snapshot of its history"""
+        history = self.history[room_id]
+        snapshot = history.cull_snapshot()
+        if snapshot is None:
+            return 0
+        seq = history.seq
+        erased = await asyncio.to_thread(find_erased, *snapshot, self._base_drawn(room_id))
+        if self.history.get(room_id) is not history:
+            return 0
+        return history.apply_cull(erased, snapshot[2], seq)
+
+    def _base_drawn(self, room_id: str):
+        """Whether the room's base layer has pixels in a box, or None if it has no base layer"""
+        layer = self.bases.get(room_id)
+        if layer is None:
+            return None
+        # A copy, since records may be folded into the layer while a worker thread reads it
+        image = layer.raster.image.copy()
+        return lambda box: image.crop((int(box[0]), int(box[1]), int(box[2]) + 1, int(box[3]) + 1)).getbbox() is not None
+
+    async def _region_base(self, room_id: str, box: Box) -> Optional[str]:
+        """The part of the room's base layer under box, as a base entry offset to the box corner"""
+        layer = self.bases.get(room_id)
+        if layer is None:
+            return None
+        left, top = max(0, int(box[0])), max(0, int(box[1]))
+        crop = layer.raster.image.crop((left, top, int(box[2]) + 1, int(box[3]) + 1))
+        if crop.getbbox() is None:
+            return None
+        data = await asyncio.to_thread(encode_png, crop)
+        return dumps({"type": "base", "image": data, "seq": layer.seq, "x": left, "y": top})
+
+    def _fold_into_base(self, room_id: str, records: List[EventRecord]):
+        layer = self.bases.get(room_id)
+        if layer is None:
+            layer = self.bases[room_id] = BaseLayer()
+        layer.fold(records)
+
+    async def _refresh_base(self, room_id: str) -> Optional[str]:
+        """Re-encode the room's base layer if events were folded in, and lead its init frame with it"""
+        layer = self.bases.get(room_id)
+        if layer is None:
+            return None
+        data = await layer.encode()
+        history = self.history.get(room_id)
+        if history is not None and self.bases.get(room_id) is layer:
+            history.set_base(layer.record())
+        return data
+
+    def _unload_room_history(self, room_id: str):
+        history = self.history.pop(room_id, None)
+        if history is not None:
+            history.release()
+        self.uncompacted.pop(room_id, None)
+        self.rasters.pop(room_id, None)
+        self.raster_locks.pop(room_id, None)
+        self.bases.pop(room_id, None)
+
+    def _enforce_history_budget(self, current_room: str):
+        """Get back under HISTORY_MAX_TOTAL_BYTES: unload idle rooms first, then trim the largest"""
+        budget = self.history_budget
+        # Rooms nobody here is connected to are fully persisted and reload on the next join
+        idle = sorted(
+            (
+                room_id for room_id in self.history
+                if room_id != current_room and room_id not in self.active_connections
+                # A base layer not yet checkpointed would be lost with the room
+                and (room_id not in self.bases or self.bases[room_id].persisted)
+            ),
+            key=lambda room_id: self.history[room_id].bytes,
+            reverse=True
+        )
+        for room_id in idle:
+            if not budget.over:
+                return
+            self._unload_room_history(room_id)
+            self.unloaded_rooms.add(room_id)
+            logger.debug(f"Unloaded history of idle room {room_id} to stay within the memory budget")
+
+        while budget.over:
+            room_id = max(self.history, key=lambda room_id: self.history[room_id].bytes)
+            history = self.history[room_id]
+            if len(history) <= 1:
+                break
+            freed = history.evict_oldest(max(1, len(history) // 10))
+            logger.warning(f"History memory budget exceeded, evicted {freed} bytes of oldest events in room {room_id}")
 
     async def broadcast(self, message: str, room_id: str, username: str = None, sender_ws: WebSocket = None):
-        try:
-            event = json.loads(message)
-            event_type = event.get('type')
-        except Exception as e:
-            logger.error(f"Error parsing WebSocket message: {e}")
-            event_type = None
+        # Everything one inbound message does shares a single session, checked out only if it is needed
+        async with UnitOfWork() as uow:
+            await self._handle_message(message, room_id, username, sender_ws, uow)
+
+    async def _handle_message(self, message: str, room_id: str, username: str, sender_ws: WebSocket, uow: UnitOfWork):
+        # Parse once; everything downstream works off the decoded event and its type
+        event, event_type = parse_event(message)
+        if event is None:
+            logger.error(f"Error parsing WebSocket message in room {room_id}")
+            event = {}
+        record = None
+
+        if event_type == "cursor" and self.cursors.enabled:
+            self.cursors.update(room_id, username, event)
+            return
 
         if event_type == "chat":
-            async with AsyncSessionLocal() as session:
-                from datetime import datetime
-                await CanvasService.save_chat_message(
-                    session,
-                    room_id,
-                    event.get("username"),
-                    event.get("message"),
-                    event.get("timestamp") or datetime.utcnow()
-                )
+            # The sender is whoever the socket authenticated as, not what the frame claims
+            sender = username or event.get("username")
+            if not isinstance(event.get("message"), str) or not isinstance(sender, str):
+                logger.warning(f"Dropped malformed chat message from {username} in room {room_id}")
+                return
+            if event.get("username") != sender:
+                message = dumps({**event, "username": sender})
+            # Written by the persistence worker with the rest of its batch; readers see it in the chat tail now
+            await self.persistence.enqueue_chat(CanvasService.record_chat_message(
+                room_id,
+                sender,
+                event["message"],
+                event.get("timestamp")
+            ))
 
         if event_type == "clear":
-            async with AsyncSessionLocal() as session:
-                is_admin = await RoomService.is_room_admin(session, room_id, username)
+            is_admin = await RoomService.is_room_admin(uow.session, room_id, username)
+            # Clearing only waits on the persistence queue and the raster
+            await uow.release()
             if is_admin:
-                self.history[room_id] = []
-                await self.save_room_history(room_id)
+                self.strokes.discard_room(room_id)
+                await self._clear_room_history(room_id)
+                await self.checkpoint_room_history(room_id, cleared=True)
                 logger.info(f"Room {room_id} cleared by admin {username}")
             else:
                 logger.warning(f"Non-admin user {username} attempted to clear room {room_id}")
-                for connection in self.active_connections.get(room_id, []):
-                    try:
-                        await connection.send_text(json.dumps({"type": "error", "message": "Only the room admin can clear the board."}))
-                    except:
-                        pass
+                self.send_to_room(room_id, dumps({"type": "error", "message": "Only the room admin can clear the board."}))
                 return
 
         elif event_type == "delete_room":
-            async with AsyncSessionLocal() as session:
-                is_admin = await RoomService.is_room_admin(session, room_id, username)
+            is_admin = await RoomService.is_room_admin(uow.session, room_id, username)
             if is_admin:
-                await self.delete_room(room_id)
+                # Notify before the room's connection list is dropped
+                self.send_to_room(room_id, dumps({"type": "info", "message": "Room deleted by admin."}))
+                await self.delete_room(room_id, uow.session)
                 logger.info(f"Room {room_id} deleted by admin {username}")
-                for connection in self.active_connections.get(room_id, []):
-                    try:
-                        await connection.send_text(json.dumps({"type": "info", "message": "Room deleted by admin."}))
-                    except:
-                        pass
             else:
                 logger.warning(f"Non-admin user {username} attempted to delete room {room_id}")
-                for connection in self.active_connections.get(room_id, []):
-                    try:
-                        await connection.send_text(json.dumps({"type": "error", "message": "Only admin can delete the room."}))
-                    except:
-                        pass
+                self.send_to_room(room_id, dumps({"type": "error", "message": "Only admin can delete the room."}))
             return
 
-        elif event_type not in ("cursor", "undo", "chat"):
-            self.history.setdefault(room_id, []).append(message)
-            if len(self.history[room_id]) > settings.MAX_HISTORY_PER_ROOM:
-                self.history[room_id] = self.history[room_id][-settings.MAX_HISTORY_PER_ROOM:]
-            await self.save_room_history(room_id)
+        elif event_type in UNDO_EVENTS:
+            record = await self.undo_user_stroke(room_id, username, event_type)
+            if record is None:
+                return
+            message = record.raw
+
+        elif event_type in STROKE_TYPES and self.strokes.enabled:
+            await self.strokes.add(room_id, username, event)
+            if username:
+                # Lets clients match the live points to the polyline that later replaces them
+                message = with_author(message, username)
+
+        elif is_history_event(event_type):
+            record = await self.append_room_event(room_id, event_type, message, username)
+            if record is None:
+                return
+            message = record.raw
 
         if event_type == "save_snapshot":
-            async with AsyncSessionLocal() as session:
-                await SnapshotService.save_snapshot(
-                    session,
-                    room_id,
-                    event["snapshot"],
-                    event["username"]
-                )
-                snaphistory = await SnapshotService.get_snapshots_by_room(session, room_id)
-            for connection in self.active_connections.get(room_id, []):
-                try:
-                    await connection.send_text(json.dumps({
-                        "type": "snapshots_history",
-                        "snapshots": snaphistory
-                    }))
-                except:
-                    pass
+            snapshot = await SnapshotService.save_snapshot(
+                uow.session,
+                room_id,
+                event["snapshot"],
+                event["username"]
+            )
+            if snapshot is not None:
+                self.snapshot_lists.add(room_id, snapshot)
+            page = await self.snapshot_lists.page(room_id, db=uow.session)
+            if page is not None:
+                self.send_to_room(room_id, self._snapshot_list_frame(*page), "snapshots_history")
             return
 
         if event_type == "restore_snapshot":
-            async with AsyncSessionLocal() as session:
-                snap_data = await SnapshotService.get_snapshot_data(session, event["snapshot_id"])
             restored_by = event["username"]
-            if snap_data:
-                logger.info(f"Snapshot {event['snapshot_id']} restored in room {room_id} by {restored_by}")
-                for connection in self.active_connections.get(room_id, []):
-                    try:
-                        await connection.send_text(json.dumps({
-                            "type": "snapshot_restored",
-                            "snapshot_id": event["snapshot_id"],
-                            "snapshot_data": snap_data,
-                            "restored_by": restored_by
-                        }))
-                    except:
-                        pass
+            pieces = await SnapshotService.open_snapshot_stream(uow.session, event["snapshot_id"])
+            if pieces is not None:
+                header = dumps({
+                    "type": "snapshot_restored",
+                    "snapshot_id": event["snapshot_id"],
+                    "restored_by": restored_by
+                })
+                # snapshot_data goes last so it can be streamed into the frame
+                if await self._stream_to_room(room_id, header[:-1] + ',"snapshot_data":"', pieces, '"}', event_type):
+                    logger.info(f"Snapshot {event['snapshot_id']} restored in room {room_id} by {restored_by}")
             return
 
         if event_type == "get_snapshots":
-            async with AsyncSessionLocal() as session:
-                snaphistory = await SnapshotService.get_snapshots_by_room(session, room_id)
-            for connection in self.active_connections.get(room_id, []):
-                try:
-                    await connection.send_text(json.dumps({
-                        "type": "snapshots_history",
-                        "snapshots": snaphistory
-                    }))
-                except:
-                    pass
-            return
-
-        disconnected = []
-        for connection in self.active_connections.get(room_id, []):
-            
-            if sender_ws and connection == sender_ws and event_type in (
-                "webrtc-offer", "webrtc-answer", "webrtc-candidate"
-            ):
-                continue
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting to client in room {room_id}: {e}")
-                disconnected.append(connection)
-        for conn in disconnected:
-            await self.disconnect(conn, room_id)
+            before = event.get("before")
+            if not isinstance(before, int) or isinstance(before, bool):
+                before = None
+            page = await self.snapshot_lists.page(room_id, before, uow.session)
+            if page is not None:
+                self._reply(room_id, sender_ws, self._snapshot_list_frame(*page, before), "snapshots_history")
+            return
+
+        if event_type == "get_chat_history":
+            before = event.get("before")
+            if not isinstance(before, int) or isinstance(before, bool):
+                before = None
+            messages, next_before = await self._chat_page(uow.session, room_id, before)
+            self._reply(room_id, sender_ws, self._chat_history_frame(messages, next_before, before), "chat_history")
+            return
+
+        if event_type == "get_region":
+            values = [event.get(key) for key in ("x", "y", "width", "height")]
+            if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+                x, y, width, height = values
+                base = await self._region_base(room_id, (x, y, x + width, y + height))
+                frame = self._room_history(room_id).region_frame(x, y, width, height, base)
+                self._reply(room_id, sender_ws, frame, "region")
+            return
+
+        # Fan-out only queues frames; each connection's writer task does the network I/O
+        exclude = None
+        if sender_ws and event_type in ("webrtc-offer", "webrtc-answer", "webrtc-candidate"):
+            exclude = sender_ws
+        key = f"cursor:{username}" if event_type == "cursor" else None
+        self.send_to_room(room_id, message, event_type, key, exclude=exclude, record=record)
+
+    async def _chat_page(self, db: AsyncSession, room_id: str, before: int = None):
+        """A chat page whose next_before is set whenever older messages exist"""
+        messages, next_before = await CanvasService.get_chat_page(db, room_id, before)
+        unstored = before is None and next_before is None and messages and messages[0]["id"] is None
+        if unstored and len(messages) >= settings.MAX_CHAT_HISTORY:
+            # None of the newest page is stored yet, so no row says where older pages start; let the queued
+            # writes land and read the page from the table, where every message has its id
+            await self.persistence.drain()
+            chat_tail.discard(room_id)
+            messages, next_before = await CanvasService.get_chat_page(db, room_id, before)
+        return messages, next_before
+
+    def _reply(self, room_id: str, sender_ws: WebSocket, frame: str, event_type: str):
+        """Send a frame that only concerns whoever asked for it, e.g. a listing page"""
+        client = self.clients.get(sender_ws)
+        if client is not None:
+            client.send(frame, event_type)
+        else:
+            self.send_to_room(room_id, frame, event_type)
+
+    @staticmethod
+    def _chat_history_frame(messages: List[dict], next_before: Optional[int], before: int = None) -> str:
+        return dumps({
+            "type": "chat_history",
+            "messages": messages,
+            # Same paging contract as snapshots_history; before is null for the join backlog
+            "before": before,
+            "next_before": next_before
+        })
+
+    @staticmethod
+    def _snapshot_list_frame(snapshots: List[dict], next_before: Optional[int], before: int = None) -> str:
+        return dumps({
+            "type": "snapshots_history",
+            "snapshots": snapshots,
+            # Pass next_before back as before to get the next older page; before says which page this is
+            "before": before,
+            "next_before": next_before
+        })
+
+    async def broadcast_binary(self, data: bytes, room_id: str, username: str = None):
+        """Relay a binary stroke frame; its points are recorded as regular JSON history events"""
+        try:
+            events = decode_stroke(data)
+        except ValueError as e:
+            logger.error(f"Invalid binary frame from {username} in room {room_id}: {e}")
+            return
+
+        event_type = events[0]["type"]
+        messages = []
+        records = []
+        for event in events:
+            # Only the server names the author and numbers history
+            event.pop("author", None)
+            event.pop("seq", None)
+            message = dumps(event)
+            if self.strokes.enabled:
+                messages.append(with_author(message, username) if username else message)
+                await self.strokes.add(room_id, username, event)
+            else:
+                records.append(await self.append_room_event(room_id, event_type, message, username))
+        if None in records:
+            # Forwarded to the room's owner node, which relays the numbered points to every node
+            return
+
+        if records:
+            # Each point is a history record; peers need its seq to resume from and to undo it
+            messages = [record.raw for record in records]
+            data = encode_stroke([loads(message) for message in messages])
+        elif username:
+            # Relayed with the author, so clients can match the live points to the polyline that replaces them
+            data = encode_stroke([{**event, "author": username} for event in events])
+        self._deliver_stroke(room_id, data, messages, event_type)
+        if self.backplane:
+            self.backplane.publish(
+                room_id,
+                "stroke",
+                payloads=messages,
+                event_type=event_type,
+                records=[list(record) for record in records],
+                binary=base64.b64encode(data).decode() if data is not None else None
+            )
 
     def list_rooms(self):
         return list(self.rooms)
@@ -212,15 +951,36 @@ class ConnectionManager:
             room = await RoomService.create_room(session, room_name, admin_username)
             return room is not None
 
-    async def delete_room(self, room_id: str):
-        """Delete room using RoomService"""
+    async def delete_room(self, room_id: str, db: AsyncSession = None):
+        """Delete room using RoomService, on the caller's session if it has one"""
         if room_id in self.rooms:
             self.rooms.remove(room_id)
+
+        if db is not None:
+            # The caller's admin check must not hold a connection the persistence worker needs to drain
+            await db.close()
+        # Let queued log writes land first so they can't outlive the room
+        await self.persistence.drain()
         
-        async with AsyncSessionLocal() as session:
-            await RoomService.delete_room(session, room_id)
-        
+        if db is not None:
+            await RoomService.delete_room(db, room_id)
+        else:
+            async with AsyncSessionLocal() as session:
+                await RoomService.delete_room(session, room_id)
+
+        self._drop_room_state(room_id)
+        if self.backplane:
+            self.backplane.publish(room_id, "delete")
+
+    def _drop_room_state(self, room_id: str):
+        """Forget a deleted room's connections, history and pending cursors on this node"""
+        self.rooms.discard(room_id)
         if room_id in self.active_connections:
             del self.active_connections[room_id]
-        if room_id in self.history:
-            del self.history[room_id]
+        self._unload_room_history(room_id)
+        self.unloaded_rooms.discard(room_id)
+        self.cursors.discard_room(room_id)
+        self.strokes.discard_room(room_id)
+        self.snapshot_lists.discard(room_id)
+        chat_tail.discard(room_id)
+        room_cache.invalidate(room_id)
@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.database import AsyncSessionLocal
+from app.services.canvas_service import BASE_UNCHANGED, CanvasService
+from app.core.config import settings
+from app.core.events import EventRecord
+from app.core.logger import logger
+
+
+class PersistenceWorker:
+    """Write-behind queue that group-commits room event log and chat writes in the background"""
+
+    def __init__(
+        self,
+        max_queue_size: int = settings.PERSIST_QUEUE_MAXSIZE,
+        batch_size: int = settings.PERSIST_BATCH_SIZE,
+        flush_interval_ms: int = settings.PERSIST_FLUSH_INTERVAL_MS
+    ):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._task: asyncio.Task | None = None
+        self.metrics: Dict[str, int] = {
+            "enqueued": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "blocked_puts": 0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("Persistence worker started")
+
+    async def stop(self):
+        """Flush everything still queued, then stop the worker"""
+        if self._task is None:
+            return
+        await self.drain()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Persistence worker stopped ({self.metrics['written']} items written)")
+
+    async def drain(self):
+        """Wait until every queued item has been committed (or failed)"""
+        if self._task is not None and not self._task.done():
+            await self.queue.join()
+
+    async def enqueue_event(self, room_id: str, record: EventRecord):
+        await self._put(("event", room_id, record))
+
+    async def enqueue_chat(self, item: Tuple[str, datetime, dict]):
+        """Queue a (room_id, timestamp, tail entry) item from CanvasService.record_chat_message"""
+        await self._put(("chat", item))
+
+    async def enqueue_checkpoint(
+        self,
+        room_id: str,
+        seq: int,
+        events: List[EventRecord],
+        base: Any = BASE_UNCHANGED,
+        on_commit: Optional[Callable[[], None]] = None
+    ):
+        """Queue a checkpoint; on_commit runs once it is committed, and never if the write fails"""
+        await self._put(("checkpoint", room_id, seq, events, base, on_commit))
+
+    async def _put(self, item: Tuple):
+        self.metrics["enqueued"] += 1
+        if self.queue.full():
+            # Backpressure: the caller waits for the worker instead of dropping writes
+            self.metrics["blocked_puts"] += 1
+            logger.warning(f"Persistence queue full ({self.queue.qsize()} items), applying backpressure")
+            await self.queue.put(item)
+        else:
+            self.queue.put_nowait(item)
+        self.metrics["max_depth"] = max(self.metrics["max_depth"], self.queue.qsize())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.error(f"Persistence worker flush error: {e}", exc_info=True)
+                self.metrics["failed"] += len(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: List[Tuple]):
+        ok = await self._write(batch)
+        self.metrics["batches"] += 1
+        if ok or len(batch) == 1:
+            self.metrics["written" if ok else "failed"] += len(batch)
+            if ok:
+                self._committed(batch)
+            return
+        # One bad item must not take every room's writes in the group commit down with it
+        logger.warning(f"Batch of {len(batch)} writes failed, retrying them one at a time")
+        for item in batch:
+            ok = await self._write([item])
+            self.metrics["written" if ok else "failed"] += 1
+            if ok:
+                self._committed([item])
+
+    @staticmethod
+    def _committed(items: List[Tuple]):
+        for item in items:
+            if item[0] == "checkpoint" and item[5] is not None:
+                try:
+                    item[5]()
+                except Exception as e:
+                    logger.error(f"Checkpoint commit callback error in room {item[1]}: {e}", exc_info=True)
+
+    async def _write(self, batch: List[Tuple]) -> bool:
+        """Write a batch in one commit, returning False if it was rolled back"""
+        events: List[Dict[str, Any]] = []
+        chats: List[Tuple[str, datetime, dict]] = []
+        checkpoints: Dict[str, Tuple[int, List[EventRecord], Any]] = {}
+        for item in batch:
+            if item[0] == "event":
+                _, room_id, record = item
+                events.append({"room_id": room_id, "seq": record.seq, "event_type": record.type, "payload": record.raw})
+            elif item[0] == "chat":
+                chats.append(item[1])
+            else:
+                # A later checkpoint for the same room supersedes an earlier one, except
+                # that an unchanged base keeps a new base layer the earlier one carried
+                _, room_id, seq, room_events, base, _ = item
+                if base is BASE_UNCHANGED and room_id in checkpoints:
+                    base = checkpoints[room_id][2]
+                checkpoints[room_id] = (seq, room_events, base)
+
+        async with AsyncSessionLocal() as session:
+            return await CanvasService.write_event_batch(session, events, checkpoints, chats)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {**self.metrics, "queue_depth": self.queue.qsize(), "queue_capacity": self.queue.maxsize}
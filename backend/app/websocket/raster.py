@@ -0,0 +1,272 @@
+import asyncio
+import base64
+import io
+from typing import Dict, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.core.events import EventRecord, loads, dumps
+from app.core.logger import logger
+
+# Optional Pillow renderer; without it joiners always get the vector init frame
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+RASTER_AVAILABLE = Image is not None
+
+TRANSPARENT = (0, 0, 0, 0)
+
+
+def _color(value, default=(0, 0, 0, 255)) -> tuple:
+    try:
+        return ImageColor.getcolor(value, "RGBA")
+    except (AttributeError, TypeError, ValueError):
+        return default
+
+
+def _number(event: dict, key: str, default: float = 0) -> float:
+    value = event.get(key, default)
+    return value if isinstance(value, (int, float)) else default
+
+
+class RoomRaster:
+    """Server-side rendering of a room's drawing history, split into PNG tiles with dirty tracking"""
+
+    def __init__(
+        self,
+        width: int = settings.CANVAS_WIDTH,
+        height: int = settings.CANVAS_HEIGHT,
+        tile_size: int = settings.RASTER_TILE_SIZE,
+        image: Optional["Image.Image"] = None,
+        seq: int = 0
+    ):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.image = Image.new("RGBA", (width, height), TRANSPARENT)
+        if image is not None:
+            self.image.paste(image.convert("RGBA"), (0, 0))
+        self._draw = ImageDraw.Draw(self.image)
+        # Last history seq drawn into the image
+        self.seq = seq
+        # Single-point brush/eraser events continue one shared path, as on the client canvas
+        self._pen: Optional[Tuple[float, float]] = None
+        self._tiles: Dict[Tuple[int, int], str] = {}
+        self._dirty: Set[Tuple[int, int]] = set(self._all_tiles())
+        self._frame: Optional[str] = None
+        self.metrics: Dict[str, int] = {"applied": 0, "tiles_encoded": 0}
+
+    def _all_tiles(self):
+        for ty in range(-(-self.height // self.tile_size)):
+            for tx in range(-(-self.width // self.tile_size)):
+                yield tx, ty
+
+    def _touch(self, x0: float, y0: float, x1: float, y1: float, pad: float = 0):
+        """Mark the tiles under a bounding box as needing re-encoding"""
+        left = max(0, int(min(x0, x1) - pad) // self.tile_size)
+        top = max(0, int(min(y0, y1) - pad) // self.tile_size)
+        right = min(self.width - 1, int(max(x0, x1) + pad)) // self.tile_size
+        bottom = min(self.height - 1, int(max(y0, y1) + pad)) // self.tile_size
+        for ty in range(top, bottom + 1):
+            for tx in range(left, right + 1):
+                self._dirty.add((tx, ty))
+        self._frame = None
+
+    def apply(self, record: EventRecord):
+        """Draw one history record"""
+        try:
+            event = loads(record.raw)
+            self._render(record.type, event)
+        except Exception as e:
+            logger.error(f"Raster render error for {record.type} event {record.seq}: {e}")
+        self.seq = max(self.seq, record.seq)
+        self.metrics["applied"] += 1
+
+    def _render(self, event_type: Optional[str], event: dict):
+        if event_type in ("brush", "eraser"):
+            point = (_number(event, "x"), _number(event, "y"))
+            start = self._pen or point
+            self._pen = point
+            self._stroke(event_type, [start, point], event)
+        elif event_type == "polyline":
+            points = [tuple(point) for point in event.get("points", []) if len(point) == 2]
+            if points:
+                self._pen = points[-1]
+                self._stroke(event.get("tool"), points, event)
+        elif event_type == "rectangle":
+            x, y = _number(event, "startX"), _number(event, "startY")
+            w, h = _number(event, "width"), _number(event, "height")
+            box = [min(x, x + w), min(y, y + h), max(x, x + w), max(y, y + h)]
+            width = max(1, round(_number(event, "thickness", 1)))
+            self._draw.rectangle(box, outline=_color(event.get("color")), width=width)
+            self._touch(*box, pad=width)
+        elif event_type == "ellipse":
+            cx, cy = _number(event, "centerX"), _number(event, "centerY")
+            rx, ry = abs(_number(event, "radiusX")), abs(_number(event, "radiusY"))
+            box = [cx - rx, cy - ry, cx + rx, cy + ry]
+            width = max(1, round(_number(event, "thickness", 1)))
+            self._draw.ellipse(box, outline=_color(event.get("color")), width=width)
+            self._touch(*box, pad=width)
+        elif event_type == "text" and event.get("text"):
+            size = max(1, round(_number(event, "fontSize", 18)))
+            x, y = _number(event, "x"), _number(event, "y")
+            try:
+                font = ImageFont.load_default(size=size)
+            except TypeError:
+                font = ImageFont.load_default()
+            # Canvas fillText anchors at the left end of the baseline
+            self._draw.text((x, y), str(event["text"]), fill=_color(event.get("color")), font=font, anchor="ls")
+            self._touch(*self._draw.textbbox((x, y), str(event["text"]), font=font, anchor="ls"))
+
+    def _stroke(self, tool: Optional[str], points: List[Tuple[float, float]], event: dict):
+        width = max(1, round(_number(event, "thickness", 1)))
+        # Erasing writes transparent pixels, like destination-out on the client
+        fill = TRANSPARENT if tool == "eraser" else _color(event.get("color"))
+        if len(points) > 1:
+            self._draw.line(points, fill=fill, width=width, joint="curve")
+        # Round caps at the ends, and a dot for a single point
+        radius = width / 2
+        for x, y in {points[0], points[-1]}:
+            self._draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=fill)
+        xs = [x for x, _ in points]
+        ys = [y for _, y in points]
+        self._touch(min(xs), min(ys), max(xs), max(ys), pad=width)
+
+    def clear(self, seq: int = None):
+        self._draw.rectangle([0, 0, self.width, self.height], fill=TRANSPARENT)
+        self._pen = None
+        self._touch(0, 0, self.width, self.height)
+        if seq is not None:
+            self.seq = max(self.seq, seq)
+
+    def paste(self, box: Tuple[int, int, int, int], image: "Image.Image"):
+        """Replace the pixels in box, e.g. with a region redrawn by render_region"""
+        self.image.paste(image, box[:2])
+        self._touch(box[0], box[1], box[2] - 1, box[3] - 1)
+
+    def _crop_tile(self, tile: Tuple[int, int]) -> "Image.Image":
+        left, top = tile[0] * self.tile_size, tile[1] * self.tile_size
+        return self.image.crop((left, top, min(left + self.tile_size, self.width), min(top + self.tile_size, self.height)))
+
+    def _store_tiles(self, encoded: Dict[Tuple[int, int], Optional[str]]):
+        for tile, data in encoded.items():
+            if data is None:
+                # Fully transparent tiles are left out of the frame
+                self._tiles.pop(tile, None)
+            else:
+                self._tiles[tile] = data
+                self.metrics["tiles_encoded"] += 1
+
+    async def encode_dirty(self):
+        """Re-encode the tiles drawn on since the last frame, off the event loop"""
+        while self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            # Encode copies so tiles drawn on meanwhile can't tear; those are dirty again and go next round
+            crops = {tile: self._crop_tile(tile) for tile in dirty}
+            self._store_tiles(await asyncio.to_thread(_encode_tiles, crops))
+
+    def tiles_frame(self) -> str:
+        """A 'tiles' frame for joiners; tiles still dirty are encoded in place, so await encode_dirty first"""
+        if self._dirty:
+            self._store_tiles(_encode_tiles({tile: self._crop_tile(tile) for tile in self._dirty}))
+            self._dirty.clear()
+        if self._frame is None:
+            self._frame = dumps({
+                "type": "tiles",
+                "tile_size": self.tile_size,
+                "width": self.width,
+                "height": self.height,
+                "tiles": [{"x": tx, "y": ty, "data": data} for (tx, ty), data in sorted(self._tiles.items())],
+                "seq": self.seq,
+            })
+        return self._frame
+
+
+def _encode_tiles(crops: Dict[Tuple[int, int], "Image.Image"]) -> Dict[Tuple[int, int], Optional[str]]:
+    encoded = {}
+    for tile, image in crops.items():
+        if image.getbbox() is None:
+            encoded[tile] = None
+            continue
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=False)
+        encoded[tile] = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return encoded
+
+
+def render_history(records: List[EventRecord], base: Optional["Image.Image"] = None, seq: int = 0) -> RoomRaster:
+    """A room's canvas drawn from its base image and live records; slow, so run it off the event loop"""
+    raster = RoomRaster(image=base, seq=seq)
+    for record in records:
+        raster.apply(record)
+    return raster
+
+
+def render_region(box: Tuple[int, int, int, int], records: List[EventRecord], base: Optional["Image.Image"] = None) -> "Image.Image":
+    """The pixels in box drawn from the base image's crop there and the records touching it, in history order"""
+    # Drawn on a full-size canvas so records keep their own coordinates
+    raster = RoomRaster()
+    if base is not None:
+        raster.image.paste(base.convert("RGBA"), box[:2])
+    for record in records:
+        raster.apply(record)
+    return raster.image.crop(box)
+
+
+def base_record(data: str, seq: int) -> str:
+    """A base image as the leading entry of an init frame's history"""
+    return dumps({"type": "base", "image": data, "seq": seq})
+
+
+def encode_png(image: "Image.Image") -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def decode_png(data: str) -> "Image.Image":
+    image = Image.open(io.BytesIO(base64.b64decode(data.split(",", 1)[-1])))
+    image.load()
+    return image
+
+
+class BaseLayer:
+    """Raster of everything evicted from a room's in-memory history, the base its init frame builds on"""
+
+    def __init__(self, data: Optional[str] = None, seq: int = 0):
+        image = decode_png(data) if data else None
+        self.raster = RoomRaster(image=image, seq=seq)
+        self.data = data
+        # Folded into since the last encode / since the last checkpoint that stored it
+        self.dirty = False
+        self.persisted = data is not None
+
+    @property
+    def seq(self) -> int:
+        return self.raster.seq
+
+    def fold(self, records: List[EventRecord]):
+        for record in records:
+            self.raster.apply(record)
+        self.dirty = True
+        self.persisted = False
+
+    async def encode(self) -> str:
+        """PNG data URL of the layer, encoded off the event loop and only after it changed"""
+        while self.dirty:
+            self.dirty = False
+            seq = self.seq
+            # Encode a copy so records folded in meanwhile can't tear the image; loop if that happened
+            data = await asyncio.to_thread(encode_png, self.raster.image.copy())
+            if not self.dirty:
+                self.data = data
+                logger.debug(f"Encoded history base layer at seq {seq} ({len(data)} bytes)")
+        return self.data
+
+    def mark_persisted(self, data: str):
+        """Note that a checkpoint storing data committed, unless records were folded in since it was encoded"""
+        if self.data is data and not self.dirty:
+            self.persisted = True
+
+    def record(self) -> str:
+        return base_record(self.data, self.seq)
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Callable, Dict, Optional
+from app.database import AsyncSessionLocal
+from app.services.snapshot_service import SnapshotService
+from app.core.config import settings
+from app.core.logger import logger
+
+
+class SnapshotRetention:
+    """Periodically prunes rooms to MAX_SNAPSHOTS_PER_ROOM and collects snapshot chunks nothing refers to"""
+
+    def __init__(
+        self,
+        on_pruned: Optional[Callable[[], None]] = None,
+        interval_s: int = settings.SNAPSHOT_RETENTION_INTERVAL_S
+    ):
+        self._on_pruned = on_pruned
+        self.interval = interval_s
+        self._task: asyncio.Task | None = None
+        self.metrics: Dict[str, int] = {"runs": 0, "snapshots_pruned": 0, "chunks_collected": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Snapshot retention started (every {self.interval}s)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self):
+        async with AsyncSessionLocal() as session:
+            pruned, collected = await SnapshotService.prune_snapshots(session)
+        self.metrics["runs"] += 1
+        self.metrics["snapshots_pruned"] += pruned
+        self.metrics["chunks_collected"] += collected
+        if pruned and self._on_pruned is not None:
+            self._on_pruned()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Snapshot retention error: {e}", exc_info=True)
@@ -0,0 +1,55 @@
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import AsyncSessionLocal, Snapshot
+from app.services.snapshot_service import SnapshotService, snapshot_metadata
+from app.core.config import settings
+
+
+class SnapshotListCache:
+    """Newest page of snapshot metadata per room, updated in place on save instead of re-queried"""
+
+    def __init__(self, page_size: int = settings.SNAPSHOT_PAGE_SIZE):
+        self.page_size = page_size
+        # One entry past the page, so whether an older page exists is known without another query
+        self.rooms: Dict[str, List[dict]] = {}
+        self.metrics: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    def _page(self, entries: List[dict]) -> Tuple[List[dict], Optional[int]]:
+        page = entries[:self.page_size]
+        return page, page[-1]["id"] if len(entries) > self.page_size and page else None
+
+    async def page(
+        self,
+        room_id: str,
+        before: int = None,
+        db: AsyncSession = None
+    ) -> Optional[Tuple[List[dict], Optional[int]]]:
+        """(snapshots, id to pass as before for the next page) newest first, or None on a DB error"""
+        if before is None and room_id in self.rooms:
+            self.metrics["hits"] += 1
+            return self._page(self.rooms[room_id])
+
+        self.metrics["misses"] += 1
+        if db is not None:
+            entries = await SnapshotService.get_snapshots_by_room(db, room_id, self.page_size + 1, before)
+        else:
+            async with AsyncSessionLocal() as session:
+                entries = await SnapshotService.get_snapshots_by_room(session, room_id, self.page_size + 1, before)
+        if entries is None:
+            return None
+        # Only the newest page is kept; older pages are rarely read and go straight to the index
+        if before is None:
+            self.rooms[room_id] = entries
+        return self._page(entries)
+
+    def add(self, room_id: str, snapshot: Snapshot):
+        entries = self.rooms.get(room_id)
+        if entries is not None:
+            entries.insert(0, snapshot_metadata(snapshot))
+            del entries[self.page_size + 1:]
+
+    def discard(self, room_id: str):
+        self.rooms.pop(room_id, None)
+
+    def clear(self):
+        self.rooms.clear()
@@ -0,0 +1,191 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from app.core.config import settings
+from app.core.events import EventRecord
+
+# Optional Pillow for eraser coverage masks; without it region queries still work but nothing is culled
+try:
+    from PIL import Image, ImageChops, ImageDraw, ImageFilter
+except ImportError:
+    Image = None
+
+MASKS_AVAILABLE = Image is not None
+
+Box = Tuple[float, float, float, float]
+
+
+def _number(event: dict, key: str, default: float = 0) -> float:
+    value = event.get(key, default)
+    return value if isinstance(value, (int, float)) else default
+
+
+def _points(event: dict) -> List[Tuple[float, float]]:
+    points = event.get("points")
+    if not isinstance(points, list):
+        return []
+    return [
+        (point[0], point[1]) for point in points
+        if isinstance(point, list) and len(point) == 2 and all(isinstance(value, (int, float)) for value in point)
+    ]
+
+
+def is_eraser(event_type: Optional[str], event: dict) -> bool:
+    return event_type == "eraser" or (event_type == "polyline" and event.get("tool") == "eraser")
+
+
+def event_bounds(event_type: Optional[str], event: dict, pen: Optional[Tuple[float, float]] = None) -> Optional[Box]:
+    """Bounding box of what an event draws, padded by its line width; None if it has no known extent
+
+    A single brush/eraser point continues the path from pen, as on the client canvas.
+    """
+    pad = _number(event, "thickness", 1) / 2 + 1
+    if event_type in ("brush", "eraser"):
+        x, y = _number(event, "x"), _number(event, "y")
+        xs, ys = [x] + ([pen[0]] if pen else []), [y] + ([pen[1]] if pen else [])
+    elif event_type == "polyline":
+        points = _points(event)
+        if not points:
+            return None
+        xs, ys = [x for x, _ in points], [y for _, y in points]
+    elif event_type == "rectangle":
+        x, y = _number(event, "startX"), _number(event, "startY")
+        xs, ys = [x, x + _number(event, "width")], [y, y + _number(event, "height")]
+    elif event_type == "ellipse":
+        cx, cy = _number(event, "centerX"), _number(event, "centerY")
+        rx, ry = abs(_number(event, "radiusX")), abs(_number(event, "radiusY"))
+        xs, ys = [cx - rx, cx + rx], [cy - ry, cy + ry]
+    elif event_type == "text" and event.get("text"):
+        # Generous: glyphs are never wider than the font size, and descenders stay within a third of it
+        size = _number(event, "fontSize", 18)
+        x, y = _number(event, "x"), _number(event, "y")
+        xs, ys = [x, x + size * len(str(event["text"]))], [y - size, y + size / 3]
+        pad = 1
+    else:
+        return None
+    return min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad
+
+
+def intersects(a: Box, b: Box) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class StrokeGrid:
+    """Uniform grid over the canvas mapping cells to the history records whose bounding box touches them"""
+
+    def __init__(
+        self,
+        width: int = settings.CANVAS_WIDTH,
+        height: int = settings.CANVAS_HEIGHT,
+        cell_size: int = settings.SPATIAL_CELL_SIZE
+    ):
+        self.cell_size = cell_size
+        self.columns = max(1, -(-width // cell_size))
+        self.rows = max(1, -(-height // cell_size))
+        self.cells: Dict[Tuple[int, int], Set[int]] = {}
+        self.boxes: Dict[int, Box] = {}
+        self.records: Dict[int, EventRecord] = {}
+        # Records without a known extent match every region
+        self.unplaced: Set[int] = set()
+        # Where the last single brush/eraser point left the shared path
+        self._pen: Optional[Tuple[float, float]] = None
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def _cells(self, box: Box) -> Iterable[Tuple[int, int]]:
+        # Anything off the canvas lands in the edge cells
+        left = min(max(int(box[0] // self.cell_size), 0), self.columns - 1)
+        right = min(max(int(box[2] // self.cell_size), 0), self.columns - 1)
+        top = min(max(int(box[1] // self.cell_size), 0), self.rows - 1)
+        bottom = min(max(int(box[3] // self.cell_size), 0), self.rows - 1)
+        for row in range(top, bottom + 1):
+            for column in range(left, right + 1):
+                yield column, row
+
+    def insert(self, record: EventRecord, event: dict):
+        box = event_bounds(record.type, event, self._pen)
+        if record.type in ("brush", "eraser"):
+            self._pen = (_number(event, "x"), _number(event, "y"))
+        elif record.type == "polyline" and box is not None:
+            self._pen = _points(event)[-1]
+        self.records[record.seq] = record
+        if box is None:
+            self.unplaced.add(record.seq)
+            return
+        self.boxes[record.seq] = box
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, set()).add(record.seq)
+
+    def remove(self, seq: int):
+        self.records.pop(seq, None)
+        self.unplaced.discard(seq)
+        box = self.boxes.pop(seq, None)
+        if box is None:
+            return
+        for cell in self._cells(box):
+            seqs = self.cells.get(cell)
+            if seqs is not None:
+                seqs.discard(seq)
+                if not seqs:
+                    del self.cells[cell]
+
+    def query(self, box: Box) -> List[EventRecord]:
+        """Records whose bounding box intersects box, plus those without one, in history order"""
+        seqs = set(self.unplaced)
+        for cell in self._cells(box):
+            for seq in self.cells.get(cell, ()):
+                if seq not in seqs and intersects(self.boxes[seq], box):
+                    seqs.add(seq)
+        return [self.records[seq] for seq in sorted(seqs)]
+
+
+def is_cullable(event_type: Optional[str], event: dict) -> bool:
+    """Whether a record draws on its own: single brush points continue a shared path, so later ones depend on them"""
+    return event_type in ("rectangle", "ellipse", "text") or (event_type == "polyline" and not is_eraser(event_type, event))
+
+
+def _draw_mask(draw: "ImageDraw.ImageDraw", event_type: str, event: dict, box: Box, offset: Tuple[float, float], grow: int):
+    """Draw an event's footprint in white, widened by grow pixels; text stands in with its whole bounding box"""
+    dx, dy = offset
+    width = max(1, round(_number(event, "thickness", 1))) + grow
+    # Lines are centred on their path on the client, while Pillow draws outlines inwards from the given box
+    half = width / 2
+    if event_type == "polyline":
+        points = [(x - dx, y - dy) for x, y in _points(event)]
+        if len(points) > 1:
+            draw.line(points, fill=255, width=width, joint="curve")
+        for x, y in {points[0], points[-1]}:
+            draw.ellipse([x - half, y - half, x + half, y + half], fill=255)
+    elif event_type == "eraser":
+        # Only the dot is certain; the segment from the previous point depends on the shared path
+        x, y = _number(event, "x") - dx, _number(event, "y") - dy
+        draw.ellipse([x - half, y - half, x + half, y + half], fill=255)
+    elif event_type == "rectangle":
+        x, y = _number(event, "startX"), _number(event, "startY")
+        w, h = _number(event, "width"), _number(event, "height")
+        rect = [min(x, x + w) - dx - half, min(y, y + h) - dy - half, max(x, x + w) - dx + half, max(y, y + h) - dy + half]
+        draw.rectangle(rect, outline=255, width=width)
+    elif event_type == "ellipse":
+        cx, cy = _number(event, "centerX") - dx, _number(event, "centerY") - dy
+        rx, ry = abs(_number(event, "radiusX")) + half, abs(_number(event, "radiusY")) + half
+        draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], outline=255, width=width)
+    else:
+        draw.rectangle([box[0] - dx, box[1] - dy, box[2] - dx, box[3] - dy], fill=255)
+
+
+def is_erased(target: Tuple[str, dict, Box], erasers: List[Tuple[str, dict]]) -> bool:
+    """Whether erasers drawn after target wipe out every pixel it drew
+
+    The target is widened and the erasers shrunk by a pixel, so antialiased edges on clients
+    never leave a trace of a culled stroke behind.
+    """
+    event_type, event, box = target
+    left, top = int(box[0]) - 2, int(box[1]) - 2
+    size = (int(box[2]) - left + 3, int(box[3]) - top + 3)
+    drawn = Image.new("L", size, 0)
+    _draw_mask(ImageDraw.Draw(drawn), event_type, event, box, (left, top), grow=2)
+    erased = Image.new("L", size, 0)
+    erase_draw = ImageDraw.Draw(erased)
+    for eraser_type, eraser in erasers:
+        _draw_mask(erase_draw, eraser_type, eraser, box, (left, top), grow=0)
+    erased = erased.filter(ImageFilter.MinFilter(3))
+    return ImageChops.subtract(drawn, erased).getbbox() is None
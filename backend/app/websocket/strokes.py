@@ -0,0 +1,187 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+from app.core.config import settings
+from app.core.logger import logger
+
+# Optional NumPy for vectorized simplification; the pure-Python path gives the same result
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _simplify_numpy(points: Sequence[Sequence[float]], tolerance: float) -> List[int]:
+    coords = np.asarray(points, dtype=float)
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        inner = coords[start + 1:end]
+        origin = coords[start]
+        dx, dy = coords[end] - origin
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - origin[0], inner[:, 1] - origin[1])
+        else:
+            distances = np.abs(dx * (inner[:, 1] - origin[1]) - dy * (inner[:, 0] - origin[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return np.flatnonzero(keep).tolist()
+
+
+def _simplify_python(points: Sequence[Sequence[float]], tolerance: float) -> List[int]:
+    keep = {0, len(points) - 1}
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        x0, y0 = points[start]
+        dx, dy = points[end][0] - x0, points[end][1] - y0
+        length = (dx * dx + dy * dy) ** 0.5
+        farthest, max_distance = start, -1.0
+        for index in range(start + 1, end):
+            x, y = points[index]
+            if length == 0:
+                distance = ((x - x0) ** 2 + (y - y0) ** 2) ** 0.5
+            else:
+                distance = abs(dx * (y - y0) - dy * (x - x0)) / length
+            if distance > max_distance:
+                farthest, max_distance = index, distance
+        if max_distance > tolerance:
+            keep.add(farthest)
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+    return sorted(keep)
+
+
+def simplify_polyline(points: List[List[float]], tolerance: float) -> List[List[float]]:
+    """Ramer-Douglas-Peucker simplification, keeping points further than tolerance from the chord"""
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    indices = _simplify_numpy(points, tolerance) if np is not None else _simplify_python(points, tolerance)
+    return [points[index] for index in indices]
+
+
+class OpenStroke:
+    """Points of a stroke that is still being drawn"""
+
+    __slots__ = ("author", "style", "points", "last_seen")
+
+    def __init__(self, author: Optional[str], style: tuple, point: List[float], now: float):
+        self.author = author
+        self.style = style
+        self.points = [point]
+        self.last_seen = now
+
+
+class StrokeAggregator:
+    """Merges consecutive brush/eraser points per user into simplified polyline history records"""
+
+    def __init__(
+        self,
+        on_stroke: Callable[[str, dict, Optional[str]], Awaitable[None]],
+        idle_ms: int = settings.STROKE_IDLE_MS,
+        max_points: int = settings.STROKE_MAX_POINTS,
+        tolerance: float = settings.STROKE_SIMPLIFY_TOLERANCE
+    ):
+        self._on_stroke = on_stroke
+        self.idle = idle_ms / 1000
+        self.max_points = max_points
+        self.tolerance = tolerance
+        self.open: Dict[str, Dict[str, OpenStroke]] = {}
+        self._task: asyncio.Task | None = None
+        self.metrics: Dict[str, int] = {"points": 0, "points_kept": 0, "polylines": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle > 0
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Stroke aggregator started ({round(self.idle * 1000)} ms idle close)")
+
+    async def stop(self):
+        """Stop sweeping and emit every stroke still open"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for room_id in list(self.open):
+            await self.close_room(room_id)
+
+    async def add(self, room_id: str, username: Optional[str], event: dict):
+        """Extend the user's open stroke, closing it first if the style changed"""
+        point = [event.get("x"), event.get("y")]
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in point):
+            logger.warning(f"Ignoring stroke point without coordinates in room {room_id}")
+            return
+        self.metrics["points"] += 1
+        now = asyncio.get_running_loop().time()
+        style = (event.get("type"), event.get("color"), event.get("thickness"))
+        strokes = self.open.setdefault(room_id, {})
+        stroke = strokes.get(username)
+
+        if stroke is not None and stroke.style != style:
+            await self._close(room_id, strokes.pop(username))
+            stroke = None
+        if stroke is None:
+            strokes[username] = OpenStroke(username, style, point, now)
+            return
+
+        stroke.points.append(point)
+        stroke.last_seen = now
+        if len(stroke.points) >= self.max_points:
+            # Continue from the last point so the split leaves no gap in the line
+            strokes[username] = OpenStroke(username, style, point, now)
+            await self._close(room_id, stroke)
+
+    async def close_user(self, room_id: str, username: Optional[str]):
+        stroke = self.open.get(room_id, {}).pop(username, None)
+        if stroke is not None:
+            await self._close(room_id, stroke)
+
+    async def close_room(self, room_id: str):
+        """Emit the room's open strokes, e.g. on shutdown"""
+        for stroke in self.open.pop(room_id, {}).values():
+            await self._close(room_id, stroke)
+
+    def discard_room(self, room_id: str):
+        self.open.pop(room_id, None)
+
+    async def _close(self, room_id: str, stroke: OpenStroke):
+        event_type, color, thickness = stroke.style
+        points = simplify_polyline(stroke.points, self.tolerance)
+        polyline = {"type": "polyline", "tool": event_type, "points": points, "thickness": thickness}
+        if color is not None:
+            polyline["color"] = color
+        self.metrics["polylines"] += 1
+        self.metrics["points_kept"] += len(points)
+        await self._on_stroke(room_id, polyline, stroke.author)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.idle / 2)
+            cutoff = loop.time() - self.idle
+            for room_id, strokes in list(self.open.items()):
+                for username, stroke in list(strokes.items()):
+                    if stroke.last_seen <= cutoff and strokes.get(username) is stroke:
+                        del strokes[username]
+                        try:
+                            await self._close(room_id, stroke)
+                        except Exception as e:
+                            logger.error(f"Stroke close error in room {room_id}: {e}", exc_info=True)
+                if not strokes and self.open.get(room_id) is strokes:
+                    del self.open[room_id]
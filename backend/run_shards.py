@@ -0,0 +1,43 @@
+"""Run one uvicorn process per room shard.
+
+Each process gets its own event loop and ConnectionManager and listens on
+SHARD_BASE_PORT + index. A room is owned by shard
+crc32(room_id) % SHARD_COUNT; GET /rooms/{room_name}/shard tells clients
+where to connect up front. A socket that lands on the wrong shard is closed
+with code 4009 and the owning shard's URL as the reason.
+
+REST room changes can hit any shard, so set BACKPLANE_URL (redis:// or
+postgresql://) to mirror room deletes across shards. Drawing history is only
+numbered and persisted by the room's shard; should a write reach another
+node anyway, it is forwarded there over the backplane.
+
+Usage: SHARD_COUNT=4 python run_shards.py
+"""
+import multiprocessing
+import os
+import uvicorn
+
+
+def run_shard(index: int, count: int, base_port: int, host: str):
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["SHARD_COUNT"] = str(count)
+    uvicorn.run("app.main:app", host=host, port=base_port + index)
+
+
+if __name__ == "__main__":
+    count = int(os.getenv("SHARD_COUNT", str(os.cpu_count() or 1)))
+    base_port = int(os.getenv("SHARD_BASE_PORT", "8000"))
+    host = os.getenv("HOST", "0.0.0.0")
+
+    processes = [
+        multiprocessing.Process(target=run_shard, args=(index, count, base_port, host), name=f"shard-{index}")
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
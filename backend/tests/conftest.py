@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+# Settings are read on import, so the throwaway database and small limits go in first
+_db_dir = tempfile.mkdtemp(prefix="canvas-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'test.db')}"
+# A small ring, so eviction into the base layer is quick to reach
+os.environ["MAX_HISTORY_PER_ROOM"] = "10"
+
+import pytest
+from sqlalchemy import event
+from app.database import Base, engine
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _skip_fsync(dbapi_connection, connection_record):
+    # The test database never has to survive a crash, and syncing every commit dominates run time
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.close()
+
+
+class FakeWebSocket:
+    """Stands in for a client socket, keeping every frame the server sends it"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+    async def send_bytes(self, message: bytes):
+        self.sent.append(message)
+
+    async def close(self, code: int = None):
+        pass
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def database():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+
+@pytest.fixture
+async def managers(database):
+    """Builds started ConnectionManagers and shuts them all down afterwards"""
+    from app.websocket.manager import ConnectionManager
+
+    started = []
+
+    async def build(configure=None) -> ConnectionManager:
+        manager = ConnectionManager()
+        if configure is not None:
+            configure(manager)
+        await manager.start()
+        started.append(manager)
+        return manager
+
+    yield build
+    for manager in started:
+        await manager.shutdown()
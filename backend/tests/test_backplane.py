@@ -0,0 +1,112 @@
+import asyncio
+import uuid
+import pytest
+from app.core.config import settings
+from app.core.events import dumps, loads
+from app.core.sharding import shard_for_room
+from app.websocket.backplane import InMemoryBackplane, LocalBroker, create_backplane
+from conftest import FakeWebSocket
+
+pytestmark = pytest.mark.anyio
+
+
+async def settle():
+    """Let the backplane publishers and client writers run"""
+    await asyncio.sleep(0.1)
+
+
+def room_on_shard(shard: int) -> str:
+    return next(name for name in (f"room-{index}" for index in range(100)) if shard_for_room(name, 2) == shard)
+
+
+async def _record(received, envelope):
+    received.append(envelope)
+
+
+@pytest.fixture
+async def nodes(managers, monkeypatch):
+    """Two nodes of a two-shard deployment sharing one in-process broker"""
+    monkeypatch.setattr(settings, "SHARD_COUNT", 2)
+    monkeypatch.setattr(settings, "BACKPLANE_URL", f"memory://{uuid.uuid4().hex}")
+
+    def shard(index):
+        def configure(manager):
+            manager.shard_index = index
+        return configure
+
+    return await managers(shard(0)), await managers(shard(1))
+
+
+async def test_broker_skips_the_publishing_node():
+    broker = LocalBroker()
+    first, second = InMemoryBackplane(broker), InMemoryBackplane(broker)
+    received = {first: [], second: []}
+    for backplane in (first, second):
+        backplane.set_handler(lambda envelope, backplane=backplane: _record(received[backplane], envelope))
+        await backplane.start()
+
+    first.publish("room", "frame", payload="hello")
+    await settle()
+    await first.stop()
+    await second.stop()
+
+    assert received[first] == []
+    assert [(envelope["room"], envelope["payload"]) for envelope in received[second]] == [("room", "hello")]
+
+
+def test_backplane_is_chosen_by_url_scheme():
+    assert create_backplane("") is None
+    assert isinstance(create_backplane("memory://a"), InMemoryBackplane)
+    assert create_backplane("memory://a").broker is create_backplane("memory://a").broker
+    with pytest.raises(ValueError):
+        create_backplane("kafka://localhost")
+
+
+async def test_history_writes_are_numbered_by_the_owning_node(nodes):
+    owner, other = nodes
+    room_id = room_on_shard(0)
+    watcher, drawer = FakeWebSocket(), FakeWebSocket()
+    await owner.connect(watcher, room_id, "alice")
+    await other.connect(drawer, room_id, "bob")
+    await settle()
+    watcher.sent.clear()
+    drawer.sent.clear()
+
+    message = dumps({"type": "rectangle", "startX": 1, "startY": 2, "width": 3, "height": 4})
+    await other.broadcast(message, room_id, "bob", drawer)
+    await settle()
+
+    [record] = owner.history[room_id].records
+    assert (record.seq, record.author) == (1, "bob")
+    assert list(other.history[room_id].records) == [record]
+    for socket in (watcher, drawer):
+        assert [loads(frame)["seq"] for frame in socket.sent] == [1]
+
+
+async def test_chat_reaches_clients_on_other_nodes(nodes):
+    first, second = nodes
+    room_id = room_on_shard(1)
+    reader, writer = FakeWebSocket(), FakeWebSocket()
+    await first.connect(reader, room_id, "alice")
+    await second.connect(writer, room_id, "bob")
+    await settle()
+    reader.sent.clear()
+
+    await second.broadcast(dumps({"type": "chat", "message": "hi", "username": "bob"}), room_id, "bob", writer)
+    await settle()
+
+    assert [(loads(frame)["type"], loads(frame)["message"]) for frame in reader.sent] == [("chat", "hi")]
+
+
+async def test_deleting_a_room_drops_it_on_every_node(nodes):
+    first, second = nodes
+    room_id = room_on_shard(0)
+    await first.connect(FakeWebSocket(), room_id, "alice")
+    await second.connect(FakeWebSocket(), room_id, "bob")
+
+    await first.delete_room(room_id)
+    await settle()
+
+    for node in nodes:
+        assert room_id not in node.history
+        assert room_id not in node.active_connections
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+import pytest
+from app.database import AsyncSessionLocal
+from app.services.canvas_service import CanvasService, chat_tail
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+async def save_messages(room_id, count, first=0):
+    async with AsyncSessionLocal() as db:
+        for index in range(first, first + count):
+            assert await CanvasService.save_chat_message(db, room_id, "alice", f"m{index}", START + timedelta(seconds=index))
+
+
+async def page(room_id, before=None, limit=None):
+    async with AsyncSessionLocal() as db:
+        messages, next_before = await CanvasService.get_chat_page(db, room_id, before, limit)
+    return [message["message"] for message in messages], next_before
+
+
+async def test_pages_walk_back_to_the_first_message(database):
+    await save_messages("paged", 7)
+    chat_tail.discard("paged")
+
+    newest, before = await page("paged", limit=3)
+    older, before = await page("paged", before, limit=3)
+    oldest, last = await page("paged", before, limit=3)
+
+    assert (newest, older, oldest) == (["m4", "m5", "m6"], ["m1", "m2", "m3"], ["m0"])
+    assert last is None
+
+
+async def test_same_timestamp_messages_are_ordered_by_id(database):
+    async with AsyncSessionLocal() as db:
+        for index in range(4):
+            await CanvasService.save_chat_message(db, "ties", "alice", f"m{index}", START)
+    chat_tail.discard("ties")
+
+    newest, before = await page("ties", limit=2)
+    older, last = await page("ties", before, limit=2)
+
+    assert (newest, older, last) == (["m2", "m3"], ["m0", "m1"], None)
+
+
+async def test_newest_page_is_served_from_the_tail(database):
+    await save_messages("tail", 3)
+    chat_tail.discard("tail")
+    await page("tail", limit=2)
+    misses = chat_tail.metrics["misses"]
+
+    newest, _ = await page("tail", limit=2)
+
+    assert newest == ["m1", "m2"]
+    assert chat_tail.metrics["misses"] == misses
+
+
+async def test_cursor_skips_messages_still_waiting_to_be_written(database):
+    await save_messages("unflushed", 4)
+    chat_tail.discard("unflushed")
+    await page("unflushed")
+    # Queued for the write-behind insert, so the tail has them without ids
+    for index in range(4, 6):
+        CanvasService.record_chat_message("unflushed", "alice", f"m{index}", START + timedelta(seconds=index))
+
+    newest, before = await page("unflushed", limit=3)
+    older, _ = await page("unflushed", before, limit=3)
+
+    assert newest == ["m3", "m4", "m5"]
+    assert before is not None
+    assert older == ["m0", "m1", "m2"]
@@ -0,0 +1,77 @@
+import pytest
+from app.websocket.codec import (
+    FLAG_FINAL, FLAG_HAS_SEQ, FRAGMENT_HEADER, STROKE_HEADER, FragmentEncoder, decode_stroke, encode_stroke
+)
+
+
+def stroke(count, **fields):
+    return [{"type": "brush", "x": 10 + index * 3, "y": 20 - index, **fields} for index in range(count)]
+
+
+def test_round_trip_keeps_style_author_and_seq():
+    events = stroke(4, color="#ff8800", thickness=2.5, author="alice")
+    for index, event in enumerate(events):
+        event["seq"] = 41 + index
+
+    assert decode_stroke(encode_stroke(events)) == events
+
+
+def test_integral_thickness_stays_an_int():
+    events = stroke(2, thickness=3)
+
+    decoded = decode_stroke(encode_stroke(events))
+
+    assert decoded == events
+    assert isinstance(decoded[0]["thickness"], int)
+
+
+def test_seq_is_flagged_only_when_present():
+    without = encode_stroke(stroke(2, thickness=1))
+    with_seq = encode_stroke([{**event, "seq": 7 + index} for index, event in enumerate(stroke(2, thickness=1))])
+
+    assert not STROKE_HEADER.unpack_from(without)[5] & FLAG_HAS_SEQ
+    assert STROKE_HEADER.unpack_from(with_seq)[5] & FLAG_HAS_SEQ
+    assert len(with_seq) == len(without) + 4
+
+
+@pytest.mark.parametrize("seqs", [[5, 7], [5, None], [None, 5], [True, 2], [-1, 0]])
+def test_points_without_consecutive_seqs_are_not_packed(seqs):
+    events = [{**event, "seq": seq} for event, seq in zip(stroke(2, thickness=1), seqs)]
+
+    assert encode_stroke(events) is None
+
+
+@pytest.mark.parametrize("events", [
+    [],
+    [{"type": "rectangle", "x": 0, "y": 0}],
+    [{"type": "brush", "x": 0}],
+    [{"type": "brush", "x": 0, "y": 0, "color": "red"}],
+    [{"type": "brush", "x": 0, "y": 0, "thickness": 1}, {"type": "eraser", "x": 1, "y": 1, "thickness": 1}],
+    [{"type": "brush", "x": 0, "y": 0, "author": "a"}, {"type": "brush", "x": 1, "y": 1, "author": "b"}],
+    [{"type": "brush", "x": 20000, "y": 0}],
+])
+def test_unrepresentable_strokes_fall_back_to_json(events):
+    assert encode_stroke(events) is None
+
+
+def test_decode_rejects_truncated_and_padded_frames():
+    data = encode_stroke([{**event, "seq": 3 + index} for index, event in enumerate(stroke(3, thickness=1))])
+
+    with pytest.raises(ValueError):
+        decode_stroke(data[:STROKE_HEADER.size - 1])
+    with pytest.raises(ValueError):
+        decode_stroke(data[:-1])
+    with pytest.raises(ValueError):
+        decode_stroke(encode_stroke(stroke(2, thickness=1)) + b"\x00")
+
+
+def test_fragments_reassemble_to_the_frame():
+    encoder = FragmentEncoder(transfer_id=9, fragment_size=4)
+    fragments = encoder.feed(b"hello ") + encoder.feed(b"world") + [encoder.finish()]
+
+    headers = [FRAGMENT_HEADER.unpack_from(fragment) for fragment in fragments]
+    payloads = [fragment[FRAGMENT_HEADER.size:] for fragment in fragments]
+    assert all(0 < len(payload) <= 4 for payload in payloads)
+    assert b"".join(payloads) == b"hello world"
+    assert [index for _, _, _, index in headers] == list(range(len(fragments)))
+    assert [flags for _, flags, _, _ in headers] == [0] * (len(fragments) - 1) + [FLAG_FINAL]
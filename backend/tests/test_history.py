@@ -0,0 +1,156 @@
+import pytest
+from app.core.events import EventRecord, dumps
+from app.websocket.history import HistoryBuffer, UndoIndex, find_erased
+from app.websocket.spatial import MASKS_AVAILABLE
+
+needs_masks = pytest.mark.skipif(not MASKS_AVAILABLE, reason="eraser culling needs Pillow")
+
+
+def record(seq, event_type="polyline", author="alice", **fields):
+    return EventRecord(seq, event_type, dumps({"type": event_type, **fields, "seq": seq}), author)
+
+
+def line(seq, points, tool="brush", thickness=2, author="alice"):
+    return record(seq, tool=tool, points=points, thickness=thickness, color="#000000", author=author)
+
+
+def undo(seq, target, event_type="undo", author="alice"):
+    return record(seq, event_type, target=target, author=author)
+
+
+def append(history, make, *args, **fields) -> int:
+    """Append a record numbered by the buffer, as the manager does"""
+    seq = history.next_seq()
+    history.append(make(seq, *args, **fields))
+    return seq
+
+
+def test_undo_index_moves_seqs_between_stacks():
+    index = UndoIndex()
+    for seq in (1, 2, 3):
+        index.add("alice", seq)
+
+    index.move("alice", 3, undo=True)
+    index.move("alice", 2, undo=True)
+    assert index.last_done("alice") == 1
+    assert index.last_undone("alice") == 2
+
+    index.move("alice", 2, undo=False)
+    assert index.last_done("alice") == 2
+    assert index.last_undone("alice") == 3
+
+    index.add("alice", 4)
+    assert index.last_undone("alice") is None
+
+
+def test_undo_index_forgets_folded_seqs():
+    index = UndoIndex()
+    for seq in (1, 2, 3, 4):
+        index.add("alice", seq)
+    index.move("alice", 4, undo=True)
+    index.move("alice", 3, undo=True)
+
+    index.forget(3)
+
+    assert index.done == {}
+    assert index.undone == {"alice": [4]}
+
+
+def test_undo_and_redo_records_toggle_what_is_drawn():
+    history = HistoryBuffer(max_records=100)
+    append(history, line, [[0, 0], [10, 0]])
+    append(history, line, [[0, 5], [10, 5]])
+    append(history, undo, 2)
+
+    assert [entry.seq for entry in history.live_records()] == [1]
+    assert '"seq":2' not in history.init_frame()
+
+    append(history, undo, 2, "redo")
+
+    assert [entry.seq for entry in history.live_records()] == [1, 2]
+    assert history.undo.last_done("alice") == 2
+
+
+def test_eviction_folds_live_records_and_forgets_undo_state():
+    folded = []
+    history = HistoryBuffer(max_records=4, on_evict=folded.extend)
+    append(history, line, [[0, 0], [1, 1]])
+    append(history, line, [[0, 0], [1, 1]])
+    append(history, undo, 2)
+    append(history, line, [[0, 0], [1, 1]])
+    append(history, line, [[0, 0], [1, 1]])
+
+    assert history.floor == 1
+    assert [entry.seq for entry in folded] == [1]
+    assert history.since(0) is None
+    assert [entry.seq for entry in history.since(1)] == [2, 3, 4, 5]
+
+
+@needs_masks
+def test_eraser_covering_a_stroke_culls_it():
+    history = HistoryBuffer(max_records=100)
+    append(history, line, [[100, 100], [120, 100]])
+    append(history, line, [[90, 100], [130, 100]], tool="eraser", thickness=30)
+
+    assert history.cull_erased() == 1
+    assert history.culled == {1}
+    assert [entry.seq for entry in history.live_records()] == [2]
+
+
+@needs_masks
+def test_eraser_over_nothing_is_culled_unless_the_base_has_pixels():
+    records = [line(1, [[500, 500], [520, 500]], tool="eraser", thickness=10)]
+
+    assert find_erased(records, set(), 0) == [(1, [])]
+    assert find_erased(records, set(), 0, lambda box: True) == []
+
+
+@needs_masks
+def test_partly_erased_stroke_is_kept():
+    records = [
+        line(1, [[100, 100], [200, 100]]),
+        line(2, [[90, 100], [130, 100]], tool="eraser", thickness=30),
+    ]
+
+    assert find_erased(records, set(), 0) == []
+
+
+@needs_masks
+def test_undoing_the_eraser_revives_what_it_culled():
+    history = HistoryBuffer(max_records=100)
+    append(history, line, [[100, 100], [120, 100]])
+    append(history, line, [[90, 100], [130, 100]], tool="eraser", thickness=30)
+    history.cull_erased()
+
+    append(history, undo, 2)
+
+    assert history.culled == set()
+    assert [entry.seq for entry in history.take_revived()] == [1]
+    assert [entry.seq for entry in history.live_records()] == [1]
+
+
+@needs_masks
+def test_cull_found_off_the_loop_skips_records_undone_meanwhile():
+    history = HistoryBuffer(max_records=100)
+    append(history, line, [[100, 100], [120, 100]])
+    append(history, line, [[90, 100], [130, 100]], tool="eraser", thickness=30)
+    snapshot = history.cull_snapshot()
+    erased = find_erased(*snapshot)
+    assert erased == [(1, [2])]
+
+    # The eraser is undone while find_erased ran in its worker thread
+    append(history, undo, 2)
+
+    assert history.apply_cull(erased, snapshot[2], 2) == 0
+    assert history.culled == set()
+
+
+@needs_masks
+def test_each_eraser_is_looked_at_once():
+    history = HistoryBuffer(max_records=100)
+    append(history, line, [[100, 100], [120, 100]])
+    append(history, line, [[90, 100], [130, 100]], tool="eraser", thickness=30)
+    history.cull_erased()
+
+    assert history.cull_snapshot()[2] == 2
+    assert history.cull_erased() == 0
@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.core.events import dumps, loads
+from app.services.canvas_service import CanvasService
+from app.database import AsyncSessionLocal
+from app.websocket.codec import decode_stroke, encode_stroke
+from app.websocket.raster import RASTER_AVAILABLE
+from conftest import FakeWebSocket
+
+pytestmark = pytest.mark.anyio
+
+
+def without_strokes(manager):
+    manager.strokes.idle = 0
+
+
+async def settle():
+    """Let the per-client writer tasks send what was queued"""
+    await asyncio.sleep(0.05)
+
+
+def rectangle(index: int) -> str:
+    return dumps({"type": "rectangle", "startX": index, "startY": index, "width": 5, "height": 5})
+
+
+async def test_binary_relay_carries_the_seq_of_each_point(managers):
+    manager = await managers(without_strokes)
+    drawer, binary, text = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await manager.connect(drawer, "relay", "alice", binary=True)
+    await manager.connect(binary, "relay", "bob", binary=True)
+    await manager.connect(text, "relay", "carol")
+    await settle()
+    binary.sent.clear()
+    text.sent.clear()
+
+    points = [{"type": "brush", "x": x, "y": 5, "color": "#000000", "thickness": 2} for x in range(3)]
+    await manager.broadcast_binary(encode_stroke(points), "relay", "alice")
+    await settle()
+
+    seqs = [record.seq for record in manager.history["relay"].records]
+    assert seqs == [1, 2, 3]
+    [frame] = binary.sent
+    assert [event["seq"] for event in decode_stroke(frame)] == seqs
+    assert [event["author"] for event in decode_stroke(frame)] == ["alice"] * 3
+    assert [loads(message)["seq"] for message in text.sent] == seqs
+
+
+async def test_client_supplied_seq_and_author_are_replaced(managers):
+    manager = await managers(without_strokes)
+    listener = FakeWebSocket()
+    await manager.connect(listener, "spoof", "bob", binary=True)
+    await manager.append_room_event("spoof", "rectangle", rectangle(0), "bob")
+    await settle()
+    listener.sent.clear()
+
+    points = [{"type": "brush", "x": 1, "y": 1, "seq": 40, "author": "mallory"}]
+    await manager.broadcast_binary(encode_stroke(points), "spoof", "alice")
+    await settle()
+
+    [event] = decode_stroke(listener.sent[0])
+    assert (event["seq"], event["author"]) == (2, "alice")
+
+
+async def test_join_leaves_open_strokes_open(managers):
+    manager = await managers()
+    drawer = FakeWebSocket()
+    await manager.connect(drawer, "open", "alice")
+    for x in range(3):
+        await manager.broadcast(dumps({"type": "brush", "x": x, "y": 0}), "open", "alice", drawer)
+
+    await manager.connect(FakeWebSocket(), "open", "bob")
+
+    assert len(manager.strokes.open["open"]["alice"].points) == 3
+    assert len(manager.history["open"]) == 0
+
+
+@pytest.mark.skipif(not RASTER_AVAILABLE, reason="base layers need Pillow")
+async def test_base_layer_counts_as_persisted_only_after_its_checkpoint_commits(managers, monkeypatch):
+    manager = await managers()
+    for index in range(settings.MAX_HISTORY_PER_ROOM + 2):
+        await manager.append_room_event("base", "rectangle", rectangle(index), "alice")
+    await manager.persistence.drain()
+    layer = manager.bases["base"]
+    assert not layer.persisted
+
+    async def failed_write(*args, **kwargs):
+        return False
+
+    write_event_batch = CanvasService.write_event_batch
+    monkeypatch.setattr(CanvasService, "write_event_batch", staticmethod(failed_write))
+    await manager.checkpoint_room_history("base")
+    await manager.persistence.drain()
+    assert not layer.persisted
+
+    monkeypatch.setattr(CanvasService, "write_event_batch", write_event_batch)
+    await manager.compact_rooms()
+    await manager.persistence.drain()
+    assert layer.persisted
+
+
+async def test_join_chat_page_has_a_cursor_while_writes_are_queued(managers, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CHAT_HISTORY", 3)
+    manager = await managers()
+    for index in range(3):
+        await manager.persistence.enqueue_chat(CanvasService.record_chat_message("chat", "alice", f"old {index}", None))
+    await manager.persistence.drain()
+    # The worker gets no turn between queueing these and reading the page, so none of them is written yet
+    for index in range(3):
+        await manager.persistence.enqueue_chat(CanvasService.record_chat_message("chat", "alice", f"new {index}", None))
+
+    async with AsyncSessionLocal() as db:
+        messages, before = await manager._chat_page(db, "chat")
+        older, _ = await manager._chat_page(db, "chat", before)
+
+    assert [message["message"] for message in messages] == ["new 0", "new 1", "new 2"]
+    assert [message["message"] for message in older] == ["old 0", "old 1", "old 2"]
@@ -0,0 +1,115 @@
+import base64
+import io
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select, update
+from app.database import AsyncSessionLocal, SnapshotChunk
+from app.services.snapshot_service import CHECKPOINT_SNAPSHOT_OWNER, SnapshotService
+from app.services.snapshot_store import Image, PNG_DATA_URL
+from app.core.config import settings
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunk_count() -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(SnapshotChunk))).scalar()
+
+
+async def save(room_id, data, saved_by="alice"):
+    async with AsyncSessionLocal() as db:
+        snapshot = await SnapshotService.save_snapshot(db, room_id, data, saved_by)
+    assert snapshot is not None
+    return snapshot.id
+
+
+async def load(snapshot_id):
+    async with AsyncSessionLocal() as db:
+        return await SnapshotService.get_snapshot_data(db, snapshot_id)
+
+
+async def age_chunks():
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(SnapshotChunk).values(last_used=datetime.utcnow() - timedelta(days=1)))
+        await db.commit()
+
+
+def png(color, size=(300, 200)) -> str:
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    image.paste(color, (0, 0, 40, 40))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return PNG_DATA_URL + base64.b64encode(buffer.getvalue()).decode()
+
+
+def pixels(data: str) -> bytes:
+    return Image.open(io.BytesIO(base64.b64decode(data[len(PNG_DATA_URL):]))).convert("RGBA").tobytes()
+
+
+async def test_identical_byte_chunks_are_stored_once(database):
+    size = settings.SNAPSHOT_CHUNK_SIZE
+    data = "a" * size * 2 + "b" * size + "é"
+
+    first = await save("dedup", data)
+    second = await save("dedup", data)
+
+    assert await chunk_count() == 3
+    assert await load(first) == data
+    assert await load(second) == data
+
+
+@pytest.mark.skipif(Image is None, reason="image tiles need Pillow")
+async def test_png_snapshots_share_tiles_and_skip_blank_ones(database):
+    red = png((255, 0, 0, 255))
+    blue = png((0, 0, 255, 255))
+
+    first = await save("tiles", red)
+    second = await save("tiles", blue)
+
+    # One drawn tile each; the blank ones are left out
+    assert await chunk_count() == 2
+    assert pixels(await load(first)) == pixels(red)
+    assert pixels(await load(second)) == pixels(blue)
+
+
+async def test_stream_yields_the_snapshot_piece_by_piece(database):
+    data = "x" * (settings.SNAPSHOT_CHUNK_SIZE + 10)
+    snapshot_id = await save("stream", data)
+
+    async with AsyncSessionLocal() as db:
+        stream = await SnapshotService.open_snapshot_stream(db, snapshot_id)
+        pieces = [piece async for piece in stream]
+
+    assert [len(piece) for piece in pieces if piece] == [settings.SNAPSHOT_CHUNK_SIZE, 10]
+    assert "".join(pieces) == data
+
+
+async def test_retention_prunes_old_snapshots_then_their_chunks(database):
+    size = settings.SNAPSHOT_CHUNK_SIZE
+    shared = "s" * size
+    ids = [await save("retention", shared + str(index) * size) for index in range(3)]
+    assert await chunk_count() == 4
+
+    async with AsyncSessionLocal() as db:
+        # Chunks inside the grace period stay, in case a save is about to reference them
+        assert await SnapshotService.prune_snapshots(db, keep=1) == (2, 0)
+    await age_chunks()
+    async with AsyncSessionLocal() as db:
+        assert await SnapshotService.prune_snapshots(db, keep=1) == (0, 2)
+
+    assert await chunk_count() == 2
+    assert await load(ids[0]) is None
+    assert await load(ids[-1]) == shared + "2" * size
+
+
+async def test_checkpoints_are_not_listed_or_pruned(database):
+    checkpoint = await save("hidden", "base", CHECKPOINT_SNAPSHOT_OWNER)
+    for index in range(2):
+        await save("hidden", f"user {index}")
+
+    async with AsyncSessionLocal() as db:
+        listed = await SnapshotService.get_snapshots_by_room(db, "hidden")
+        await SnapshotService.prune_snapshots(db, keep=1)
+
+    assert checkpoint not in [snapshot["id"] for snapshot in listed]
+    assert await load(checkpoint) == "base"
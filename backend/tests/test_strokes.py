@@ -0,0 +1,73 @@
+import pytest
+from app.websocket.strokes import StrokeAggregator, _simplify_python, simplify_polyline
+
+pytestmark = pytest.mark.anyio
+
+
+def aggregator(**options):
+    closed = []
+
+    async def on_stroke(room_id, polyline, author):
+        closed.append((room_id, polyline, author))
+
+    return StrokeAggregator(on_stroke, idle_ms=options.pop("idle_ms", 1000), **options), closed
+
+
+def point(x, y, **style):
+    return {"type": "brush", "x": x, "y": y, "color": "#000000", "thickness": 2, **style}
+
+
+async def test_points_close_into_one_polyline_per_user():
+    strokes, closed = aggregator(tolerance=0)
+    for x in range(3):
+        await strokes.add("room", "alice", point(x, x * x))
+        await strokes.add("room", "bob", point(x, 0))
+
+    await strokes.close_user("room", "alice")
+
+    assert closed == [("room", {
+        "type": "polyline", "tool": "brush", "points": [[0, 0], [1, 1], [2, 4]], "thickness": 2, "color": "#000000"
+    }, "alice")]
+    assert list(strokes.open["room"]) == ["bob"]
+
+
+async def test_style_change_closes_the_open_stroke():
+    strokes, closed = aggregator(tolerance=0)
+    await strokes.add("room", "alice", point(0, 0))
+    await strokes.add("room", "alice", point(1, 0))
+    await strokes.add("room", "alice", point(2, 0, type="eraser"))
+
+    assert [polyline["points"] for _, polyline, _ in closed] == [[[0, 0], [1, 0]]]
+    assert strokes.open["room"]["alice"].style == ("eraser", "#000000", 2)
+
+
+async def test_long_stroke_splits_without_a_gap():
+    strokes, closed = aggregator(max_points=3, tolerance=0)
+    for x in range(4):
+        await strokes.add("room", "alice", point(x, 0))
+    await strokes.close_room("room")
+
+    assert [polyline["points"] for _, polyline, _ in closed] == [[[0, 0], [1, 0], [2, 0]], [[2, 0], [3, 0]]]
+
+
+@pytest.mark.parametrize("x, y", [(None, 1), (1, "2"), (True, 1), (1, False)])
+async def test_points_without_numeric_coordinates_are_ignored(x, y):
+    strokes, closed = aggregator()
+
+    await strokes.add("room", "alice", point(x, y))
+
+    assert strokes.open == {}
+    assert strokes.metrics["points"] == 0
+
+
+async def test_disabled_without_an_idle_timeout():
+    strokes, _ = aggregator(idle_ms=0)
+
+    assert not strokes.enabled
+
+
+def test_simplification_drops_points_near_the_chord():
+    points = [[0, 0], [1, 0.1], [2, -0.1], [3, 5], [4, 0]]
+
+    assert simplify_polyline(points, 0.5) == [[0, 0], [2, -0.1], [3, 5], [4, 0]]
+    assert [points[index] for index in _simplify_python(points, 0.5)] == simplify_polyline(points, 0.5)
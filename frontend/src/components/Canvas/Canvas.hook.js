@@ -26,6 +26,7 @@ export const useCanvas = (user, roomId, adminUsername) => {
     draw,
     stopDrawing,
     handleUndo,
+    handleRedo,
     clearCanvas
   } = useCanvasDrawing(canvasRef, tool, color, thickness, sendMessage, roomId);
 
@@ -37,7 +38,9 @@ export const useCanvas = (user, roomId, adminUsername) => {
     snapshots,
     handleSaveSnapshot,
     handleRestoreSnapshot,
-    loadSnapshots
+    loadSnapshots,
+    hasOlderSnapshots,
+    loadOlderSnapshots
   } = useCanvasSnapshots(canvasRef, roomId, user?.username);
 
   // Load snapshots on mount
@@ -106,8 +109,11 @@ export const useCanvas = (user, roomId, adminUsername) => {
     snapshots,
     handleClear,
     handleUndo,
+    handleRedo,
     handleSaveSnapshot,
     handleRestoreSnapshot,
+    hasOlderSnapshots,
+    loadOlderSnapshots,
     handleDeleteRoom,
     isAdmin
   };
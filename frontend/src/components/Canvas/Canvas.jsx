@@ -17,8 +17,11 @@ const Canvas = ({ user, roomId, adminUsername, onSwitchRoom }) => {
     snapshots,
     handleClear,
     handleUndo,
+    handleRedo,
     handleSaveSnapshot,
     handleRestoreSnapshot,
+    hasOlderSnapshots,
+    loadOlderSnapshots,
     handleDeleteRoom,
     isAdmin
   } = useCanvas(user, roomId, adminUsername);
@@ -122,6 +125,9 @@ const Canvas = ({ user, roomId, adminUsername, onSwitchRoom }) => {
           <button className="canvas-btn canvas-btn-primary" onClick={handleUndo}>
             ↶ Undo
           </button>
+          <button className="canvas-btn canvas-btn-primary" onClick={handleRedo}>
+            ↷ Redo
+          </button>
           <button className="canvas-btn canvas-btn-success" onClick={handleSaveSnapshot}>
             💾 Save Snapshot
           </button>
@@ -153,6 +159,11 @@ const Canvas = ({ user, roomId, adminUsername, onSwitchRoom }) => {
                 📸 {snap.saved_by} - {new Date(snap.created_at).toLocaleString()}
               </button>
             ))}
+            {hasOlderSnapshots && (
+              <button className="canvas-snapshot-item" onClick={loadOlderSnapshots}>
+                Older…
+              </button>
+            )}
           </div>
         </div>
       )}
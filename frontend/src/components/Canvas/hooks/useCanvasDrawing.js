@@ -1,5 +1,6 @@
-import { useState, useRef, useCallback } from 'react';
+import { useState, useRef, useCallback, useEffect } from 'react';
 import { WS_EVENTS } from '../../../constants';
+import { encodeStroke } from '../../../utils/strokeCodec';
 
 /**
  * Custom hook for canvas drawing operations
@@ -9,6 +10,9 @@ export const useCanvasDrawing = (canvasRef, tool, color, thickness, sendMessage,
   const [isDrawing, setIsDrawing] = useState(false);
   const [startPos, setStartPos] = useState({ x: 0, y: 0 });
   const historyRef = useRef([]);
+  // Stroke points drawn since the last animation frame, sent together as one frame
+  const pointsRef = useRef([]);
+  const frameRef = useRef(null);
 
   // Get canvas context
   const getContext = useCallback(() => {
@@ -27,6 +31,42 @@ export const useCanvasDrawing = (canvasRef, tool, color, thickness, sendMessage,
     };
   }, [canvasRef]);
 
+  // Send the queued stroke points, as one compact binary frame when they fit one
+  const flushPoints = useCallback(() => {
+    if (frameRef.current !== null) {
+      cancelAnimationFrame(frameRef.current);
+      frameRef.current = null;
+    }
+    const points = pointsRef.current;
+    if (points.length === 0 || !sendMessage) return;
+    pointsRef.current = [];
+    const frame = encodeStroke(points);
+    if (frame) {
+      sendMessage(frame);
+    } else {
+      points.forEach(point => sendMessage(JSON.stringify(point)));
+    }
+  }, [sendMessage]);
+
+  // Queue a point for the next animation frame; a frame holds points of one style only
+  const queuePoint = useCallback((point) => {
+    const first = pointsRef.current[0];
+    if (first && (first.type !== point.type || first.color !== point.color || first.thickness !== point.thickness)) {
+      flushPoints();
+    }
+    pointsRef.current.push(point);
+    if (frameRef.current === null) {
+      frameRef.current = requestAnimationFrame(flushPoints);
+    }
+  }, [flushPoints]);
+
+  // Don't leave a frame scheduled after unmounting
+  useEffect(() => () => {
+    if (frameRef.current !== null) {
+      cancelAnimationFrame(frameRef.current);
+    }
+  }, []);
+
   // Start drawing
   const startDrawing = useCallback((e) => {
     const pos = getMousePos(e);
@@ -59,16 +99,8 @@ export const useCanvasDrawing = (canvasRef, tool, color, thickness, sendMessage,
       ctx.lineTo(pos.x, pos.y);
       ctx.stroke();
 
-      // Send to other users
-      if (sendMessage) {
-        sendMessage(JSON.stringify({
-          type: WS_EVENTS.BRUSH,
-          x: pos.x,
-          y: pos.y,
-          color,
-          thickness
-        }));
-      }
+      // Send to other users with the rest of this animation frame's points
+      queuePoint({ type: WS_EVENTS.BRUSH, x: pos.x, y: pos.y, color, thickness });
     } else if (tool === 'eraser') {
       ctx.globalCompositeOperation = 'destination-out';
       ctx.lineWidth = thickness * 2;
@@ -77,21 +109,16 @@ export const useCanvasDrawing = (canvasRef, tool, color, thickness, sendMessage,
       ctx.stroke();
       ctx.globalCompositeOperation = 'source-over';
 
-      // Send to other users
-      if (sendMessage) {
-        sendMessage(JSON.stringify({
-          type: WS_EVENTS.ERASER,
-          x: pos.x,
-          y: pos.y,
-          thickness: thickness * 2
-        }));
-      }
+      // Send to other users with the rest of this animation frame's points
+      queuePoint({ type: WS_EVENTS.ERASER, x: pos.x, y: pos.y, thickness: thickness * 2 });
     }
-  }, [isDrawing, getContext, getMousePos, tool, color, thickness, sendMessage]);
+  }, [isDrawing, getContext, getMousePos, tool, color, thickness, queuePoint]);
 
   // Stop drawing
   const stopDrawing = useCallback((e) => {
     if (!isDrawing) return;
+    // The stroke's last points go out now rather than on the next frame
+    flushPoints();
 
     const ctx = getContext();
     if (!ctx) return;
@@ -164,14 +191,23 @@ export const useCanvasDrawing = (canvasRef, tool, color, thickness, sendMessage,
     }
 
     setIsDrawing(false);
-  }, [isDrawing, getContext, getMousePos, tool, color, thickness, startPos, sendMessage]);
+  }, [isDrawing, getContext, getMousePos, tool, color, thickness, startPos, sendMessage, flushPoints]);
 
-  // Handle undo
+  // Handle undo; queued points go first so the stroke they belong to is the one undone
   const handleUndo = useCallback(() => {
+    flushPoints();
     if (sendMessage) {
       sendMessage(JSON.stringify({ type: WS_EVENTS.UNDO }));
     }
-  }, [sendMessage]);
+  }, [sendMessage, flushPoints]);
+
+  // Handle redo of the last undone stroke
+  const handleRedo = useCallback(() => {
+    flushPoints();
+    if (sendMessage) {
+      sendMessage(JSON.stringify({ type: WS_EVENTS.REDO }));
+    }
+  }, [sendMessage, flushPoints]);
 
   // Clear canvas
   const clearCanvas = useCallback(() => {
@@ -188,6 +224,7 @@ export const useCanvasDrawing = (canvasRef, tool, color, thickness, sendMessage,
     draw,
     stopDrawing,
     handleUndo,
+    handleRedo,
     clearCanvas
   };
 };
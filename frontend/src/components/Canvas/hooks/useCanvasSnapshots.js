@@ -7,6 +7,8 @@ import { WS_EVENTS } from '../../../constants';
  */
 export const useCanvasSnapshots = (canvasRef, roomId, username) => {
   const [snapshots, setSnapshots] = useState([]);
+  // Id to pass as `before` for the next older page, or null when everything is loaded
+  const [nextBefore, setNextBefore] = useState(null);
   const { sendMessage, lastMessage } = useContext(WebSocketContext);
 
   // Listen for snapshot updates
@@ -17,7 +19,13 @@ export const useCanvasSnapshots = (canvasRef, roomId, username) => {
       const msg = JSON.parse(lastMessage);
       
       if (msg.type === WS_EVENTS.SNAPSHOTS_HISTORY) {
-        setSnapshots(msg.snapshots || []);
+        // Older pages extend the list; the newest page replaces it
+        if (msg.before) {
+          setSnapshots(prev => [...prev, ...(msg.snapshots || [])]);
+        } else {
+          setSnapshots(msg.snapshots || []);
+        }
+        setNextBefore(msg.next_before ?? null);
       }
     } catch (error) {
       console.error('Error parsing snapshot message:', error);
@@ -33,6 +41,16 @@ export const useCanvasSnapshots = (canvasRef, roomId, username) => {
     }
   }, [sendMessage]);
 
+  // Load the next page of older snapshots
+  const loadOlderSnapshots = useCallback(() => {
+    if (sendMessage && nextBefore) {
+      sendMessage(JSON.stringify({
+        type: WS_EVENTS.GET_SNAPSHOTS,
+        before: nextBefore
+      }));
+    }
+  }, [sendMessage, nextBefore]);
+
   // Save current canvas as snapshot
   const handleSaveSnapshot = useCallback(() => {
     const canvas = canvasRef.current;
@@ -75,6 +93,8 @@ export const useCanvasSnapshots = (canvasRef, roomId, username) => {
     snapshots,
     handleSaveSnapshot,
     handleRestoreSnapshot,
-    loadSnapshots
+    loadSnapshots,
+    hasOlderSnapshots: nextBefore !== null,
+    loadOlderSnapshots
   };
 };
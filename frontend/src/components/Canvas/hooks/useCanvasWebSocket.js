@@ -1,12 +1,19 @@
-import { useEffect, useContext, useCallback } from 'react';
+import { useEffect, useContext, useCallback, useRef } from 'react';
 import { WebSocketContext } from '../../../context/WebSocketContext';
 import { WS_EVENTS } from '../../../constants';
 
+const isUndoRecord = event => event.type === WS_EVENTS.UNDO || event.type === WS_EVENTS.REDO;
+
+const emptyLog = () => ({ images: [], records: [], pending: [], dead: new Set() });
+
 /**
  * Custom hook for handling incoming WebSocket messages for canvas
  */
 export const useCanvasWebSocket = (canvasRef, roomId) => {
   const { lastMessage } = useContext(WebSocketContext);
+  // What the canvas shows, so an undo or redo from the server can be applied by redrawing:
+  // background images, history records by seq, and live stroke points not yet merged into a record
+  const logRef = useRef(emptyLog());
 
   // Get canvas context
   const getContext = useCallback(() => {
@@ -24,51 +31,78 @@ export const useCanvasWebSocket = (canvasRef, roomId) => {
 
       switch (msg.type) {
         case WS_EVENTS.INIT:
-          // Handle initial canvas state
+          // Handle initial canvas state; on a reconnect this replaces whatever is drawn
+          if (canvasRef.current) {
+            ctx.clearRect(0, 0, canvasRef.current.width, canvasRef.current.height);
+          }
+          logRef.current = emptyLog();
+          // falls through
+        case WS_EVENTS.RESYNC:
+          // A resync carries only the events missed while disconnected
           if (msg.history && Array.isArray(msg.history)) {
-            msg.history.forEach(event => {
-              const evt = JSON.parse(event);
-              drawEvent(ctx, evt);
-            });
+            // History entries are embedded as JSON objects (older servers sent strings)
+            const events = msg.history.map(event => (typeof event === 'string' ? JSON.parse(event) : event));
+            const hasBase = events[0]?.type === WS_EVENTS.BASE;
+            if (hasBase) {
+              // Compacted history starts from a rendered image of the older events
+              logRef.current.images = [{ src: events.shift().image, x: 0, y: 0 }];
+            }
+            // Undos missed while disconnected may take back strokes already drawn
+            const hasUndo = events.some(isUndoRecord);
+            events.forEach(evt => (isUndoRecord(evt) ? applyUndo(evt) : remember(evt)));
+            if (hasBase || hasUndo) {
+              redraw(ctx);
+            } else {
+              events.forEach(evt => drawEvent(ctx, evt));
+            }
           }
           break;
 
-        case WS_EVENTS.BRUSH:
-          ctx.strokeStyle = msg.color;
-          ctx.lineWidth = msg.thickness;
-          ctx.lineCap = 'round';
-          ctx.lineJoin = 'round';
-          ctx.lineTo(msg.x, msg.y);
-          ctx.stroke();
+        case WS_EVENTS.TILES:
+          // Server-rendered canvas state, sent instead of init when we asked for render=tiles
+          logRef.current = emptyLog();
+          logRef.current.images = (msg.tiles || []).map(tile => ({
+            src: tile.data,
+            x: tile.x * msg.tile_size,
+            y: tile.y * msg.tile_size
+          }));
+          redraw(ctx);
           break;
 
+        case WS_EVENTS.BRUSH:
         case WS_EVENTS.ERASER:
-          ctx.globalCompositeOperation = 'destination-out';
-          ctx.lineWidth = msg.thickness;
-          ctx.lineCap = 'round';
-          ctx.lineTo(msg.x, msg.y);
-          ctx.stroke();
-          ctx.globalCompositeOperation = 'source-over';
+        case WS_EVENTS.RECTANGLE:
+        case WS_EVENTS.ELLIPSE:
+        case WS_EVENTS.TEXT:
+          drawEvent(ctx, msg);
+          remember(msg);
           break;
 
-        case WS_EVENTS.RECTANGLE:
-          ctx.strokeStyle = msg.color;
-          ctx.lineWidth = msg.thickness;
-          ctx.strokeRect(msg.startX, msg.startY, msg.width, msg.height);
+        case WS_EVENTS.STROKES:
+          // Several points of a stroke that arrived in one binary frame
+          (msg.strokes || []).forEach(evt => {
+            drawEvent(ctx, evt);
+            remember(evt);
+          });
           break;
 
-        case WS_EVENTS.ELLIPSE:
-          ctx.strokeStyle = msg.color;
-          ctx.lineWidth = msg.thickness;
-          ctx.beginPath();
-          ctx.ellipse(msg.centerX, msg.centerY, msg.radiusX, msg.radiusY, 0, 0, 2 * Math.PI);
-          ctx.stroke();
+        case WS_EVENTS.POLYLINE:
+          // A finished stroke whose points were already drawn live; it stands in for them from now on
+          if (!commitStroke(msg)) {
+            drawEvent(ctx, msg);
+          }
           break;
 
-        case WS_EVENTS.TEXT:
-          ctx.fillStyle = msg.color;
-          ctx.font = `${msg.fontSize}px Arial`;
-          ctx.fillText(msg.text, msg.x, msg.y);
+        case WS_EVENTS.UNDO:
+        case WS_EVENTS.REDO:
+          applyUndo(msg);
+          redraw(ctx);
+          break;
+
+        case WS_EVENTS.RESTORE:
+          // Erased strokes the server left out of our init, brought back because their eraser is being undone
+          restore(msg.history || []);
+          redraw(ctx);
           break;
 
         case WS_EVENTS.CLEAR:
@@ -76,11 +110,14 @@ export const useCanvasWebSocket = (canvasRef, roomId) => {
           if (canvas) {
             ctx.clearRect(0, 0, canvas.width, canvas.height);
           }
+          logRef.current = emptyLog();
           break;
 
         case WS_EVENTS.SNAPSHOT_RESTORED:
           if (msg.snapshot_data) {
-            restoreSnapshot(ctx, msg.snapshot_data);
+            logRef.current = emptyLog();
+            logRef.current.images = [{ src: msg.snapshot_data, x: 0, y: 0 }];
+            redraw(ctx);
           }
           break;
 
@@ -92,36 +129,126 @@ export const useCanvasWebSocket = (canvasRef, roomId) => {
     }
   }, [lastMessage, getContext, canvasRef]);
 
+  // Add a drawn event to the log: history records by seq, live stroke points until their polyline arrives
+  const remember = (event) => {
+    const log = logRef.current;
+    if (event.seq !== undefined) {
+      if (event.type === WS_EVENTS.POLYLINE) {
+        commitStroke(event);
+      } else {
+        log.records.push(event);
+      }
+    } else if ((event.type === WS_EVENTS.BRUSH || event.type === WS_EVENTS.ERASER) && event.author) {
+      // Points we can't match to a polyline would be repainted forever, so only authored ones are kept
+      log.pending.push(event);
+    }
+  };
+
+  // Swap the author's live points for their finished polyline; false if none of them were seen here
+  const commitStroke = (polyline) => {
+    const log = logRef.current;
+    const before = log.pending.length;
+    log.pending = log.pending.filter(point => point.author !== polyline.author);
+    log.records.push(polyline);
+    return polyline.author !== undefined && log.pending.length < before;
+  };
+
+  // Put records we may not have back into the log in seq order, so they are drawn under later erasers
+  const restore = (events) => {
+    const log = logRef.current;
+    const known = new Set(log.records.map(evt => evt.seq));
+    events.filter(evt => !known.has(evt.seq)).forEach(evt => log.records.push(evt));
+    log.records.sort((a, b) => a.seq - b.seq);
+  };
+
+  const applyUndo = (event) => {
+    const { dead } = logRef.current;
+    if (event.type === WS_EVENTS.UNDO) {
+      dead.add(event.target);
+    } else {
+      dead.delete(event.target);
+    }
+  };
+
+  // Repaint from the log, leaving out undone records
+  const redraw = (ctx) => {
+    const canvas = canvasRef.current;
+    if (!canvas) return;
+    const log = logRef.current;
+    const paint = images => {
+      if (log !== logRef.current) return;
+      ctx.clearRect(0, 0, canvas.width, canvas.height);
+      images.forEach(({ img, x, y }) => ctx.drawImage(img, x, y));
+      log.records.filter(evt => !log.dead.has(evt.seq)).forEach(evt => drawEvent(ctx, evt));
+      ctx.beginPath();
+      log.pending.forEach(evt => drawEvent(ctx, evt));
+    };
+    // Images load asynchronously; paint once all of them are ready so records land on top
+    Promise.all(log.images.map(({ src, x, y }) => new Promise(resolve => {
+      const img = new Image();
+      img.onload = () => resolve({ img, x, y });
+      img.onerror = () => resolve(null);
+      img.src = src;
+    }))).then(images => paint(images.filter(Boolean)));
+  };
+
   // Helper function to draw an event
   const drawEvent = (ctx, event) => {
     switch (event.type) {
       case WS_EVENTS.BRUSH:
         ctx.strokeStyle = event.color;
         ctx.lineWidth = event.thickness;
+        ctx.lineCap = 'round';
+        ctx.lineJoin = 'round';
+        ctx.lineTo(event.x, event.y);
+        ctx.stroke();
+        break;
+      case WS_EVENTS.ERASER:
+        ctx.globalCompositeOperation = 'destination-out';
+        ctx.lineWidth = event.thickness;
+        ctx.lineCap = 'round';
         ctx.lineTo(event.x, event.y);
         ctx.stroke();
+        ctx.globalCompositeOperation = 'source-over';
+        break;
+      case WS_EVENTS.POLYLINE:
+        // A whole brush/eraser stroke, merged and simplified by the server
+        if (!event.points || event.points.length === 0) break;
+        ctx.save();
+        if (event.tool === WS_EVENTS.ERASER) {
+          ctx.globalCompositeOperation = 'destination-out';
+        } else {
+          ctx.strokeStyle = event.color;
+        }
+        ctx.lineWidth = event.thickness;
+        ctx.lineCap = 'round';
+        ctx.lineJoin = 'round';
+        ctx.beginPath();
+        ctx.moveTo(event.points[0][0], event.points[0][1]);
+        // A single-point stroke still draws a round dot
+        (event.points.length > 1 ? event.points.slice(1) : event.points).forEach(([x, y]) => ctx.lineTo(x, y));
+        ctx.stroke();
+        ctx.restore();
+        break;
+      case WS_EVENTS.RECTANGLE:
+        ctx.strokeStyle = event.color;
+        ctx.lineWidth = event.thickness;
+        ctx.strokeRect(event.startX, event.startY, event.width, event.height);
+        break;
+      case WS_EVENTS.ELLIPSE:
+        ctx.strokeStyle = event.color;
+        ctx.lineWidth = event.thickness;
+        ctx.beginPath();
+        ctx.ellipse(event.centerX, event.centerY, event.radiusX, event.radiusY, 0, 0, 2 * Math.PI);
+        ctx.stroke();
+        break;
+      case WS_EVENTS.TEXT:
+        ctx.fillStyle = event.color;
+        ctx.font = `${event.fontSize}px Arial`;
+        ctx.fillText(event.text, event.x, event.y);
         break;
-      // Add other event types as needed
       default:
         break;
     }
   };
-
-  // Helper function to restore snapshot
-  const restoreSnapshot = (ctx, snapshotData) => {
-    try {
-      const canvas = canvasRef.current;
-      if (!canvas) return;
-
-      ctx.clearRect(0, 0, canvas.width, canvas.height);
-      
-      const img = new Image();
-      img.onload = () => {
-        ctx.drawImage(img, 0, 0);
-      };
-      img.src = snapshotData;
-    } catch (error) {
-      console.error('Error restoring snapshot:', error);
-    }
-  };
 };
@@ -1,4 +1,4 @@
-import { useState, useEffect, useRef, useContext } from 'react';
+import { useState, useEffect, useRef, useContext, useCallback } from 'react';
 import { WebSocketContext } from '../../context/WebSocketContext';
 import { WS_EVENTS } from '../../constants';
 
@@ -10,6 +10,8 @@ export const useChatBox = (roomId, username) => {
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState('');
   const [isOpen, setIsOpen] = useState(false);
+  // Id to pass as `before` for the next older page, or null when everything is loaded
+  const [nextBefore, setNextBefore] = useState(null);
   const messagesEndRef = useRef(null);
   const { lastMessage, sendMessage } = useContext(WebSocketContext);
 
@@ -18,9 +20,11 @@ export const useChatBox = (roomId, username) => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Only new messages scroll; loading older ones keeps the view where it is
+  const newestMessage = messages[messages.length - 1];
   useEffect(() => {
     scrollToBottom();
-  }, [messages]);
+  }, [newestMessage]);
 
   // Listen to WebSocket messages for chat events
   useEffect(() => {
@@ -38,6 +42,14 @@ export const useChatBox = (roomId, username) => {
             timestamp: msg.timestamp || new Date().toISOString()
           }
         ]);
+      } else if (msg.type === WS_EVENTS.CHAT_HISTORY) {
+        // Older pages go in front; the join backlog replaces whatever was shown
+        if (msg.before) {
+          setMessages((prev) => [...(msg.messages || []), ...prev]);
+        } else {
+          setMessages(msg.messages || []);
+        }
+        setNextBefore(msg.next_before ?? null);
       }
     } catch (error) {
       console.error('Error parsing chat message:', error);
@@ -48,6 +60,16 @@ export const useChatBox = (roomId, username) => {
     setIsOpen((prev) => !prev);
   };
 
+  // Load the next page of older messages
+  const loadOlderMessages = useCallback(() => {
+    if (sendMessage && nextBefore) {
+      sendMessage(JSON.stringify({
+        type: WS_EVENTS.GET_CHAT_HISTORY,
+        before: nextBefore
+      }));
+    }
+  }, [sendMessage, nextBefore]);
+
   const handleSendMessage = (e) => {
     e.preventDefault();
     
@@ -71,6 +93,8 @@ export const useChatBox = (roomId, username) => {
     isOpen,
     toggleChat,
     handleSendMessage,
-    messagesEndRef
+    messagesEndRef,
+    hasOlderMessages: nextBefore !== null,
+    loadOlderMessages
   };
 };
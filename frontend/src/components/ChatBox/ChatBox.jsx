@@ -10,7 +10,9 @@ const ChatBox = ({ roomId, username }) => {
     isOpen,
     toggleChat,
     handleSendMessage,
-    messagesEndRef
+    messagesEndRef,
+    hasOlderMessages,
+    loadOlderMessages
   } = useChatBox(roomId, username);
 
   return (
@@ -23,6 +25,11 @@ const ChatBox = ({ roomId, username }) => {
       {isOpen && (
         <div className="chatbox-body">
           <div className="chatbox-messages">
+            {hasOlderMessages && (
+              <button type="button" className="chatbox-older-btn" onClick={loadOlderMessages}>
+                Older messages…
+              </button>
+            )}
             {messages.length === 0 ? (
               <div className="chatbox-empty">No messages yet. Start chatting!</div>
             ) : (
@@ -31,17 +31,26 @@ export const CURSORS = {
 // WebSocket Events
 export const WS_EVENTS = {
   INIT: 'init',
+  RESYNC: 'resync',
+  TILES: 'tiles',
+  BASE: 'base',
   DRAW: 'draw',
   BRUSH: 'brush',
   ERASER: 'eraser',
+  POLYLINE: 'polyline',
+  STROKES: 'strokes', // Client-side only: the points of one binary stroke frame, handed on together
   RECTANGLE: 'rectangle',
   ELLIPSE: 'ellipse',
   TEXT: 'text',
   UNDO: 'undo',
+  REDO: 'redo',
+  RESTORE: 'restore',
   CLEAR: 'clear',
   CURSOR: 'cursor',
   USER_LEFT: 'user_left',
   CHAT: 'chat',
+  GET_CHAT_HISTORY: 'get_chat_history',
+  CHAT_HISTORY: 'chat_history',
   SAVE_SNAPSHOT: 'save_snapshot',
   RESTORE_SNAPSHOT: 'restore_snapshot',
   GET_SNAPSHOTS: 'get_snapshots',
@@ -1,8 +1,14 @@
 import React, { createContext, useEffect, useRef, useState, useCallback } from "react";
+import { decodeStroke } from "../utils/strokeCodec";
+import { createFragmentAssembler, isFragment } from "../utils/frameFragments";
+import { WS_EVENTS } from "../constants";
 
 // Context for sharing websocket state and actions across the app
 export const WebSocketContext = createContext(null);
 
+// History frames end with the room's seq; matched without parsing the whole message
+const SEQ_PATTERN = /"seq":(\d+)\}$/;
+
 // Helper to get JWT token from localStorage
 function getToken() {
   return localStorage.getItem("token");
@@ -55,6 +61,8 @@ export const WebSocketProvider = ({ roomId, children }) => {
   const reconnectTimeoutRef = useRef(null);
   const reconnectAttemptsRef = useRef(0);
   const messageQueueRef = useRef(new MessageQueue());
+  const shardUrlRef = useRef(null); // Set when the server redirects us to the room's shard
+  const lastSeqRef = useRef(null); // Latest history seq seen, sent as ?since= on reconnect
   const maxReconnectAttempts = 5;
   const baseReconnectDelay = 2000; // 2 seconds base delay
 
@@ -82,9 +90,11 @@ export const WebSocketProvider = ({ roomId, children }) => {
     }
   }, []);
 
-  // Send a message; queue if socket is not open
+  // Send a message (text, or an ArrayBuffer binary frame); queue if socket is not open
   const sendMessage = useCallback((message) => {
-    const msgString = typeof message === 'string' ? message : JSON.stringify(message);
+    const msgString = (typeof message === 'string' || message instanceof ArrayBuffer)
+      ? message
+      : JSON.stringify(message);
     if (wsRef.current?.readyState === WebSocket.OPEN) {
       try {
         wsRef.current.send(msgString);
@@ -114,12 +124,18 @@ export const WebSocketProvider = ({ roomId, children }) => {
 
     // Dynamically determine WebSocket URL based on environment
     const getWebSocketUrl = () => {
+      // Full joins get the server-rendered canvas as tiles; on reconnect, ask only for the history we missed
+      const since = lastSeqRef.current !== null ? `&since=${lastSeqRef.current}` : '';
+      const query = `token=${token}&protocol=binary&render=tiles${since}`;
+      if (shardUrlRef.current) {
+        return `${shardUrlRef.current}/ws/${roomId}?${query}`;
+      }
       const apiUrl = process.env.REACT_APP_API_URL || 'http://localhost:8000';
       
       const wsProtocol = apiUrl.startsWith('https') ? 'wss' : 'ws';
       const baseUrl = apiUrl.replace(/^https?:\/\//, '');
       
-      return `${wsProtocol}://${baseUrl}/ws/${roomId}?token=${token}`;
+      return `${wsProtocol}://${baseUrl}/ws/${roomId}?${query}`;
     };
 
     const wsUrl = getWebSocketUrl();
@@ -127,6 +143,8 @@ export const WebSocketProvider = ({ roomId, children }) => {
 
     try {
       const socket = new WebSocket(wsUrl);
+      socket.binaryType = 'arraybuffer'; // protocol=binary: strokes arrive as compact binary frames
+      const assembleFragment = createFragmentAssembler();
       wsRef.current = socket;
       setWsStatus("connecting");
 
@@ -139,6 +157,28 @@ export const WebSocketProvider = ({ roomId, children }) => {
 
       // Centralized message handler - updates lastMessage state
       socket.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer && isFragment(event.data)) {
+          // Large frames (e.g. restored snapshots) arrive in pieces
+          const frame = assembleFragment(event.data);
+          if (frame !== null) setLastMessage(frame);
+          return;
+        }
+        if (event.data instanceof ArrayBuffer) {
+          // Hand binary strokes to consumers in the same JSON form as text frames; a frame's points go
+          // together, since state updates made in one handler are batched and only the last would be seen
+          const strokes = decodeStroke(event.data);
+          if (strokes.length === 0) return;
+          const last = strokes[strokes.length - 1];
+          if (last.seq !== undefined) {
+            lastSeqRef.current = last.seq;
+          }
+          setLastMessage(JSON.stringify(strokes.length === 1 ? last : { type: WS_EVENTS.STROKES, strokes }));
+          return;
+        }
+        const seqMatch = SEQ_PATTERN.exec(event.data);
+        if (seqMatch) {
+          lastSeqRef.current = Number(seqMatch[1]);
+        }
         setLastMessage(event.data);
       };
 
@@ -147,6 +187,12 @@ export const WebSocketProvider = ({ roomId, children }) => {
         setWsStatus("disconnected");
         wsRef.current = null;
 
+        // 4009: this room is served by another shard; the reason carries its URL
+        if (event.code === 4009 && event.reason && shardUrlRef.current !== event.reason) {
+          shardUrlRef.current = event.reason;
+          connect();
+          return;
+        }
         
         if (reconnectAttemptsRef.current < maxReconnectAttempts) {
           const delay = getReconnectDelay(reconnectAttemptsRef.current);
@@ -204,6 +250,8 @@ export const WebSocketProvider = ({ roomId, children }) => {
         wsRef.current.close();
       }
       wsRef.current = null;
+      shardUrlRef.current = null;
+      lastSeqRef.current = null;
       setWsStatus("disconnected");
     };
   }, [connect]);
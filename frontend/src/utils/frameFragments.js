@@ -0,0 +1,45 @@
+// frameFragments - reassembles large server frames sent as binary fragments (mirrors backend/app/websocket/codec.py)
+// Layout (little-endian): u8 marker | u8 flags | u32 transfer id | u32 fragment index, then a slice of the UTF-8 frame
+
+const FRAGMENT_MARKER = 0xf0;
+const HEADER_SIZE = 10;
+const FLAG_FINAL = 0x01;
+const FLAG_ABORT = 0x02;
+
+export const isFragment = (buffer) =>
+  buffer.byteLength >= HEADER_SIZE && new DataView(buffer).getUint8(0) === FRAGMENT_MARKER;
+
+// Returns a push(buffer) function that yields the frame text once its final fragment arrives, else null
+export const createFragmentAssembler = () => {
+  const transfers = new Map();
+  const decoder = new TextDecoder();
+
+  return (buffer) => {
+    const view = new DataView(buffer);
+    const flags = view.getUint8(1);
+    const id = view.getUint32(2, true);
+    const index = view.getUint32(6, true);
+
+    const parts = transfers.get(id) || [];
+    if (index !== parts.length) {
+      // Missed the start of this transfer (e.g. joined mid-stream); nothing usable
+      transfers.delete(id);
+      return null;
+    }
+    parts.push(new Uint8Array(buffer, HEADER_SIZE));
+    if (!(flags & FLAG_FINAL)) {
+      transfers.set(id, parts);
+      return null;
+    }
+
+    transfers.delete(id);
+    if (flags & FLAG_ABORT) return null;
+    const frame = new Uint8Array(parts.reduce((size, part) => size + part.byteLength, 0));
+    let offset = 0;
+    parts.forEach(part => {
+      frame.set(part, offset);
+      offset += part.byteLength;
+    });
+    return decoder.decode(frame);
+  };
+};
@@ -0,0 +1,117 @@
+// strokeCodec - compact binary frames for brush/eraser points (mirrors backend/app/websocket/codec.py)
+// Layout (little-endian): u8 version | u8 type | u8 r | u8 g | u8 b | u8 flags | u16 thickness x10 | u16 count
+// followed by the first point as int16 x, y and int16 dx, dy deltas for the rest,
+// then, if flagged, the u32 history seq of the first point (the rest follow it one by one)
+// and, if flagged, u8 length and the UTF-8 username of the author
+
+const VERSION = 1;
+const HEADER_SIZE = 10;
+const TYPE_CODES = { brush: 1, eraser: 2 };
+const TYPE_NAMES = { 1: 'brush', 2: 'eraser' };
+const FLAG_HAS_COLOR = 0x01;
+const FLAG_HAS_AUTHOR = 0x02;
+const FLAG_HAS_SEQ = 0x04;
+const SEQ_SIZE = 4;
+const COORD_LIMIT = 16383;
+
+const parseColor = (color) => {
+  if (typeof color !== 'string' || !color.startsWith('#')) return null;
+  let hex = color.slice(1);
+  if (hex.length === 3) hex = hex.split('').map(digit => digit + digit).join('');
+  if (!/^[0-9a-fA-F]{6}$/.test(hex)) return null;
+  const value = parseInt(hex, 16);
+  return [(value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff];
+};
+
+// Encode a single-style list of stroke events; returns null if they can't be represented
+export const encodeStroke = (events) => {
+  const first = events[0];
+  const typeCode = first && TYPE_CODES[first.type];
+  if (!typeCode) return null;
+
+  const hasColor = first.color !== undefined && first.color !== null;
+  const rgb = hasColor ? parseColor(first.color) : [0, 0, 0];
+  if (!rgb) return null;
+
+  const thickness = Math.round((first.thickness || 0) * 10);
+  if (thickness > 0xffff || events.length > 0xffff) return null;
+
+  const author = first.author !== undefined && first.author !== null ? new TextEncoder().encode(first.author) : null;
+  if (author && author.length > 0xff) return null;
+  if (events.some(event => event.author !== first.author)) return null;
+
+  // Points recorded as history events carry consecutive seqs, so only the first is sent
+  const hasSeq = first.seq !== undefined && first.seq !== null;
+  if (hasSeq && !(Number.isInteger(first.seq) && first.seq >= 0 && first.seq + events.length <= 0xffffffff)) return null;
+  if (events.some((event, i) => (hasSeq ? event.seq !== first.seq + i : event.seq !== undefined && event.seq !== null))) return null;
+
+  const pointsEnd = HEADER_SIZE + events.length * 4;
+  const authorStart = pointsEnd + (hasSeq ? SEQ_SIZE : 0);
+  const buffer = new ArrayBuffer(authorStart + (author ? author.length + 1 : 0));
+  const view = new DataView(buffer);
+  view.setUint8(0, VERSION);
+  view.setUint8(1, typeCode);
+  view.setUint8(2, rgb[0]);
+  view.setUint8(3, rgb[1]);
+  view.setUint8(4, rgb[2]);
+  view.setUint8(5, (hasColor ? FLAG_HAS_COLOR : 0) | (author ? FLAG_HAS_AUTHOR : 0) | (hasSeq ? FLAG_HAS_SEQ : 0));
+  view.setUint16(6, thickness, true);
+  view.setUint16(8, events.length, true);
+
+  let prevX = 0;
+  let prevY = 0;
+  for (let i = 0; i < events.length; i++) {
+    const x = Math.round(events[i].x);
+    const y = Math.round(events[i].y);
+    if (Math.abs(x) > COORD_LIMIT || Math.abs(y) > COORD_LIMIT) return null;
+    view.setInt16(HEADER_SIZE + i * 4, x - prevX, true);
+    view.setInt16(HEADER_SIZE + i * 4 + 2, y - prevY, true);
+    prevX = x;
+    prevY = y;
+  }
+  if (hasSeq) {
+    view.setUint32(pointsEnd, first.seq, true);
+  }
+  if (author) {
+    view.setUint8(authorStart, author.length);
+    new Uint8Array(buffer, authorStart + 1).set(author);
+  }
+  return buffer;
+};
+
+// Decode a binary stroke frame into the equivalent per-point JSON events
+export const decodeStroke = (buffer) => {
+  const view = new DataView(buffer);
+  if (buffer.byteLength < HEADER_SIZE || view.getUint8(0) !== VERSION) return [];
+
+  const type = TYPE_NAMES[view.getUint8(1)];
+  const count = view.getUint16(8, true);
+  const flags = view.getUint8(5);
+  const pointsEnd = HEADER_SIZE + count * 4;
+  if (!type || buffer.byteLength < pointsEnd) return [];
+
+  const style = { thickness: view.getUint16(6, true) / 10 };
+  if (flags & FLAG_HAS_COLOR) {
+    style.color = '#' + [2, 3, 4].map(i => view.getUint8(i).toString(16).padStart(2, '0')).join('');
+  }
+  const hasSeq = (flags & FLAG_HAS_SEQ) !== 0;
+  const authorStart = pointsEnd + (hasSeq ? SEQ_SIZE : 0);
+  if (buffer.byteLength < authorStart) return [];
+  const seq = hasSeq ? view.getUint32(pointsEnd, true) : null;
+  if (flags & FLAG_HAS_AUTHOR) {
+    if (buffer.byteLength < authorStart + 1 || buffer.byteLength !== authorStart + 1 + view.getUint8(authorStart)) return [];
+    style.author = new TextDecoder().decode(new Uint8Array(buffer, authorStart + 1));
+  } else if (buffer.byteLength !== authorStart) {
+    return [];
+  }
+
+  const events = [];
+  let x = 0;
+  let y = 0;
+  for (let i = 0; i < count; i++) {
+    x += view.getInt16(HEADER_SIZE + i * 4, true);
+    y += view.getInt16(HEADER_SIZE + i * 4 + 2, true);
+    events.push(hasSeq ? { type, x, y, ...style, seq: seq + i } : { type, x, y, ...style });
+  }
+  return events;
+};